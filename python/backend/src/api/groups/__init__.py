@@ -2,9 +2,15 @@ from fastapi import APIRouter
 
 from .last_updated import get_last_updated
 from .member_intersection import (
+    list_member_intersection_members,
     request_member_intersection,
+    stream_member_intersection_members,
+    stream_member_intersection_request,
     view_member_intersection_request,
 )
+from .member_sets import evaluate_member_set
+from .overlap_estimate import estimate_overlap
+from .overlap_matrix import get_overlap_matrix
 from .reach_prediction import predict_reach
 
 
@@ -21,6 +27,38 @@ def build_router() -> APIRouter:
         path="/member-intersection/{request_id}",
         endpoint=view_member_intersection_request,
     )
+    r.add_api_route(
+        methods=["GET"],
+        path="/member-intersection/{request_id}/events",
+        endpoint=stream_member_intersection_request,
+    )
+    r.add_api_route(
+        methods=["GET"],
+        path="/member-intersection/{request_id}/members",
+        endpoint=list_member_intersection_members,
+    )
+    r.add_api_route(
+        methods=["GET"],
+        path="/member-intersection/{request_id}/members.ndjson",
+        endpoint=stream_member_intersection_members,
+    )
+
+    r.add_api_route(
+        methods=["POST"],
+        path="/member-sets",
+        endpoint=evaluate_member_set,
+    )
+
+    r.add_api_route(
+        methods=["POST"],
+        path="/overlap-estimate",
+        endpoint=estimate_overlap,
+    )
+    r.add_api_route(
+        methods=["POST"],
+        path="/overlap-matrix",
+        endpoint=get_overlap_matrix,
+    )
 
     r.add_api_route(
         methods=["GET"],
@@ -0,0 +1,105 @@
+from collections.abc import Sequence
+from datetime import datetime
+from typing import Literal
+
+import asyncpg
+import postgres
+import vk
+from pydantic import BaseModel, Field
+from utils import utc_now
+from vk_extra import VkGroupUrl
+
+# --------------------------------------------------------------------------------------------------
+
+
+class GroupFreshnessRequest(BaseModel):
+    url: VkGroupUrl
+    freshness: Literal["FRESH", "STALE"]
+    # NB: With "FRESH", members refreshed at most this long ago are reused as is.
+    max_age_n_seconds: int | None = Field(default=None, ge=0)
+
+
+class ReusedGroupSnapshot(BaseModel):
+    group_id: int
+    last_updated_at: datetime
+    age_n_seconds: float
+
+
+class GroupRefreshPlan(BaseModel):
+    group_ids_to_update: list[int]
+    reused_snapshots: list[ReusedGroupSnapshot]
+
+
+async def plan_group_refreshes(
+    pg_pool: asyncpg.Pool,
+    *,
+    requested_groups: Sequence[GroupFreshnessRequest],
+    groups: list[vk.groups.GroupById],
+) -> GroupRefreshPlan:
+    stored_groups = await postgres.vk_groups.list_by_ids(
+        pg_pool,
+        group_ids=[group.id for group in groups],
+    )
+    last_updated_at_by_id = {group.id: group.last_updated_at for group in stored_groups}
+    now = utc_now()
+
+    group_ids_to_update: list[int] = []
+    reused_snapshots: list[ReusedGroupSnapshot] = []
+
+    for group in groups:
+        requested_group = _find_requested_group(requested_groups, group)
+        if requested_group and requested_group.freshness == "STALE":
+            continue
+
+        last_updated_at = last_updated_at_by_id.get(group.id)
+        max_age_n_seconds = (
+            requested_group.max_age_n_seconds if requested_group else None
+        )
+        if last_updated_at and max_age_n_seconds is not None:
+            age_n_seconds = (now - last_updated_at).total_seconds()
+            if age_n_seconds <= max_age_n_seconds:
+                reused_snapshots.append(
+                    ReusedGroupSnapshot(
+                        group_id=group.id,
+                        last_updated_at=last_updated_at,
+                        age_n_seconds=age_n_seconds,
+                    )
+                )
+                continue
+
+        group_ids_to_update.append(group.id)
+
+    return GroupRefreshPlan(
+        group_ids_to_update=group_ids_to_update,
+        reused_snapshots=reused_snapshots,
+    )
+
+
+# Groups whose members were never fetched, in the order of `group_ids`.
+async def list_not_updated_group_ids(
+    pg_pool: asyncpg.Pool,
+    group_ids: list[int],
+) -> list[int]:
+    groups = await postgres.vk_groups.list_by_ids(pg_pool, group_ids=group_ids)
+    updated_group_ids = {group.id for group in groups if group.last_updated_at}
+    return [group_id for group_id in group_ids if group_id not in updated_group_ids]
+
+
+# NB:
+#   VK resolves URLs into groups in its own order, and a URL may use the numeric form
+#   (e.g. `club123`) instead of the screen name. Unmatched groups are refreshed.
+def _find_requested_group(
+    requested_groups: Sequence[GroupFreshnessRequest],
+    group: vk.groups.GroupById,
+) -> GroupFreshnessRequest | None:
+    names = {
+        group.screen_name,
+        f"club{group.id}",
+        f"public{group.id}",
+        f"event{group.id}",
+    }
+    for requested_group in requested_groups:
+        if requested_group.url.screen_name in names:
+            return requested_group
+
+    return None
@@ -1,20 +1,29 @@
 import asyncio
+from collections.abc import AsyncGenerator
+from contextlib import aclosing
+from datetime import datetime
 from typing import Annotated, Literal
 from uuid import UUID, uuid4
 
+import numpy as np
 import postgres
 import structlog
 import vk
 from asyncpg.connection import asyncpg
-from fastapi import HTTPException
+from fastapi import HTTPException, Query
+from fastapi.responses import StreamingResponse
 from job import JobInfo, JobStatus
-from pydantic import BaseModel, Field, TypeAdapter
+from pydantic import BaseModel, Field
 from vk.errors import TransientError, with_transient_error_retry
 from vk.groups.get_by_id import GetByIdRequest
-from vk_extra import VkGroupUrl
+from vk.retry import INTERACTIVE_RETRY_POLICY
 
 from api.auth.cookie import AuthCookieValueExtractor
-from api.state import ApiStateExtractor
+from api.job_events import format_sse_event, watch_jobs, with_sse_keepalive
+from api.state import ApiState, ApiStateExtractor
+
+from .freshness import GroupFreshnessRequest, ReusedGroupSnapshot, plan_group_refreshes
+from .overlap_estimate import estimate_num_intersection_members
 
 log = structlog.stdlib.get_logger()
 
@@ -24,9 +33,8 @@ MIN_NUM_GROUPS = 2
 MAX_NUM_GROUPS = 10
 
 
-class GroupToIntersect(BaseModel):
-    url: VkGroupUrl
-    freshness: Literal["FRESH", "STALE"]
+class GroupToIntersect(GroupFreshnessRequest):
+    pass
 
 
 class GroupsMemberIntersectionRequest(BaseModel):
@@ -58,6 +66,10 @@ class GroupsMemberIntersectionDuplicateGroups(BaseModel):
 class GroupsMemberIntersectionInfo(BaseModel):
     type: Literal["INFO"]
     request_id: UUID
+    # NB: Groups requested as "FRESH", but recent enough to skip the refresh.
+    reused_snapshots: list[ReusedGroupSnapshot]
+    # NB: From the members fetched before, `None` if some groups were never fetched.
+    estimated_num_intersection_members: int | None = None
 
 
 class UserMissingAccessToken(BaseModel):
@@ -109,7 +121,10 @@ async def request_member_intersection(
         )
 
     log.info("Getting groups by screen names...")
-    response = await with_transient_error_retry(get_groups_by_screen_names)
+    response = await with_transient_error_retry(
+        get_groups_by_screen_names,
+        policy=INTERACTIVE_RETRY_POLICY,
+    )
     if len(group_screen_names) != len(response.groups):
         log.debug(
             "Missing groups after resolving screen names",
@@ -135,18 +150,31 @@ async def request_member_intersection(
     log.info("Upserting groups...")
     await postgres.vk_groups.upsert_only_vk_data(state.pg_pool, groups=response.groups)
 
+    estimated_num_intersection_members = await estimate_num_intersection_members(
+        state,
+        [group.id for group in response.groups],
+    )
+    log.info(
+        "Estimated intersection size",
+        estimated_num_intersection_members=estimated_num_intersection_members,
+    )
+
     intersection_request_id = uuid4()
-    group_ids_to_update = [
-        group.id
-        for group, g in zip(response.groups, request.groups)
-        if g.freshness == "FRESH"
-    ]
-    log.info("Inserting group update jobs...", group_ids=group_ids_to_update)
+    refresh_plan = await plan_group_refreshes(
+        state.pg_pool,
+        requested_groups=request.groups,
+        groups=response.groups,
+    )
+    log.info(
+        "Inserting group update jobs...",
+        group_ids=refresh_plan.group_ids_to_update,
+        reused_snapshots=refresh_plan.reused_snapshots,
+    )
     job_ids = await postgres.group_update_jobs.insert_many(
         state.pg_pool,
         request_id=intersection_request_id,
         user_id=auth.user_id,
-        group_ids=group_ids_to_update,
+        group_ids=refresh_plan.group_ids_to_update,
     )
 
     log.info(
@@ -165,6 +193,8 @@ async def request_member_intersection(
     return GroupsMemberIntersectionInfo(
         type="INFO",
         request_id=intersection_request_id,
+        reused_snapshots=refresh_plan.reused_snapshots,
+        estimated_num_intersection_members=estimated_num_intersection_members,
     )
 
 
@@ -201,6 +231,7 @@ class GroupsViewMemberIntersectionResponse(BaseModel):
         screen_name: str
         members_count: int
         photo_url: str | None = None
+        last_updated_at: datetime | None = None
 
     class GroupUpdateJob(BaseModel):
         group_id: int
@@ -209,30 +240,96 @@ class GroupsViewMemberIntersectionResponse(BaseModel):
 
     groups: list[Group]
     update_jobs: list[GroupUpdateJob]
+    num_intersection_members: int
+    # NB: See `list_member_intersection_members` for large intersections.
     intersection_member_ids: list[int]
 
 
+class GroupsMemberIntersectionProgress(BaseModel):
+    update_jobs: list[GroupsViewMemberIntersectionResponse.GroupUpdateJob]
+
+
 async def view_member_intersection_request(
     state: ApiStateExtractor,
     _auth: AuthCookieValueExtractor,
     request_id: UUID,
 ) -> GroupsViewMemberIntersectionResponse:
-    request = await postgres.group_member_intersection_requests.select_by_id(
+    request = await _select_request(state.pg_pool, request_id=request_id)
+
+    update_jobs = await postgres.group_update_jobs.list_by_ids(
         state.pg_pool,
+        job_ids=request.update_job_ids,
+    )
+    update_jobs.sort(key=lambda j: j.created_at)
+
+    return await _build_view_response(state, request, update_jobs)
+
+
+# Streams `progress` events while the update jobs run and a single `completed` event
+# with the same payload as `view_member_intersection_request` once they are done.
+async def stream_member_intersection_request(
+    state: ApiStateExtractor,
+    _auth: AuthCookieValueExtractor,
+    request_id: UUID,
+) -> StreamingResponse:
+    request = await _select_request(state.pg_pool, request_id=request_id)
+
+    async def events() -> AsyncGenerator[str, None]:
+        watched_jobs = watch_jobs(state.job_events, job_ids=request.update_job_ids)
+        # NB: Unsubscribes even if the client disconnects mid-stream.
+        async with aclosing(watched_jobs):
+            async for update_jobs in watched_jobs:
+                if all(job.status.is_completed() for job in update_jobs):
+                    response = await _build_view_response(state, request, update_jobs)
+                    yield format_sse_event("completed", response)
+                    return
+
+                progress = GroupsMemberIntersectionProgress(
+                    update_jobs=_build_response_update_jobs(update_jobs),
+                )
+                yield format_sse_event("progress", progress)
+
+    return StreamingResponse(
+        with_sse_keepalive(events()),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+async def _select_request(
+    pg_pool: asyncpg.Pool,
+    *,
+    request_id: UUID,
+) -> postgres.group_member_intersection_requests.IntersectionRequest:
+    request = await postgres.group_member_intersection_requests.select_by_id(
+        pg_pool,
         request_id=request_id,
     )
     if not request:
         raise HTTPException(status_code=404, detail="Request not found")
 
-    groups, update_jobs, intersection_member_ids = await asyncio.gather(
-        postgres.vk_groups.list_by_ids(state.pg_pool, group_ids=request.group_ids),
-        postgres.group_update_jobs.list_by_ids(
-            state.pg_pool, job_ids=request.update_job_ids
-        ),
-        _list_intersection_member_ids(state.pg_pool, group_ids=request.group_ids),
-    )
+    return request
+
+
+async def _build_view_response(
+    state: ApiState,
+    request: postgres.group_member_intersection_requests.IntersectionRequest,
+    update_jobs: list[postgres.group_update_jobs.GroupUpdateJob],
+) -> GroupsViewMemberIntersectionResponse:
+    # NB: The intersection is the heavy part, and it's incomplete until the jobs are done.
+    has_uncompleted_jobs = any(not job.status.is_completed() for job in update_jobs)
+    if has_uncompleted_jobs:
+        groups = await postgres.vk_groups.list_by_ids(
+            state.pg_pool,
+            group_ids=request.group_ids,
+        )
+        intersection_member_ids = np.empty(0, dtype=np.uint32)
+    else:
+        groups, intersection_member_ids = await asyncio.gather(
+            postgres.vk_groups.list_by_ids(state.pg_pool, group_ids=request.group_ids),
+            state.memberships.intersect(request.group_ids),
+        )
     groups.sort(key=lambda g: g.name.lower())
-    update_jobs.sort(key=lambda j: j.created_at)
 
     response_groups = [
         GroupsViewMemberIntersectionResponse.Group(
@@ -241,10 +338,22 @@ async def view_member_intersection_request(
             screen_name=group.screen_name,
             members_count=group.members_count,
             photo_url=group.photo_200 or group.photo_100 or group.photo_50,
+            last_updated_at=group.last_updated_at,
         )
         for group in groups
     ]
-    response_update_jobs = [
+    return GroupsViewMemberIntersectionResponse(
+        groups=response_groups,
+        update_jobs=_build_response_update_jobs(update_jobs),
+        num_intersection_members=len(intersection_member_ids),
+        intersection_member_ids=intersection_member_ids.tolist(),
+    )
+
+
+def _build_response_update_jobs(
+    update_jobs: list[postgres.group_update_jobs.GroupUpdateJob],
+) -> list[GroupsViewMemberIntersectionResponse.GroupUpdateJob]:
+    return [
         GroupsViewMemberIntersectionResponse.GroupUpdateJob(
             group_id=job.group_id,
             status=job.status,
@@ -252,35 +361,94 @@ async def view_member_intersection_request(
         )
         for job in update_jobs
     ]
-    return GroupsViewMemberIntersectionResponse(
-        groups=response_groups,
-        update_jobs=response_update_jobs,
-        intersection_member_ids=intersection_member_ids,
+
+
+# --------------------------------------------------------------------------------------------------
+
+MEMBERS_PAGE_DEFAULT_LIMIT = 1_000
+MEMBERS_PAGE_MAX_LIMIT = 10_000
+
+# NB: Small enough to keep memory per stream bounded, large enough to keep the overhead low.
+MEMBERS_STREAM_CHUNK_SIZE = 10_000
+
+
+class GroupsMemberIntersectionMembersPage(BaseModel):
+    member_ids: list[int]
+    # NB: Pass as `after` to get the next page, `None` on the last page.
+    next_cursor: int | None
+
+
+# Keyset pagination over the intersection, which is sorted by user id.
+async def list_member_intersection_members(
+    state: ApiStateExtractor,
+    _auth: AuthCookieValueExtractor,
+    request_id: UUID,
+    after: int | None = None,
+    limit: Annotated[
+        int,
+        Query(ge=1, le=MEMBERS_PAGE_MAX_LIMIT),
+    ] = MEMBERS_PAGE_DEFAULT_LIMIT,
+) -> GroupsMemberIntersectionMembersPage:
+    request = await _select_completed_request(state, request_id=request_id)
+
+    intersection_member_ids = await state.memberships.intersect(request.group_ids)
+    start = _find_members_start(intersection_member_ids, after=after)
+    end = start + limit
+
+    page = intersection_member_ids[start:end]
+    is_last_page = end >= len(intersection_member_ids)
+
+    return GroupsMemberIntersectionMembersPage(
+        member_ids=page.tolist(),
+        next_cursor=None if is_last_page else int(page[-1]),
     )
 
 
-async def _list_intersection_member_ids(
-    pg_pool: asyncpg.Pool,
+# Streams the intersection as NDJSON, one user id per line, starting after `after`.
+async def stream_member_intersection_members(
+    state: ApiStateExtractor,
+    _auth: AuthCookieValueExtractor,
+    request_id: UUID,
+    after: int | None = None,
+) -> StreamingResponse:
+    # NB: Errors can't be reported once streaming has started.
+    request = await _select_completed_request(state, request_id=request_id)
+
+    # NB: The headers go out before the first chunk, so the client hears back right away.
+    async def lines() -> AsyncGenerator[str, None]:
+        intersection_member_ids = await state.memberships.intersect(request.group_ids)
+        start = _find_members_start(intersection_member_ids, after=after)
+
+        for i in range(start, len(intersection_member_ids), MEMBERS_STREAM_CHUNK_SIZE):
+            chunk = intersection_member_ids[i : i + MEMBERS_STREAM_CHUNK_SIZE]
+            yield "".join(f"{member_id}\n" for member_id in chunk.tolist())
+
+    return StreamingResponse(
+        lines(),
+        media_type="application/x-ndjson",
+        headers={"X-Accel-Buffering": "no"},
+    )
+
+
+async def _select_completed_request(
+    state: ApiState,
     *,
-    group_ids: list[int],
-) -> list[int]:
-    async with pg_pool.acquire() as conn:
-        rows = await conn.fetch(
-            """
-                WITH users_with_group_counts AS (
-                    SELECT user_id
-                         , COUNT(DISTINCT group_id) AS group_count
-                    FROM vk_group_members
-                    WHERE group_id = ANY($1)
-                    GROUP BY user_id
-                )
+    request_id: UUID,
+) -> postgres.group_member_intersection_requests.IntersectionRequest:
+    request = await _select_request(state.pg_pool, request_id=request_id)
 
-                SELECT user_id
-                FROM users_with_group_counts
-                WHERE group_count = $2
-            """,
-            group_ids,
-            len(group_ids),
-        )
+    update_jobs = await postgres.group_update_jobs.list_by_ids(
+        state.pg_pool,
+        job_ids=request.update_job_ids,
+    )
+    if any(not job.status.is_completed() for job in update_jobs):
+        raise HTTPException(status_code=409, detail="Update jobs are not completed")
+
+    return request
+
+
+def _find_members_start(member_ids: np.ndarray, *, after: int | None) -> int:
+    if after is None:
+        return 0
 
-    return TypeAdapter(list[int]).validate_python([row["user_id"] for row in rows])
+    return int(np.searchsorted(member_ids, after, side="right"))
@@ -0,0 +1,108 @@
+from typing import Annotated, Literal
+
+import numpy as np
+import structlog
+from memberships import SetExpression, set_expression
+from pydantic import BaseModel, Field
+
+from api.auth.cookie import AuthCookieValueExtractor
+from api.state import ApiStateExtractor
+
+from .freshness import list_not_updated_group_ids
+
+log = structlog.stdlib.get_logger()
+
+# --------------------------------------------------------------------------------------------------
+
+MAX_NUM_GROUPS = 32
+MAX_NUM_EXPRESSION_NODES = 128
+
+MEMBERS_PAGE_DEFAULT_LIMIT = 1_000
+MEMBERS_PAGE_MAX_LIMIT = 10_000
+
+
+class GroupsMemberSetRequest(BaseModel):
+    expression: SetExpression
+    # NB: Keyset pagination over the result, which is sorted by user id.
+    after: int | None = None
+    limit: int = Field(
+        default=MEMBERS_PAGE_DEFAULT_LIMIT,
+        ge=1,
+        le=MEMBERS_PAGE_MAX_LIMIT,
+    )
+
+
+class GroupsMemberSetPage(BaseModel):
+    type: Literal["PAGE"]
+    num_members: int
+    member_ids: list[int]
+    # NB: Pass as `after` to get the next page, `None` on the last page.
+    next_cursor: int | None
+
+
+class GroupsMemberSetReachedLimits(BaseModel):
+    type: Literal["REACHED_LIMITS"]
+    max_num_groups: int
+    max_num_expression_nodes: int
+
+
+class GroupsMemberSetNotUpdatedGroups(BaseModel):
+    type: Literal["NOT_UPDATED_GROUPS"]
+    # NB: Groups whose members were never fetched, request an intersection with them first.
+    group_ids: list[int]
+
+
+GroupsMemberSetResult = Annotated[
+    GroupsMemberSetPage
+    | GroupsMemberSetReachedLimits
+    | GroupsMemberSetNotUpdatedGroups,
+    Field(..., discriminator="type"),
+]
+
+
+# Evaluates a set expression, e.g. union, difference or "at least k of n",
+# over members of already updated groups.
+async def evaluate_member_set(
+    state: ApiStateExtractor,
+    _auth: AuthCookieValueExtractor,
+    request: GroupsMemberSetRequest,
+) -> GroupsMemberSetResult:
+    group_ids = set_expression.list_group_ids(request.expression)
+    if (
+        len(group_ids) > MAX_NUM_GROUPS
+        or set_expression.count_nodes(request.expression) > MAX_NUM_EXPRESSION_NODES
+    ):
+        return GroupsMemberSetReachedLimits(
+            type="REACHED_LIMITS",
+            max_num_groups=MAX_NUM_GROUPS,
+            max_num_expression_nodes=MAX_NUM_EXPRESSION_NODES,
+        )
+
+    not_updated_group_ids = await list_not_updated_group_ids(state.pg_pool, group_ids)
+    if not_updated_group_ids:
+        return GroupsMemberSetNotUpdatedGroups(
+            type="NOT_UPDATED_GROUPS",
+            group_ids=not_updated_group_ids,
+        )
+
+    member_ids = await state.memberships.evaluate(request.expression)
+    log.info(
+        "Evaluated member set",
+        num_groups=len(group_ids),
+        num_members=len(member_ids),
+    )
+
+    start = 0
+    if request.after is not None:
+        start = int(np.searchsorted(member_ids, request.after, side="right"))
+    end = start + request.limit
+
+    page = member_ids[start:end]
+    is_last_page = end >= len(member_ids)
+
+    return GroupsMemberSetPage(
+        type="PAGE",
+        num_members=len(member_ids),
+        member_ids=page.tolist(),
+        next_cursor=None if is_last_page else int(page[-1]),
+    )
@@ -0,0 +1,96 @@
+from typing import Annotated, Literal
+
+from memberships import sketch
+from pydantic import BaseModel, Field
+
+from api.auth.cookie import AuthCookieValueExtractor
+from api.state import ApiState, ApiStateExtractor
+
+from .freshness import list_not_updated_group_ids
+
+# --------------------------------------------------------------------------------------------------
+
+MIN_NUM_GROUPS = 1
+MAX_NUM_GROUPS = 64
+
+
+class GroupsOverlapEstimateRequest(BaseModel):
+    group_ids: list[int] = Field(
+        ...,
+        min_length=MIN_NUM_GROUPS,
+        max_length=MAX_NUM_GROUPS,
+    )
+
+
+class GroupsOverlapEstimate(BaseModel):
+    class Group(BaseModel):
+        group_id: int
+        estimated_num_members: int
+
+    type: Literal["ESTIMATE"]
+    groups: list[Group]
+    estimated_num_union_members: int
+    estimated_num_intersection_members: int
+    jaccard: float
+    # NB: All groups are smaller than the sketches, so the numbers are exact.
+    is_exact: bool
+
+
+class GroupsOverlapNotUpdatedGroups(BaseModel):
+    type: Literal["NOT_UPDATED_GROUPS"]
+    # NB: Groups whose members were never fetched, request an intersection with them first.
+    group_ids: list[int]
+
+
+GroupsOverlapEstimateResult = Annotated[
+    GroupsOverlapEstimate | GroupsOverlapNotUpdatedGroups,
+    Field(..., discriminator="type"),
+]
+
+
+# Estimates sizes and the overlap of stored groups from their sketches, without loading
+# the members, so that huge requests can be spotted before paying for them.
+async def estimate_overlap(
+    state: ApiStateExtractor,
+    _auth: AuthCookieValueExtractor,
+    request: GroupsOverlapEstimateRequest,
+) -> GroupsOverlapEstimateResult:
+    group_ids = list(dict.fromkeys(request.group_ids))
+
+    not_updated_group_ids = await list_not_updated_group_ids(state.pg_pool, group_ids)
+    if not_updated_group_ids:
+        return GroupsOverlapNotUpdatedGroups(
+            type="NOT_UPDATED_GROUPS",
+            group_ids=not_updated_group_ids,
+        )
+
+    sketches = await state.memberships.get_sketches(group_ids)
+    overlap = sketch.estimate_overlap(list(sketches.values()))
+
+    return GroupsOverlapEstimate(
+        type="ESTIMATE",
+        groups=[
+            GroupsOverlapEstimate.Group(
+                group_id=group_id,
+                estimated_num_members=round(sketch.estimate_num_members(group_sketch)),
+            )
+            for group_id, group_sketch in sketches.items()
+        ],
+        estimated_num_union_members=round(overlap.num_union_members),
+        estimated_num_intersection_members=round(overlap.num_intersection_members),
+        jaccard=overlap.jaccard,
+        is_exact=overlap.is_exact,
+    )
+
+
+# `None` if members of some of the groups were never fetched.
+async def estimate_num_intersection_members(
+    state: ApiState,
+    group_ids: list[int],
+) -> int | None:
+    if await list_not_updated_group_ids(state.pg_pool, group_ids):
+        return None
+
+    sketches = await state.memberships.get_sketches(group_ids)
+    overlap = sketch.estimate_overlap(list(sketches.values()))
+    return round(overlap.num_intersection_members)
@@ -0,0 +1,116 @@
+from typing import Annotated, Literal
+
+import structlog
+from memberships import MAX_NUM_PAIRWISE_ARRAYS, sketch
+from pydantic import BaseModel, Field
+
+from api.auth.cookie import AuthCookieValueExtractor
+from api.state import ApiStateExtractor
+
+from .freshness import list_not_updated_group_ids
+
+log = structlog.stdlib.get_logger()
+
+# --------------------------------------------------------------------------------------------------
+
+MAX_NUM_EXACT_GROUPS = MAX_NUM_PAIRWISE_ARRAYS
+MAX_NUM_ESTIMATED_GROUPS = 256
+
+
+class GroupsOverlapMatrixRequest(BaseModel):
+    group_ids: list[int] = Field(..., min_length=1)
+    # NB:
+    #   "EXACT" reads the members of all the groups, "ESTIMATE" only their sketches,
+    #   which is instant and allows more groups, see `memberships/sketch.py`.
+    mode: Literal["EXACT", "ESTIMATE"] = "EXACT"
+
+
+class GroupsOverlapMatrix(BaseModel):
+    type: Literal["MATRIX"]
+    # NB: Rows and columns of the matrices follow the order of the groups.
+    group_ids: list[int]
+    num_members: list[int]
+    num_intersection_members: list[list[int]]
+    jaccard: list[list[float]]
+    is_exact: bool
+
+
+class GroupsOverlapMatrixReachedLimits(BaseModel):
+    type: Literal["REACHED_LIMITS"]
+    max_num_exact_groups: int
+    max_num_estimated_groups: int
+
+
+class GroupsOverlapMatrixNotUpdatedGroups(BaseModel):
+    type: Literal["NOT_UPDATED_GROUPS"]
+    # NB: Groups whose members were never fetched, request an intersection with them first.
+    group_ids: list[int]
+
+
+GroupsOverlapMatrixResult = Annotated[
+    GroupsOverlapMatrix
+    | GroupsOverlapMatrixReachedLimits
+    | GroupsOverlapMatrixNotUpdatedGroups,
+    Field(..., discriminator="type"),
+]
+
+
+# Overlaps of every pair of stored groups at once, e.g. for competitive analysis,
+# instead of requesting an intersection for each pair.
+async def get_overlap_matrix(
+    state: ApiStateExtractor,
+    _auth: AuthCookieValueExtractor,
+    request: GroupsOverlapMatrixRequest,
+) -> GroupsOverlapMatrixResult:
+    group_ids = list(dict.fromkeys(request.group_ids))
+
+    max_num_groups = (
+        MAX_NUM_EXACT_GROUPS if request.mode == "EXACT" else MAX_NUM_ESTIMATED_GROUPS
+    )
+    if len(group_ids) > max_num_groups:
+        return GroupsOverlapMatrixReachedLimits(
+            type="REACHED_LIMITS",
+            max_num_exact_groups=MAX_NUM_EXACT_GROUPS,
+            max_num_estimated_groups=MAX_NUM_ESTIMATED_GROUPS,
+        )
+
+    not_updated_group_ids = await list_not_updated_group_ids(state.pg_pool, group_ids)
+    if not_updated_group_ids:
+        return GroupsOverlapMatrixNotUpdatedGroups(
+            type="NOT_UPDATED_GROUPS",
+            group_ids=not_updated_group_ids,
+        )
+
+    if request.mode == "EXACT":
+        num_intersection_members = await state.memberships.count_pairwise_intersections(
+            group_ids
+        )
+        num_members = num_intersection_members.diagonal()
+        num_union_members = (
+            num_members[:, None] + num_members[None, :] - num_intersection_members
+        )
+        # NB: Only empty groups have an empty union.
+        jaccard = num_intersection_members / num_union_members.clip(min=1)
+        is_exact = True
+    else:
+        sketches = await state.memberships.get_sketches(group_ids)
+        overlaps = sketch.estimate_pairwise_overlaps(list(sketches.values()))
+        num_members = overlaps.num_members
+        num_intersection_members = overlaps.num_intersection_members
+        jaccard = overlaps.jaccard
+        is_exact = overlaps.is_exact
+
+    log.info(
+        "Computed group overlap matrix",
+        mode=request.mode,
+        num_groups=len(group_ids),
+    )
+
+    return GroupsOverlapMatrix(
+        type="MATRIX",
+        group_ids=group_ids,
+        num_members=num_members.round().astype(int).tolist(),
+        num_intersection_members=num_intersection_members.round().astype(int).tolist(),
+        jaccard=jaccard.tolist(),
+        is_exact=is_exact,
+    )
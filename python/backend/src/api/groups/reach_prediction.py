@@ -11,6 +11,7 @@ from prophet import Prophet
 from pydantic import BaseModel, TypeAdapter
 from vk.errors import TransientError, with_transient_error_retry
 from vk.groups.get_by_id import GetByIdRequest
+from vk.retry import INTERACTIVE_RETRY_POLICY
 from vk.stats.get import GetStatsRequest
 from vk_extra.group_url import VkGroupUrl
 
@@ -70,7 +71,10 @@ async def predict_reach(
             GetByIdRequest(group_ids=request.group_url.screen_name),
         )
 
-    response = await with_transient_error_retry(get_group_by_screen_name)
+    response = await with_transient_error_retry(
+        get_group_by_screen_name,
+        policy=INTERACTIVE_RETRY_POLICY,
+    )
     if not response.groups:
         raise HTTPException(status_code=404, detail="Group not found")
     group = response.groups[0]
@@ -0,0 +1,134 @@
+import asyncio
+from collections.abc import AsyncGenerator, AsyncIterator, Iterator
+from contextlib import contextmanager, suppress
+from uuid import UUID
+
+import asyncpg
+import postgres
+import structlog
+from pydantic import BaseModel
+
+log = structlog.stdlib.get_logger()
+
+# --------------------------------------------------------------------------------------------------
+
+# NB: Proxies drop idle connections, so idle streams send a comment this often.
+SSE_KEEPALIVE_EVERY_N_SECONDS = 15
+
+
+# Fans out job change notifications from Postgres to the streams subscribed to the jobs.
+#
+# A single `LISTEN` connection per process, no matter how many streams are open.
+class JobEventsHub:
+    def __init__(self, pg_pool: asyncpg.Pool) -> None:
+        self.pg_pool = pg_pool
+
+        self._subscribers: dict[UUID, set[asyncio.Event]] = {}
+
+    async def run(self) -> None:
+        await postgres.listen.listen_forever(
+            self.pg_pool,
+            channel=postgres.group_update_jobs.JOB_CHANGES_CHANNEL,
+            on_notification=self._on_notification,
+            # NB: Jobs may have changed while we weren't listening.
+            on_connected=self._wake_up_all,
+        )
+
+    # The event is set whenever any of the jobs changes.
+    @contextmanager
+    def subscribe(self, job_ids: list[UUID]) -> Iterator[asyncio.Event]:
+        event = asyncio.Event()
+        for job_id in job_ids:
+            self._subscribers.setdefault(job_id, set()).add(event)
+
+        try:
+            yield event
+        finally:
+            for job_id in job_ids:
+                events = self._subscribers.get(job_id)
+                if events is None:
+                    continue
+
+                events.discard(event)
+                if not events:
+                    del self._subscribers[job_id]
+
+    def _on_notification(self, payload: str) -> None:
+        try:
+            job_id = UUID(payload)
+        except ValueError:
+            log.warning("Invalid job change notification", payload=payload)
+            return
+
+        for event in self._subscribers.get(job_id, ()):
+            event.set()
+
+    def _wake_up_all(self) -> None:
+        for events in self._subscribers.values():
+            for event in events:
+                event.set()
+
+
+# --------------------------------------------------------------------------------------------------
+
+
+# Yields the jobs right away and then every time any of them changes,
+# until all of them are completed.
+async def watch_jobs(
+    hub: JobEventsHub,
+    *,
+    job_ids: list[UUID],
+) -> AsyncGenerator[list[postgres.group_update_jobs.GroupUpdateJob], None]:
+    # NB: Subscribe before the first read, so that no change is missed in between.
+    with hub.subscribe(job_ids) as changed:
+        while True:
+            changed.clear()
+            jobs = await postgres.group_update_jobs.list_by_ids(
+                hub.pg_pool,
+                job_ids=job_ids,
+            )
+            jobs.sort(key=lambda j: j.created_at)
+            yield jobs
+
+            if all(job.status.is_completed() for job in jobs):
+                return
+
+            await changed.wait()
+
+
+# Formats a server-sent event, see https://html.spec.whatwg.org/#server-sent-events.
+def format_sse_event(event: str, data: BaseModel) -> str:
+    return f"event: {event}\ndata: {data.model_dump_json()}\n\n"
+
+
+# Interleaves `events` with keepalive comments, sent while no event is ready.
+async def with_sse_keepalive(events: AsyncGenerator[str, None]) -> AsyncIterator[str]:
+    async def get_next_event() -> str:
+        return await anext(events)
+
+    next_event = asyncio.create_task(get_next_event())
+    try:
+        while True:
+            done, _ = await asyncio.wait(
+                [next_event],
+                timeout=SSE_KEEPALIVE_EVERY_N_SECONDS,
+            )
+            if not done:
+                yield ": keepalive\n\n"
+                continue
+
+            try:
+                yield next_event.result()
+            except StopAsyncIteration:
+                return
+
+            next_event = asyncio.create_task(get_next_event())
+    finally:
+        # NB: E.g. the client has disconnected.
+        if not next_event.done():
+            next_event.cancel()
+            with suppress(asyncio.CancelledError, StopAsyncIteration):
+                await next_event
+
+        # NB: Runs the cleanup of `events`, even if the task never started.
+        await events.aclose()
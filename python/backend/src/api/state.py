@@ -5,8 +5,11 @@ import asyncpg
 import vk
 from config import BackendConfig, VkConfig
 from fastapi import Depends, Request
+from memberships import MembershipIndex
+from portraits import PortraitCache
 
 from api.dependencies import get_dependency
+from api.job_events import JobEventsHub
 
 # --------------------------------------------------------------------------------------------------
 
@@ -19,6 +22,10 @@ class ApiState:
     pg_pool: asyncpg.Pool
     vk_client: vk.Client
 
+    job_events: JobEventsHub
+    memberships: MembershipIndex
+    portraits: PortraitCache
+
 
 # --------------------------------------------------------------------------------------------------
 
@@ -1,6 +1,10 @@
 from fastapi import APIRouter
 
-from .average_portrait import request_average_portrait, view_average_portrait_request
+from .average_portrait import (
+    request_average_portrait,
+    stream_average_portrait_request,
+    view_average_portrait_request,
+)
 from .get import get_users
 
 
@@ -17,6 +21,11 @@ def build_router() -> APIRouter:
         path="/average-portrait/{request_id}",
         endpoint=view_average_portrait_request,
     )
+    r.add_api_route(
+        methods=["GET"],
+        path="/average-portrait/{request_id}/events",
+        endpoint=stream_average_portrait_request,
+    )
 
     r.add_api_route(
         methods=["POST"],
@@ -1,4 +1,7 @@
 import asyncio
+from collections.abc import AsyncGenerator
+from contextlib import aclosing
+from datetime import datetime, timedelta
 from typing import Annotated, Literal
 from uuid import UUID, uuid4
 
@@ -7,18 +10,22 @@ import postgres
 import structlog
 import vk
 from fastapi import HTTPException
+from fastapi.responses import StreamingResponse
 from job import JobInfo, JobStatus
+from portraits import AveragePortrait, CachedAveragePortrait
 from pydantic import BaseModel, Field
 from vk.errors import TransientError, with_transient_error_retry
 from vk.groups.get_by_id import GetByIdRequest
-from vk.pagination import VK_PAGINATION_MAX_ITEMS
-from vk.users.get_via_execute import GetUsersViaExecuteRequest
-from vk_extra import VkGroupUrl
+from vk.retry import INTERACTIVE_RETRY_POLICY
 
 from api.auth.cookie import AuthCookieValueExtractor
-from api.state import ApiStateExtractor
-
-from .build_portrait import AveragePortrait, build_portrait
+from api.groups.freshness import (
+    GroupFreshnessRequest,
+    ReusedGroupSnapshot,
+    plan_group_refreshes,
+)
+from api.job_events import format_sse_event, watch_jobs, with_sse_keepalive
+from api.state import ApiState, ApiStateExtractor
 
 log = structlog.stdlib.get_logger()
 
@@ -27,12 +34,16 @@ log = structlog.stdlib.get_logger()
 MIN_NUM_GROUPS = 1
 MAX_NUM_GROUPS = 10
 
+# NB: Builds claimed longer ago than this have probably crashed, so they're taken over.
+MAX_PORTRAIT_BUILD_DURATION = timedelta(minutes=10)
+
+PORTRAIT_BUILD_POLL_INTERVAL_N_SECONDS = 1
+
 
 class UsersAveragePortrait_Request:
     class Request(BaseModel):
-        class Group(BaseModel):
-            url: VkGroupUrl
-            freshness: Literal["FRESH", "STALE"]
+        class Group(GroupFreshnessRequest):
+            pass
 
         groups: list[Group]
 
@@ -56,6 +67,8 @@ class UsersAveragePortrait_Request:
     class Info(BaseModel):
         type: Literal["INFO"]
         request_id: UUID
+        # NB: Groups requested as "FRESH", but recent enough to skip the refresh.
+        reused_snapshots: list[ReusedGroupSnapshot]
 
     Result = Annotated[
         Info
@@ -104,7 +117,10 @@ async def request_average_portrait(
         )
 
     log.info("Getting groups by screen names...")
-    response = await with_transient_error_retry(get_groups_by_screen_names)
+    response = await with_transient_error_retry(
+        get_groups_by_screen_names,
+        policy=INTERACTIVE_RETRY_POLICY,
+    )
     if len(group_screen_names) != len(response.groups):
         log.debug(
             "Missing groups after resolving screen names",
@@ -130,17 +146,21 @@ async def request_average_portrait(
     await postgres.vk_groups.upsert_only_vk_data(state.pg_pool, groups=response.groups)
 
     portrait_request_id = uuid4()
-    group_ids_to_update = [
-        group.id
-        for group, g in zip(response.groups, request.groups)
-        if g.freshness == "FRESH"
-    ]
-    log.info("Inserting group update jobs...", group_ids=group_ids_to_update)
+    refresh_plan = await plan_group_refreshes(
+        state.pg_pool,
+        requested_groups=request.groups,
+        groups=response.groups,
+    )
+    log.info(
+        "Inserting group update jobs...",
+        group_ids=refresh_plan.group_ids_to_update,
+        reused_snapshots=refresh_plan.reused_snapshots,
+    )
     job_ids = await postgres.group_update_jobs.insert_many(
         state.pg_pool,
         request_id=portrait_request_id,
         user_id=auth.user_id,
-        group_ids=group_ids_to_update,
+        group_ids=refresh_plan.group_ids_to_update,
     )
 
     log.info(
@@ -159,6 +179,7 @@ async def request_average_portrait(
     return UsersAveragePortrait_Request.Info(
         type="INFO",
         request_id=portrait_request_id,
+        reused_snapshots=refresh_plan.reused_snapshots,
     )
 
 
@@ -195,6 +216,7 @@ class UsersAveragePortrait_View:
             screen_name: str
             members_count: int
             photo_url: str | None = None
+            last_updated_at: datetime | None = None
 
         class GroupUpdateJob(BaseModel):
             group_id: int
@@ -207,27 +229,105 @@ class UsersAveragePortrait_View:
         average_portrait: AveragePortrait | None
 
 
+class UsersAveragePortrait_Progress(BaseModel):
+    update_jobs: list[UsersAveragePortrait_View.Response.GroupUpdateJob]
+
+
 async def view_average_portrait_request(
     state: ApiStateExtractor,
     auth: AuthCookieValueExtractor,
     request_id: UUID,
 ) -> UsersAveragePortrait_View.Response:
-    request = await _select_user_average_portrait_request(
+    request = await _select_request(state.pg_pool, request_id=request_id)
+
+    update_jobs = await postgres.group_update_jobs.list_by_ids(
         state.pg_pool,
+        job_ids=request.update_job_ids,
+    )
+    update_jobs.sort(key=lambda j: j.created_at)
+
+    return await _build_view_response(state, auth.user_id, request, update_jobs)
+
+
+# Streams `progress` events while the update jobs run and a single `completed` event
+# with the same payload as `view_average_portrait_request` once they are done.
+async def stream_average_portrait_request(
+    state: ApiStateExtractor,
+    auth: AuthCookieValueExtractor,
+    request_id: UUID,
+) -> StreamingResponse:
+    request = await _select_request(state.pg_pool, request_id=request_id)
+
+    # NB: Errors can't be reported once streaming has started.
+    user_access_token = await postgres.vk_oauth_tokens.select_access_token(
+        state.pg_pool,
+        user_id=auth.user_id,
+    )
+    if not user_access_token:
+        raise HTTPException(status_code=401, detail="Unauthorized")
+
+    async def events() -> AsyncGenerator[str, None]:
+        watched_jobs = watch_jobs(state.job_events, job_ids=request.update_job_ids)
+        # NB: Unsubscribes even if the client disconnects mid-stream.
+        async with aclosing(watched_jobs):
+            async for update_jobs in watched_jobs:
+                if all(job.status.is_completed() for job in update_jobs):
+                    response = await _build_view_response(
+                        state,
+                        auth.user_id,
+                        request,
+                        update_jobs,
+                    )
+                    # NB: The portrait is being built elsewhere, wait for it.
+                    while not response.average_portrait:
+                        await asyncio.sleep(PORTRAIT_BUILD_POLL_INTERVAL_N_SECONDS)
+                        response = await _build_view_response(
+                            state,
+                            auth.user_id,
+                            request,
+                            update_jobs,
+                        )
+                    yield format_sse_event("completed", response)
+                    return
+
+                progress = UsersAveragePortrait_Progress(
+                    update_jobs=_build_response_update_jobs(update_jobs),
+                )
+                yield format_sse_event("progress", progress)
+
+    return StreamingResponse(
+        with_sse_keepalive(events()),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+async def _select_request(
+    pg_pool: asyncpg.Pool,
+    *,
+    request_id: UUID,
+) -> postgres.user_average_portrait_requests.AveragePortraitRequest:
+    request = await postgres.user_average_portrait_requests.select_by_id(
+        pg_pool,
         request_id=request_id,
     )
     if not request:
         raise HTTPException(status_code=404, detail="Request not found")
 
-    groups, update_jobs = await asyncio.gather(
-        postgres.vk_groups.list_by_ids(state.pg_pool, group_ids=request.group_ids),
-        postgres.group_update_jobs.list_by_ids(
-            state.pg_pool,
-            job_ids=request.update_job_ids,
-        ),
+    return request
+
+
+async def _build_view_response(
+    state: ApiState,
+    user_id: int,
+    request: postgres.user_average_portrait_requests.AveragePortraitRequest,
+    update_jobs: list[postgres.group_update_jobs.GroupUpdateJob],
+) -> UsersAveragePortrait_View.Response:
+    groups = await postgres.vk_groups.list_by_ids(
+        state.pg_pool,
+        group_ids=request.group_ids,
     )
     groups.sort(key=lambda g: g.name.lower())
-    update_jobs.sort(key=lambda j: j.created_at)
 
     response_groups = [
         UsersAveragePortrait_View.Response.Group(
@@ -236,17 +336,11 @@ async def view_average_portrait_request(
             screen_name=group.screen_name,
             members_count=group.members_count,
             photo_url=group.photo_200 or group.photo_100 or group.photo_50,
+            last_updated_at=group.last_updated_at,
         )
         for group in groups
     ]
-    response_update_jobs = [
-        UsersAveragePortrait_View.Response.GroupUpdateJob(
-            group_id=job.group_id,
-            status=job.status,
-            info=job.info,
-        )
-        for job in update_jobs
-    ]
+    response_update_jobs = _build_response_update_jobs(update_jobs)
 
     has_uncompleted_jobs = any(not job.status.is_completed() for job in update_jobs)
     if has_uncompleted_jobs:
@@ -257,105 +351,76 @@ async def view_average_portrait_request(
             average_portrait=None,
         )
 
-    user_access_token = await postgres.vk_oauth_tokens.select_access_token(
-        state.pg_pool,
-        user_id=auth.user_id,
-    )
-    if not user_access_token:
-        raise HTTPException(status_code=401, detail="Unauthorized")
-    user_vk_client = state.vk_client.with_new_access_token(user_access_token)
-
-    all_users = await _get_all_users(
-        state.pg_pool,
-        user_vk_client,
-        group_ids=request.group_ids,
-    )
-    log.info("Got all users", num_users=len(all_users))
-
-    average_portrait = build_portrait(all_users)
+    portrait = await _get_or_build_portrait(state, user_id, request)
+    if not portrait:
+        return UsersAveragePortrait_View.Response(
+            groups=response_groups,
+            update_jobs=response_update_jobs,
+            num_total_users=0,
+            average_portrait=None,
+        )
 
     return UsersAveragePortrait_View.Response(
         groups=response_groups,
         update_jobs=response_update_jobs,
-        num_total_users=len(all_users),
-        average_portrait=average_portrait,
+        num_total_users=portrait.num_total_users,
+        average_portrait=portrait.average_portrait,
     )
 
 
-async def _get_all_users(
-    pg_pool: asyncpg.Pool,
-    vk_client: vk.Client,
-    *,
-    group_ids: list[int],
-) -> list[vk.users.User]:
-    all_users: list[vk.users.User] = []
-
-    log.info("Getting all users...", group_ids=group_ids)
-
-    for i, group_id in enumerate(group_ids):
-        log.info(
-            "Fetching group members",
-            group_id=group_id,
-            progress=f"{i+1}/{len(group_ids)}",
-        )
-        group_member_ids = await postgres.vk_group_members.list_by_group_id(
-            pg_pool,
-            group_id=group_id,
-        )
-
-        group_users: list[vk.users.User] = []
-        limit = 8 * VK_PAGINATION_MAX_ITEMS
-
-        for i in range(0, len(group_member_ids), limit):
-            batch = group_member_ids[i : i + limit]
-            batch_ids = [m.user_id for m in batch]
-
-            # TODO: Try `users.get` without `execute`.
-            async def get_users(_error: TransientError | None):
-                return await vk.users.get_users_via_execute(
-                    vk_client, GetUsersViaExecuteRequest(user_ids=batch_ids)
-                )
-
-            log.info(
-                "Fetching group users via execute",
-                group_id=group_id,
-                offset=i,
-                num_users=len(batch_ids),
-            )
-            response = await with_transient_error_retry(get_users)
-            if not response.users:
-                break
-
-            group_users.extend(response.users)
-
-        log.info("Fetched group users", group_id=group_id, num_users=len(group_users))
-        all_users.extend(group_users)
-
-    return all_users
+# The stored portrait of the request, built here if it's missing,
+# or `None` while it's being built elsewhere.
+#
+# NB:
+#   Usually built in the background once the last update job of the request completes,
+#   but not e.g. when all the groups were recent enough or the build failed,
+#   see `background/groups/portraits.py`. The build is claimed first, so that concurrent
+#   views and polls don't all build the same portrait.
+async def _get_or_build_portrait(
+    state: ApiState,
+    user_id: int,
+    request: postgres.user_average_portrait_requests.AveragePortraitRequest,
+) -> CachedAveragePortrait | None:
+    portrait = await state.portraits.get(request.group_ids)
+    if portrait:
+        return portrait
 
+    is_claimed = await postgres.user_average_portrait_requests.claim_portrait_build(
+        state.pg_pool,
+        request_id=request.id,
+        stale_after=MAX_PORTRAIT_BUILD_DURATION,
+    )
+    if not is_claimed:
+        log.info("Average portrait is being built elsewhere", request_id=request.id)
+        return None
 
-class AveragePortraitRequest(BaseModel):
-    id: UUID
-    group_ids: list[int]
-    update_job_ids: list[UUID]
+    try:
+        log.info("Average portrait is not cached, building...", request_id=request.id)
 
+        user_access_token = await postgres.vk_oauth_tokens.select_access_token(
+            state.pg_pool,
+            user_id=user_id,
+        )
+        if not user_access_token:
+            raise HTTPException(status_code=401, detail="Unauthorized")
+        user_vk_client = state.vk_client.with_new_access_token(user_access_token)
 
-async def _select_user_average_portrait_request(
-    pg_pool: asyncpg.Pool,
-    *,
-    request_id: UUID,
-) -> AveragePortraitRequest | None:
-    async with pg_pool.acquire() as conn:
-        row = await conn.fetchrow(
-            """
-                SELECT *
-                FROM user_average_portrait_requests
-                WHERE id = $1
-            """,
-            request_id,
+        return await state.portraits.build(user_vk_client, request.group_ids)
+    finally:
+        await postgres.user_average_portrait_requests.release_portrait_builds(
+            state.pg_pool,
+            request_ids=[request.id],
         )
 
-    if not row:
-        return None
 
-    return AveragePortraitRequest.model_validate(row)
+def _build_response_update_jobs(
+    update_jobs: list[postgres.group_update_jobs.GroupUpdateJob],
+) -> list[UsersAveragePortrait_View.Response.GroupUpdateJob]:
+    return [
+        UsersAveragePortrait_View.Response.GroupUpdateJob(
+            group_id=job.group_id,
+            status=job.status,
+            info=job.info,
+        )
+        for job in update_jobs
+    ]
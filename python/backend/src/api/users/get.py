@@ -1,19 +1,17 @@
 from typing import Annotated, Literal
 from uuid import UUID
 
-import asyncpg
 import postgres
 import structlog
 import vk
 from fastapi import HTTPException
-from pydantic import BaseModel, Field, TypeAdapter
-from vk.errors import TransientError, with_transient_error_retry
+from portraits import profiles
+from pydantic import BaseModel, Field
 from vk.pagination import VK_PAGINATION_MAX_ITEMS
 from vk.users.get import User
-from vk.users.get_via_execute import GetUsersViaExecuteRequest
 
 from api.auth.cookie import AuthCookieValueExtractor
-from api.state import ApiStateExtractor
+from api.state import ApiState, ApiStateExtractor
 
 log = structlog.stdlib.get_logger()
 
@@ -55,44 +53,18 @@ async def get_users(
                 raise HTTPException(status_code=401, detail="Unauthorized")
             user_vk_client = state.vk_client.with_new_access_token(user_access_token)
 
-            intersection_member_ids = await _list_intersection_member_ids(
-                state.pg_pool,
-                group_ids=intersection_request.group_ids,
+            intersection_member_ids = await state.memberships.intersect(
+                intersection_request.group_ids,
             )
             return await _get_all_users(
+                state,
                 user_vk_client,
-                user_ids=intersection_member_ids,
+                user_ids=intersection_member_ids.tolist(),
             )
 
 
-async def _list_intersection_member_ids(
-    pg_pool: asyncpg.Pool,
-    *,
-    group_ids: list[int],
-) -> list[int]:
-    async with pg_pool.acquire() as conn:
-        rows = await conn.fetch(
-            """
-                WITH users_with_group_counts AS (
-                    SELECT user_id
-                         , COUNT(DISTINCT group_id) AS group_count
-                    FROM vk_group_members
-                    WHERE group_id = ANY($1)
-                    GROUP BY user_id
-                )
-
-                SELECT user_id
-                FROM users_with_group_counts
-                WHERE group_count = $2
-            """,
-            group_ids,
-            len(group_ids),
-        )
-
-    return TypeAdapter(list[int]).validate_python([row["user_id"] for row in rows])
-
-
 async def _get_all_users(
+    state: ApiState,
     vk_client: vk.Client,
     *,
     user_ids: list[int],
@@ -106,21 +78,20 @@ async def _get_all_users(
     for i in range(0, len(user_ids), limit):
         batch_ids = user_ids[i : i + limit]
 
-        # TODO: Try `users.get` without `execute`.
-        async def get_users(_error: TransientError | None):
-            return await vk.users.get_users_via_execute(
-                vk_client, GetUsersViaExecuteRequest(user_ids=batch_ids)
-            )
-
         log.info(
-            "Fetching users via execute",
+            "Fetching users",
             offset=i,
             num_users=len(batch_ids),
         )
-        response = await with_transient_error_retry(get_users)
-        if not response.users:
+        batch_users = await profiles.get_users(
+            state.pg_pool,
+            vk_client,
+            user_ids=batch_ids,
+            max_age_n_seconds=state.backend_config.vk_user_profile_max_age_n_seconds,
+        )
+        if not batch_users:
             break
 
-        all_users.extend(response.users)
+        all_users.extend(batch_users)
 
     return all_users
@@ -1,5 +1,10 @@
 from . import groups
+from .executor import JobExecutor, JobExecutorStats
+from .run import run_background
 
 __all__ = [
     "groups",
+    "JobExecutor",
+    "JobExecutorStats",
+    "run_background",
 ]
@@ -0,0 +1,64 @@
+import asyncio
+import signal
+
+import httpx
+import postgres
+import structlog
+import vk
+from config import BackgroundConfig, PostgresConfig, VkConfig
+from dotenv import load_dotenv
+from migrations import migrate_postgres
+
+from .run import run_background
+
+log = structlog.stdlib.get_logger()
+
+
+# Standalone worker: runs only the background subsystems, without the API server.
+#
+#   python -m background
+#
+async def main():
+    load_dotenv(".env.development")
+
+    log.info("Loading configs...")
+
+    vk_config = VkConfig.load_from_env()
+    pg_config = PostgresConfig.load_from_env()
+    background_config = BackgroundConfig.load_from_env()
+    log.info("Configs loaded.")
+
+    log.info("Building Postgres pool...")
+    pg_pool = await postgres.connection.connect_postgres(pg_config)
+    log.info("Postgres pool built.")
+    log.info("Migrating Postgres...")
+    await migrate_postgres(pg_pool)
+    log.info("Postgres migrations completed.")
+
+    # NB: Closed once the worker stops, after the jobs that use it.
+    async with httpx.AsyncClient() as http_client:
+        vk_client = vk.Client(
+            http_client=http_client,
+            access_token=vk_config.service_access_token,
+            coalesce_calls=True,
+        )
+
+        log.info("Starting background subsystems...")
+        worker = asyncio.create_task(
+            run_background(pg_pool, vk_client, background_config)
+        )
+
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, worker.cancel)
+
+        try:
+            await worker
+        except asyncio.CancelledError:
+            log.info("Worker stopped gracefully.")
+        finally:
+            await pg_pool.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,150 @@
+import asyncio
+from collections import Counter, deque
+from collections.abc import Awaitable, Callable, Hashable
+from dataclasses import dataclass
+from typing import Any
+
+import structlog
+
+log = structlog.stdlib.get_logger()
+
+# --------------------------------------------------------------------------------------------------
+
+
+@dataclass
+class JobExecutorStats:
+    num_running: int
+    num_queued: int
+    num_completed: int
+    num_failed: int
+    num_rejected: int
+
+
+@dataclass
+class _QueuedJob:
+    key: Hashable
+    name: str
+    run: Callable[[], Awaitable[Any]]
+
+
+# --------------------------------------------------------------------------------------------------
+
+
+# Runs background jobs with bounded concurrency.
+#
+# At most `max_concurrent_jobs` jobs run at once, and at most `max_concurrent_jobs_per_key`
+# of them share a key (e.g. a user). Jobs over the limits wait in the admission queue,
+# which holds at most `max_queued_jobs`, further jobs are rejected.
+#
+# Running tasks are tracked, so they aren't garbage collected mid-flight,
+# and are cancelled on `shutdown`.
+class JobExecutor:
+    def __init__(
+        self,
+        *,
+        max_concurrent_jobs: int,
+        max_concurrent_jobs_per_key: int,
+        max_queued_jobs: int,
+    ) -> None:
+        self.max_concurrent_jobs = max_concurrent_jobs
+        self.max_concurrent_jobs_per_key = max_concurrent_jobs_per_key
+        self.max_queued_jobs = max_queued_jobs
+
+        self._queue: deque[_QueuedJob] = deque()
+        self._running: dict[asyncio.Task, _QueuedJob] = {}
+        self._num_running_per_key: Counter[Hashable] = Counter()
+        self._is_shut_down = False
+
+        self._num_completed = 0
+        self._num_failed = 0
+        self._num_rejected = 0
+
+    # How many more jobs would be admitted right now.
+    def num_free_slots(self) -> int:
+        if self._is_shut_down:
+            return 0
+
+        capacity = self.max_concurrent_jobs + self.max_queued_jobs
+        return max(0, capacity - len(self._running) - len(self._queue))
+
+    # Returns `False` if the job was rejected, because the queue is full.
+    def submit(
+        self,
+        run: Callable[[], Awaitable[Any]],
+        *,
+        key: Hashable,
+        name: str,
+    ) -> bool:
+        if self.num_free_slots() <= 0:
+            log.warning("Job executor is full, rejecting job", name=name)
+            self._num_rejected += 1
+            return False
+
+        self._queue.append(_QueuedJob(key=key, name=name, run=run))
+        self._start_admitted_jobs()
+        return True
+
+    def stats(self) -> JobExecutorStats:
+        return JobExecutorStats(
+            num_running=len(self._running),
+            num_queued=len(self._queue),
+            num_completed=self._num_completed,
+            num_failed=self._num_failed,
+            num_rejected=self._num_rejected,
+        )
+
+    # Drops queued jobs and cancels running ones, waiting at most `timeout_n_seconds`.
+    async def shutdown(self, *, timeout_n_seconds: float = 10) -> None:
+        self._is_shut_down = True
+
+        log.info(
+            "Shutting down job executor",
+            num_running=len(self._running),
+            num_queued=len(self._queue),
+        )
+        self._queue.clear()
+
+        tasks = list(self._running)
+        for task in tasks:
+            task.cancel()
+
+        if tasks:
+            _done, pending = await asyncio.wait(tasks, timeout=timeout_n_seconds)
+            if pending:
+                log.warning("Some jobs didn't stop in time", num_jobs=len(pending))
+
+    # NB: Jobs of keys at their limit are skipped, so they don't block other keys.
+    def _start_admitted_jobs(self) -> None:
+        skipped: deque[_QueuedJob] = deque()
+
+        while self._queue and len(self._running) < self.max_concurrent_jobs:
+            job = self._queue.popleft()
+            if self._num_running_per_key[job.key] >= self.max_concurrent_jobs_per_key:
+                skipped.append(job)
+                continue
+
+            task = asyncio.create_task(job.run(), name=job.name)
+            self._running[task] = job
+            self._num_running_per_key[job.key] += 1
+            task.add_done_callback(self._on_job_done)
+
+        skipped.extend(self._queue)
+        self._queue = skipped
+
+    def _on_job_done(self, task: asyncio.Task) -> None:
+        job = self._running.pop(task)
+
+        self._num_running_per_key[job.key] -= 1
+        if self._num_running_per_key[job.key] <= 0:
+            del self._num_running_per_key[job.key]
+
+        if task.cancelled():
+            log.info("Job cancelled", name=job.name)
+        elif error := task.exception():
+            self._num_failed += 1
+            log.error("Job crashed", name=job.name, exc_info=error)
+        else:
+            self._num_completed += 1
+
+        if not self._is_shut_down:
+            self._start_admitted_jobs()
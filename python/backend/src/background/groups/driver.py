@@ -1,162 +1,321 @@
 import asyncio
+import os
+import socket
 from collections.abc import Mapping
-from uuid import UUID
+from functools import partial
+from uuid import UUID, uuid4
 
 import asyncpg
-import httpx
+import postgres
 import structlog
 import vk
-from job import JobInfo, JobStatus
-from pydantic import BaseModel, TypeAdapter, ValidationError
-
-from .update_job import GroupUpdateJob, group_update_job
+from job import JobStatus, RunningJobInfo
+from memberships import MembershipStorage
+from pydantic import BaseModel, TypeAdapter
+
+from ..executor import JobExecutor
+from .portraits import PortraitBuilder
+from .update_job import (
+    JOB_LEASE_DURATION,
+    GroupUpdateJob,
+    fail_group_update_job,
+    group_update_job,
+)
 
 log = structlog.stdlib.get_logger()
 
 
+# NB:
+#   The driver wakes up when new jobs are inserted (see `postgres.group_update_jobs`)
+#   and when one of its jobs completes, since a slot frees up and the next job
+#   of the same user may start then.
+#   Polling is only a safety net for missed notifications and expired leases.
 async def drive_update_jobs(
     pg_pool: asyncpg.Pool,
-    http_client: httpx.AsyncClient,
+    vk_client: vk.Client,
+    membership_storage: MembershipStorage,
+    portrait_builder: PortraitBuilder,
+    executor: JobExecutor,
     *,
-    drive_every_n_seconds: float = 5,
+    poll_every_n_seconds: float = 60,
+    worker_id: str | None = None,
 ):
-    log.info("Starting group update driver...")
+    # NB: Unique per process, so that replicas and restarts never share leases.
+    worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}:{uuid4().hex[:8]}"
+    log.info("Starting group update driver...", worker_id=worker_id)
 
     # this tells python that asyncpg.Record is a subclass of Mapping,
     # meaning the isinstance check within Pydantic will pass
     Mapping.register(asyncpg.Record)  # type: ignore
 
-    while True:
-        try:
-            log.debug("Driving group update jobs...")
-            await _drive_once(pg_pool, http_client)
-        except Exception as e:
-            log.error("Failed to drive group update jobs", exc_info=e)
+    wakeup = asyncio.Event()
+    listener = asyncio.create_task(
+        postgres.listen.listen_forever(
+            pg_pool,
+            channel=postgres.group_update_jobs.NEW_JOBS_CHANNEL,
+            on_notification=lambda _payload: wakeup.set(),
+            # NB: Jobs may have been inserted while we weren't listening.
+            on_connected=wakeup.set,
+        )
+    )
 
-        await asyncio.sleep(drive_every_n_seconds)
+    try:
+        while True:
+            # NB: Cleared before driving, so that a wakeup during the drive isn't lost.
+            wakeup.clear()
+
+            try:
+                log.debug("Driving group update jobs...")
+                await _drive_once(
+                    pg_pool,
+                    vk_client,
+                    membership_storage,
+                    portrait_builder,
+                    executor,
+                    wakeup,
+                    worker_id=worker_id,
+                )
+            except Exception as e:
+                log.error("Failed to drive group update jobs", exc_info=e)
+
+            try:
+                await asyncio.wait_for(wakeup.wait(), timeout=poll_every_n_seconds)
+            except asyncio.TimeoutError:
+                pass
+    finally:
+        listener.cancel()
 
 
 async def _drive_once(
     pg_pool: asyncpg.Pool,
-    http_client: httpx.AsyncClient,
+    vk_client: vk.Client,
+    membership_storage: MembershipStorage,
+    portrait_builder: PortraitBuilder,
+    executor: JobExecutor,
+    wakeup: asyncio.Event,
+    *,
+    worker_id: str,
 ):
-    user_jobs = await _list_oldest_one_job_per_user(pg_pool)
+    # NB: Only claim what we can run, so that other workers get the rest.
+    num_free_slots = executor.num_free_slots()
+    if num_free_slots <= 0:
+        # NB: Running jobs mostly wait for VK, so show how long they wait for rate limits.
+        log.debug(
+            "Job executor is full, not claiming jobs",
+            stats=executor.stats(),
+            rate_limit_stats=vk_client.rate_limiter.stats(),
+        )
+        return
 
-    for job in user_jobs.invalid_jobs:
-        log.error("Invalid job", job=job)
+    claimed_jobs = await _claim_jobs(
+        pg_pool,
+        worker_id=worker_id,
+        max_jobs_per_user=executor.max_concurrent_jobs_per_key,
+        limit=num_free_slots,
+    )
 
-    for job in user_jobs.valid_jobs:
-        if job.status == JobStatus.Running:
-            log.debug("Skipping running group update job", job=job)
-            continue
+    for job in claimed_jobs:
+        if job.previous_status == JobStatus.Running:
+            log.warning("Reclaimed group update job with expired lease", job=job)
+
+        update_job = GroupUpdateJob(
+            id=job.id,
+            group_id=job.group_id,
+            lease_owner=worker_id,
+        )
 
-        access_token = await _select_user_access_token(pg_pool, user_id=job.user_id)
+        # NB: The owner first, then the users whose requests share the job.
+        user_id, access_token = await _select_requester_access_token(
+            pg_pool,
+            user_ids=[job.user_id, *job.requester_user_ids],
+        )
         if not access_token:
-            log.error("Failed to get user access token", job=job)
+            # NB: Otherwise it's reclaimed and skipped forever, taking the user's slot.
+            log.error("Failed to get user access token, failing the job", job=job)
+            await fail_group_update_job(
+                pg_pool,
+                update_job,
+                error="Missing access token",
+            )
+            # NB:
+            #   The next job of the same user may be claimable now. Portraits of requests
+            #   completed by the failure are left to their views, there is no token
+            #   to build them with.
+            wakeup.set()
             continue
 
+        if user_id != job.user_id:
+            log.warning(
+                "Owner of group update job has no access token, handing it over",
+                job=job,
+                user_id=user_id,
+            )
+            await _update_job_owner(pg_pool, update_job, user_id=user_id)
+
         log.info("Starting group update job", job=job)
-        user_vk_client = vk.Client(http_client, access_token=access_token)
-        asyncio.create_task(
-            group_update_job(
+        # NB: Derive from the shared client, so that the job shares the rate limit
+        # budget with API requests made on behalf of the same user.
+        user_vk_client = vk_client.with_new_access_token(access_token)
+        is_submitted = executor.submit(
+            partial(
+                _run_update_job,
                 user_vk_client,
                 pg_pool,
-                GroupUpdateJob(
-                    id=job.id,
-                    group_id=job.group_id,
-                ),
-            )
+                membership_storage,
+                portrait_builder,
+                update_job,
+                wakeup,
+            ),
+            key=user_id,
+            name=f"group_update_job:{job.id}",
+        )
+        if not is_submitted:
+            # NB: The job is picked up again once the lease expires.
+            log.error("Failed to submit group update job", job=job)
+
+
+async def _run_update_job(
+    vk_client: vk.Client,
+    pg_pool: asyncpg.Pool,
+    membership_storage: MembershipStorage,
+    portrait_builder: PortraitBuilder,
+    job: GroupUpdateJob,
+    wakeup: asyncio.Event,
+) -> None:
+    try:
+        is_completed = await group_update_job(
+            vk_client,
+            pg_pool,
+            membership_storage,
+            job,
         )
+    finally:
+        # NB: The next job of the same user may be claimable now.
+        wakeup.set()
+
+    # NB: Only once the job is marked completed, so that nobody waits for the portraits.
+    if is_completed:
+        portrait_builder.submit(vk_client, update_job_id=job.id)
 
 
-async def _select_user_access_token(
+# Returns the first of `user_ids` that has an access token, with the token.
+async def _select_requester_access_token(
     pg_pool: asyncpg.Pool,
     *,
-    user_id: int,
-) -> str | None:
+    user_ids: list[int],
+) -> tuple[int, str | None]:
     async with pg_pool.acquire() as conn:
-        token = await conn.fetchval(
+        rows = await conn.fetch(
             """
-                SELECT access_token
+                SELECT DISTINCT ON (user_id) user_id
+                                           , access_token
                 FROM vk_oauth_tokens
-                WHERE user_id = $1
-                ORDER BY created_at DESC
-                LIMIT 1
+                WHERE user_id = ANY($1)
+                ORDER BY user_id, created_at DESC
             """,
-            user_id,
+            user_ids,
         )
+    access_token_by_user_id = {row["user_id"]: row["access_token"] for row in rows}
 
-    try:
-        return TypeAdapter(str).validate_python(token)
-    except ValidationError:
-        return None
+    for user_id in user_ids:
+        if access_token := access_token_by_user_id.get(user_id):
+            return user_id, access_token
 
+    return user_ids[0], None
 
-class UserJob(BaseModel):
+
+# NB:
+#   The job runs with the new owner's token from now on. It was claimed within the previous
+#   owner's `max_jobs_per_user`, so the new owner may briefly exceed theirs by this job.
+async def _update_job_owner(
+    pg_pool: asyncpg.Pool,
+    job: GroupUpdateJob,
+    *,
+    user_id: int,
+) -> None:
+    async with pg_pool.acquire() as conn:
+        await conn.execute(
+            """
+                UPDATE group_update_jobs
+                SET user_id = $1
+                WHERE id = $2
+                  AND lease_owner = $3
+            """,
+            user_id,
+            job.id,
+            job.lease_owner,
+        )
+
+
+class ClaimedJob(BaseModel):
     id: UUID
     user_id: int
+    requester_user_ids: list[int]
     group_id: int
-    status: JobStatus
-    info: JobInfo
-
+    previous_status: JobStatus
 
-class JobsByUser(BaseModel):
-    valid_jobs: list[UserJob]
-    invalid_jobs: list[UserJob]
 
-
-async def _list_oldest_one_job_per_user(
+# NB:
+#   Atomically moves claimable jobs to RUNNING under our lease. `SKIP LOCKED` lets
+#   concurrent workers claim disjoint jobs without waiting for each other.
+#
+#   Claimable are pending jobs and running jobs with an expired lease, but only the oldest
+#   `max_jobs_per_user` active jobs of every user, so that users' jobs across all workers
+#   don't exceed the limit.
+async def _claim_jobs(
     pg_pool: asyncpg.Pool,
     *,
-    limit: int = 5,
-) -> JobsByUser:
+    worker_id: str,
+    max_jobs_per_user: int,
+    limit: int,
+) -> list[ClaimedJob]:
+    job_info = RunningJobInfo(type=JobStatus.Running, progress=None)
+
     async with pg_pool.acquire() as conn:
-        async with conn.transaction():
-            rows = await conn.fetch(
-                """
-                    WITH ranked_jobs AS (
-                        SELECT id
-                             , user_id
-                             , group_id
-                             , status
-                             , info
-                             , ROW_NUMBER() OVER (PARTITION BY user_id ORDER BY created_at ASC) AS rn
-                        FROM group_update_jobs
-                        WHERE status IN ('PENDING', 'RUNNING')
+        rows = await conn.fetch(
+            """
+                WITH claimable_jobs AS (
+                    SELECT j.id
+                         , j.status
+                    FROM group_update_jobs j
+                    WHERE (
+                            j.status = 'PENDING'
+                        OR (j.status = 'RUNNING' AND j.lease_expires_at < NOW())
                     )
-
-                    SELECT g.id
-                         , g.user_id
-                         , g.group_id
-                         , g.status
-                         , g.info::JSONB
-
-                    FROM group_update_jobs g
-                    JOIN ranked_jobs r
-                        ON g.id = r.id
-
-                    WHERE r.rn = 1
+                      AND (
+                          SELECT COUNT(*)
+                          FROM group_update_jobs o
+                          WHERE o.user_id = j.user_id
+                            AND o.status IN ('PENDING', 'RUNNING')
+                            AND (o.created_at, o.id) < (j.created_at, j.id)
+                      ) < $5
+                    ORDER BY j.created_at ASC
                     LIMIT $1
 
-                    FOR UPDATE
-                """,
-                limit,
-            )
-
-    log.debug("Fetched oldest one job per user", rows=rows)
-    jobs = TypeAdapter(list[UserJob]).validate_python(rows)
+                    FOR UPDATE OF j SKIP LOCKED
+                )
 
-    valid_jobs = []
-    invalid_jobs = []
+                UPDATE group_update_jobs g
+                SET status = 'RUNNING'
+                  , info = $2::JSONB
+                  , lease_owner = $3
+                  , lease_expires_at = NOW() + $4::INTERVAL
 
-    for job in jobs:
-        if job.status != job.info.type:
-            invalid_jobs.append(job)
-            continue
+                FROM claimable_jobs c
+                WHERE g.id = c.id
 
-        valid_jobs.append(job)
+                RETURNING g.id
+                        , g.user_id
+                        , g.requester_user_ids
+                        , g.group_id
+                        , c.status AS previous_status
+            """,
+            limit,
+            job_info,
+            worker_id,
+            JOB_LEASE_DURATION,
+            max_jobs_per_user,
+        )
 
-    return JobsByUser(
-        valid_jobs=valid_jobs,
-        invalid_jobs=invalid_jobs,
-    )
+    log.debug("Claimed group update jobs", rows=rows)
+    return TypeAdapter(list[ClaimedJob]).validate_python(rows)
@@ -0,0 +1,96 @@
+from functools import partial
+from uuid import UUID
+
+import asyncpg
+import postgres
+import structlog
+import vk
+from portraits import PortraitCache
+
+from ..executor import JobExecutor
+
+log = structlog.stdlib.get_logger()
+
+
+# Schedules `build_request_portraits` once an update job has completed.
+#
+# NB:
+#   Builds run on their own executor, so that they never take the slots the driver
+#   claims update jobs for, and update jobs never get builds rejected.
+class PortraitBuilder:
+    def __init__(
+        self,
+        pg_pool: asyncpg.Pool,
+        portrait_cache: PortraitCache,
+        executor: JobExecutor,
+    ) -> None:
+        self.pg_pool = pg_pool
+        self.portrait_cache = portrait_cache
+        self.executor = executor
+
+    def submit(self, vk_client: vk.Client, *, update_job_id: UUID) -> None:
+        is_submitted = self.executor.submit(
+            partial(
+                build_request_portraits,
+                vk_client,
+                self.pg_pool,
+                self.portrait_cache,
+                update_job_id=update_job_id,
+            ),
+            # NB: Builds with the same access token share its rate limit anyway.
+            key=vk_client.access_token,
+            name=f"average_portraits:{update_job_id}",
+        )
+        if not is_submitted:
+            # NB: Views compute missing portraits themselves.
+            log.warning(
+                "Failed to submit average portrait builds",
+                update_job_id=update_job_id,
+            )
+
+
+# Builds the average portraits of the requests whose last update job is `update_job_id`,
+# so that views of the requests read them instead of computing them.
+#
+# NB:
+#   Runs as a separate executor job once the update job has completed, so that requests
+#   sharing the update job don't wait for the portrait and the build isn't tied
+#   to the update job's lease. Requests are claimed before building, so that a request
+#   is built once even if its last update jobs complete at the same time, and views
+#   wait for the build instead of running their own, see `api/users/average_portrait.py`.
+#   Claims are released once done, so that a failed or cancelled build isn't retried
+#   here, but by the next view of the request.
+async def build_request_portraits(
+    vk_client: vk.Client,
+    pg_pool: asyncpg.Pool,
+    portrait_cache: PortraitCache,
+    *,
+    update_job_id: UUID,
+) -> None:
+    requests = await postgres.user_average_portrait_requests.claim_portrait_builds(
+        pg_pool,
+        update_job_id=update_job_id,
+    )
+
+    try:
+        for request in requests:
+            try:
+                # NB: Requests for the same groups share the portrait.
+                if await portrait_cache.get(request.group_ids):
+                    log.info("Average portrait is up to date", request_id=request.id)
+                    continue
+
+                log.info("Building average portrait", request_id=request.id)
+                await portrait_cache.build(vk_client, request.group_ids)
+            except Exception as e:
+                log.warn(
+                    "Failed to build average portrait",
+                    request_id=request.id,
+                    error=e,
+                )
+    finally:
+        if requests:
+            await postgres.user_average_portrait_requests.release_portrait_builds(
+                pg_pool,
+                request_ids=[request.id for request in requests],
+            )
@@ -1,43 +1,227 @@
+import asyncio
 import traceback
-from datetime import datetime
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable
 from uuid import UUID
 
 import asyncpg
+import postgres
 import structlog
 import vk
-from job import FailedJobInfo, JobStatus, RunningJobInfo, SucceededJobInfo
-from pydantic import BaseModel, TypeAdapter
+from job import (
+    FailedJobInfo,
+    JobStatus,
+    PendingJobInfo,
+    RunningJobInfo,
+    SucceededJobInfo,
+)
+from memberships import MembershipStorage
+from pydantic import BaseModel
 from utils import utc_now
-from vk.errors import TransientError, with_transient_error_retry
+from vk.errors import AuthorizationError, TransientError, with_transient_error_retry
+from vk.execute import VK_EXECUTE_MAX_REQUESTS
 from vk.groups.get_members import GetMembersRequest
-from vk.groups.get_members_via_execute import GetMembersViaExecuteRequest
+from vk.groups.get_members_via_execute import (
+    GetMembersViaExecuteRequest,
+    GetMembersViaExecuteResponse,
+)
+from vk.pagination import VK_PAGINATION_MAX_ITEMS
+from vk.retry import BACKGROUND_RETRY_POLICY
 
 log = structlog.stdlib.get_logger()
 
+# --------------------------------------------------------------------------------------------------
+
+# One `execute` request fetches this many members.
+MEMBERS_CHUNK_SIZE = VK_EXECUTE_MAX_REQUESTS * VK_PAGINATION_MAX_ITEMS
+
+# NB:
+#   More doesn't help, since requests are throttled by the per-token rate limiter.
+#   Every fetcher holds at most one chunk, until the queue takes it.
+MAX_CONCURRENT_CHUNK_FETCHES = 3
+
+# NB:
+#   Fetched chunks wait here until the writer stages them, fetchers block when it's full.
+#   At most this many chunks, plus one per fetcher and the one being written, are held
+#   in memory, no matter how big the group is.
+MAX_QUEUED_CHUNKS = 2
+
+# NB:
+#   A worker owns a running job until its lease expires and renews the lease while
+#   the job runs. Jobs of a crashed or restarted worker are reclaimed by other workers
+#   once their lease expires, and are resumed from their checkpoint.
+JOB_LEASE_DURATION = timedelta(minutes=5)
+JOB_LEASE_RENEW_EVERY_N_SECONDS = 60
+
+# --------------------------------------------------------------------------------------------------
+
 
 class GroupUpdateJob(BaseModel):
     id: UUID
     group_id: int
+    lease_owner: str
 
 
+# Returns `True` if the job has completed here, i.e. succeeded or failed.
 async def group_update_job(
     vk_client: vk.Client,
     pg_pool: asyncpg.Pool,
+    membership_storage: MembershipStorage,
     job: GroupUpdateJob,
-):
+) -> bool:
+    # NB: The job may have waited in the executor queue long enough for its lease to expire.
+    if not await _renew_lease(pg_pool, job):
+        log.warning("Lost group update job lease before starting", job=job)
+        return False
+
     log.info("Updating group as running", job=job)
     await _update_job_as_running(pg_pool, job, progress=None)
 
+    work = asyncio.create_task(_do_job(vk_client, pg_pool, membership_storage, job))
+    heartbeat = asyncio.create_task(_keep_lease(pg_pool, job, work))
     try:
         log.info("Starting group update job", job=job)
-        await _do_job(vk_client, pg_pool, job)
+        await work
 
         log.info("Updating group as succeeded", job=job)
         await _update_job_as_succeeded(pg_pool, job, completed_at=utc_now())
+    except asyncio.CancelledError:
+        if heartbeat.done() and not heartbeat.cancelled():
+            log.warning("Lost group update job lease, stopping", job=job)
+            return False
+
+        # NB: Let other workers resume the job right away instead of waiting for expiry.
+        await _try_release_lease(pg_pool, job)
+        raise
     except Exception as e:
+        # NB: The owner has revoked their token, but others may be waiting for the job too.
+        if isinstance(e, AuthorizationError) and await _try_hand_over(pg_pool, job):
+            log.warning(
+                "Access token was rejected, handed the job over", job=job, error=e
+            )
+            return False
+
         log.error("Job failed", exc_info=e)
         error = traceback.format_exc()
         await _update_job_as_failed(pg_pool, job, error=error, completed_at=utc_now())
+        # NB: Failed jobs are never resumed, so their checkpoint is of no use.
+        await _try_discard_checkpoint(pg_pool, job)
+    finally:
+        # NB: On cancellation (e.g. shutdown) the job stays RUNNING with its checkpoint,
+        # so that it's resumed by whoever claims it next.
+        heartbeat.cancel()
+        work.cancel()
+
+    return True
+
+
+# Fails a claimed job that can't run at all, e.g. without an access token.
+async def fail_group_update_job(
+    pg_pool: asyncpg.Pool,
+    job: GroupUpdateJob,
+    *,
+    error: str,
+) -> None:
+    await _update_job_as_failed(pg_pool, job, error=error, completed_at=utc_now())
+    # NB: The job may have been reclaimed with a checkpoint.
+    await _try_discard_checkpoint(pg_pool, job)
+
+
+# NB: Returns only when the lease is lost, after cancelling the job.
+async def _keep_lease(
+    pg_pool: asyncpg.Pool,
+    job: GroupUpdateJob,
+    work: asyncio.Task,
+) -> None:
+    while True:
+        await asyncio.sleep(JOB_LEASE_RENEW_EVERY_N_SECONDS)
+
+        try:
+            is_renewed = await _renew_lease(pg_pool, job)
+        except Exception as e:
+            log.warn("Failed to renew job lease, continuing...", job=job, error=e)
+            continue
+
+        # NB: Someone else has reclaimed the job, e.g. we were too slow to renew.
+        if not is_renewed:
+            work.cancel()
+            return
+
+
+async def _renew_lease(
+    pg_pool: asyncpg.Pool,
+    job: GroupUpdateJob,
+) -> bool:
+    async with pg_pool.acquire() as conn:
+        status = await conn.execute(
+            """
+                UPDATE group_update_jobs
+                SET lease_expires_at = NOW() + $1::INTERVAL
+                WHERE id = $2
+                  AND status = 'RUNNING'
+                  AND lease_owner = $3
+            """,
+            JOB_LEASE_DURATION,
+            job.id,
+            job.lease_owner,
+        )
+
+    # NB: Status looks like "UPDATE 1".
+    return status != "UPDATE 0"
+
+
+async def _try_release_lease(
+    pg_pool: asyncpg.Pool,
+    job: GroupUpdateJob,
+) -> None:
+    try:
+        async with pg_pool.acquire() as conn:
+            await conn.execute(
+                """
+                    UPDATE group_update_jobs
+                    SET lease_expires_at = NOW()
+                    WHERE id = $1
+                      AND status = 'RUNNING'
+                      AND lease_owner = $2
+                """,
+                job.id,
+                job.lease_owner,
+            )
+    except Exception as e:
+        log.warn("Failed to release job lease", job=job, error=e)
+
+
+# NB:
+#   Hands the job over to the next user whose request shares it (see `requester_user_ids`)
+#   and makes it pending again, so that it's claimed within that user's limits and resumed
+#   from its checkpoint. Returns `False` if there is no one else.
+async def _try_hand_over(
+    pg_pool: asyncpg.Pool,
+    job: GroupUpdateJob,
+) -> bool:
+    job_info = PendingJobInfo(type=JobStatus.Pending)
+
+    async with pg_pool.acquire() as conn:
+        status = await conn.execute(
+            """
+                UPDATE group_update_jobs
+                SET user_id = (ARRAY_REMOVE(requester_user_ids, user_id))[1]
+                  , requester_user_ids = ARRAY_REMOVE(requester_user_ids, user_id)
+                  , status = 'PENDING'
+                  , info = $1::JSONB
+                  , lease_expires_at = NULL
+                WHERE id = $2
+                  AND lease_owner = $3
+                  AND CARDINALITY(ARRAY_REMOVE(requester_user_ids, user_id)) > 0
+            """,
+            job_info,
+            job.id,
+            job.lease_owner,
+        )
+
+    # NB: Status looks like "UPDATE 1".
+    return status != "UPDATE 0"
 
 
 async def _update_job_as_failed(
@@ -59,10 +243,13 @@ async def _update_job_as_failed(
                 UPDATE group_update_jobs
                 SET status = 'FAILED'
                   , info = $1::JSONB
+                  , lease_expires_at = NULL
                 WHERE id = $2
+                  AND lease_owner = $3
             """,
             job_info,
             job.id,
+            job.lease_owner,
         )
 
 
@@ -81,9 +268,11 @@ async def _update_job_as_running(
                 SET status = 'RUNNING'
                   , info = $1::JSONB
                 WHERE id = $2
+                  AND lease_owner = $3
             """,
             job_info,
             job.id,
+            job.lease_owner,
         )
 
 
@@ -104,145 +293,335 @@ async def _update_job_as_succeeded(
                 UPDATE group_update_jobs
                 SET status = 'SUCCEEDED'
                   , info = $1::JSONB
+                  , lease_expires_at = NULL
                 WHERE id = $2
+                  AND lease_owner = $3
             """,
             job_info,
             job.id,
+            job.lease_owner,
         )
 
 
 async def _do_job(
     vk_client: vk.Client,
     pg_pool: asyncpg.Pool,
+    membership_storage: MembershipStorage,
     job: GroupUpdateJob,
 ) -> None:
-    member_ids = []
+    await _update_members(vk_client, pg_pool, membership_storage, job)
+    await _try_update_group_sketch(membership_storage, job)
+    await _update_group_last_updated_at(pg_pool, job.group_id)
 
-    while True:
-        offset = len(member_ids)
-        log.info("Fetching group members", job=job, offset=offset)
-
-        async def get_members(_error: TransientError | None):
-            return await vk.groups.get_members_via_execute(
-                vk_client,
-                GetMembersViaExecuteRequest(
-                    group_id=job.group_id,
-                    offset=offset,
-                ),
-            )
 
-        response = await with_transient_error_retry(get_members)
-        if not response.member_ids:
-            break
+@dataclass
+class _MembersChunk:
+    offset: int
+    member_ids: list[int]
 
-        member_ids.extend(response.member_ids)
 
-        try:
-            await _update_job_as_running(
-                pg_pool,
-                job,
-                progress=RunningJobInfo.Progress(
-                    num_updated=len(member_ids),
-                    num_total=response.total_count,
-                ),
-            )
-        except Exception as e:
-            log.warn("Failed to update job as running, continuing...", job=job, error=e)
+# NB:
+#   Members are streamed into a staging table and diffed inside Postgres:
+#   the fetcher puts chunks into a bounded queue, the writer drains it into staging,
+#   so that network and database I/O overlap and memory doesn't grow with the group.
+#   Every group takes this path, small groups are no longer diffed in memory,
+#   since that diff held all members of the group at once.
+async def _update_members(
+    vk_client: vk.Client,
+    pg_pool: asyncpg.Pool,
+    membership_storage: MembershipStorage,
+    job: GroupUpdateJob,
+) -> None:
+    start_offset = await _select_resumable_checkpoint_offset(pg_pool, job)
+    if start_offset:
+        log.info("Resuming group update job", job=job, offset=start_offset)
+    else:
+        # NB: Leftovers from a previous attempt.
+        await postgres.vk_group_member_staging.delete_by_job_id(pg_pool, job_id=job.id)
+
+    # NB: `None` tells the writer that all chunks were fetched.
+    queue: asyncio.Queue[_MembersChunk | None] = asyncio.Queue(
+        maxsize=MAX_QUEUED_CHUNKS
+    )
 
-    log.info("Fetched group members", job=job, num_members=len(member_ids))
+    async def enqueue_chunk(offset: int, member_ids: list[int]) -> None:
+        await queue.put(_MembersChunk(offset=offset, member_ids=member_ids))
 
-    log.info("Listing stale group members", job=job)
-    stale_members = await _list_group_members(
-        pg_pool,
-        job.group_id,
+    async def fetch_chunks() -> None:
+        await _fetch_member_chunks(
+            vk_client,
+            pg_pool,
+            job,
+            start_offset=start_offset,
+            on_chunk=enqueue_chunk,
+        )
+        await queue.put(None)
+
+    tasks = [
+        asyncio.create_task(fetch_chunks()),
+        asyncio.create_task(_stage_chunks(pg_pool, job, queue, start_offset)),
+    ]
+    try:
+        await asyncio.gather(*tasks)
+    except BaseException:
+        # NB: Otherwise the fetcher may block forever on a full queue.
+        for task in tasks:
+            task.cancel()
+        raise
+
+    log.info("Applying staged group members", job=job)
+    diff = await membership_storage.apply_staged_members(
+        job_id=job.id,
+        group_id=job.group_id,
     )
+    log.info(
+        "Applied staged group members",
+        job=job,
+        num_removed=diff.num_removed,
+        num_added=diff.num_added,
+    )
+
+    await _update_job_checkpoint_offset(pg_pool, job, checkpoint_offset=None)
 
-    left_members = set(stale_members) - set(member_ids)
-    new_members = set(member_ids) - set(stale_members)
 
+async def _stage_chunks(
+    pg_pool: asyncpg.Pool,
+    job: GroupUpdateJob,
+    queue: asyncio.Queue[_MembersChunk | None],
+    checkpoint_offset: int,
+) -> None:
+    # NB:
+    #   Chunks arrive out of order, the checkpoint only moves past a contiguous run
+    #   of staged chunks, by the number of rows actually staged. So it never goes past
+    #   the staged rows, even after the last partial chunk, see the resumability check.
+    #   A partial chunk in the middle stops it until the job is restarted.
+    staged_chunk_sizes: dict[int, int] = {}
+
+    while (chunk := await queue.get()) is not None:
+        await postgres.vk_group_member_staging.copy_user_ids(
+            pg_pool,
+            job_id=job.id,
+            user_ids=chunk.member_ids,
+        )
+        staged_chunk_sizes[chunk.offset] = len(chunk.member_ids)
+
+        next_checkpoint_offset = checkpoint_offset
+        while next_checkpoint_offset in staged_chunk_sizes:
+            next_checkpoint_offset += staged_chunk_sizes.pop(next_checkpoint_offset)
+
+        if next_checkpoint_offset != checkpoint_offset:
+            checkpoint_offset = next_checkpoint_offset
+            await _update_job_checkpoint_offset(
+                pg_pool,
+                job,
+                checkpoint_offset=checkpoint_offset,
+            )
+
+
+async def _select_resumable_checkpoint_offset(
+    pg_pool: asyncpg.Pool,
+    job: GroupUpdateJob,
+) -> int:
     async with pg_pool.acquire() as conn:
-        async with conn.transaction():
-            if left_members:
-                await _remove_group_members(conn, job.group_id, list(left_members))
-            else:
-                log.info("No members left the group", job=job)
+        checkpoint_offset = await conn.fetchval(
+            """
+                SELECT checkpoint_offset
+                FROM group_update_jobs
+                WHERE id = $1
+            """,
+            job.id,
+        )
 
-            if new_members:
-                await _add_group_members(conn, job.group_id, list(new_members))
-            else:
-                log.info("No new members joined the group", job=job)
+    if not checkpoint_offset:
+        return 0
 
-    await _update_group_last_updated_at(pg_pool, job.group_id)
+    # NB:
+    #   The staging table is unlogged, so Postgres truncates it after a crash.
+    #   The checkpoint counts the rows staged below it, so fewer rows means they are gone.
+    num_staged = await postgres.vk_group_member_staging.count_by_job_id(
+        pg_pool,
+        job_id=job.id,
+    )
+    if num_staged < checkpoint_offset:
+        log.warn(
+            "Staged group members are lost, starting from scratch",
+            job=job,
+            checkpoint_offset=checkpoint_offset,
+            num_staged=num_staged,
+        )
+        return 0
 
+    return checkpoint_offset
 
-async def _update_group_last_updated_at(
+
+async def _update_job_checkpoint_offset(
     pg_pool: asyncpg.Pool,
-    group_id: int,
+    job: GroupUpdateJob,
+    *,
+    checkpoint_offset: int | None,
 ) -> None:
-    log.info("Updating group last updated at", group_id=group_id)
-
     async with pg_pool.acquire() as conn:
         await conn.execute(
             """
-                UPDATE vk_groups
-                SET last_updated_at = NOW()
-                WHERE id = $1
+                UPDATE group_update_jobs
+                SET checkpoint_offset = $1
+                WHERE id = $2
+                  AND lease_owner = $3
             """,
-            group_id,
+            checkpoint_offset,
+            job.id,
+            job.lease_owner,
         )
 
 
-async def _remove_group_members(
-    conn: asyncpg.Connection,
-    group_id: int,
-    user_ids: list[int],
+async def _try_discard_checkpoint(
+    pg_pool: asyncpg.Pool,
+    job: GroupUpdateJob,
 ) -> None:
-    log.info("Removing group members", group_id=group_id, num_members=len(user_ids))
-
-    await conn.execute(
-        """
-            DELETE FROM vk_group_members
-            WHERE group_id = $1
-              AND user_id = ANY($2)
-        """,
-        group_id,
-        user_ids,
-    )
+    try:
+        await _update_job_checkpoint_offset(pg_pool, job, checkpoint_offset=None)
+        await postgres.vk_group_member_staging.delete_by_job_id(pg_pool, job_id=job.id)
+    except Exception as e:
+        log.warn("Failed to discard job checkpoint", job=job, error=e)
 
 
-async def _add_group_members(
-    conn: asyncpg.Connection,
-    group_id: int,
-    user_ids: list[int],
+async def _fetch_member_chunks(
+    vk_client: vk.Client,
+    pg_pool: asyncpg.Pool,
+    job: GroupUpdateJob,
+    *,
+    start_offset: int = 0,
+    on_chunk: Callable[[int, list[int]], Awaitable[None]],
 ) -> None:
-    log.info("Adding group members", group_id=group_id, num_members=len(user_ids))
-
-    await conn.executemany(
-        """
-            INSERT INTO vk_group_members (group_id, user_id)
-            VALUES ($1, $2)
-            ON CONFLICT (group_id, user_id) DO NOTHING
-        """,
-        [(group_id, user_id) for user_id in user_ids],
+    # NB: The first chunk tells us the total number of members,
+    # so the remaining offset ranges can be fetched concurrently.
+    first_chunk = await _fetch_members_chunk(vk_client, job, offset=start_offset)
+    if not first_chunk.member_ids:
+        return
+
+    await on_chunk(start_offset, first_chunk.member_ids)
+    num_total = first_chunk.total_count
+    num_fetched = start_offset + len(first_chunk.member_ids)
+    await _try_report_progress(pg_pool, job, num_fetched, num_total)
+
+    offsets = list(
+        range(start_offset + MEMBERS_CHUNK_SIZE, num_total, MEMBERS_CHUNK_SIZE)
+    )
+    remaining_offsets = iter(offsets)
+    chunk_size_by_offset: dict[int, int] = {}
+
+    # NB:
+    #   A fixed number of fetchers take the next offset only once `on_chunk` has taken
+    #   their previous chunk, so a slow writer stops fetching instead of piling up
+    #   fetched chunks. VK throughput is additionally throttled by the rate limiter.
+    async def fetch_chunks() -> None:
+        nonlocal num_fetched
+
+        for offset in remaining_offsets:
+            chunk = await _fetch_members_chunk(vk_client, job, offset=offset)
+            await on_chunk(offset, chunk.member_ids)
+            chunk_size_by_offset[offset] = len(chunk.member_ids)
+
+            num_fetched += len(chunk.member_ids)
+            await _try_report_progress(pg_pool, job, num_fetched, num_total)
+
+    tasks = [
+        asyncio.create_task(fetch_chunks())
+        for _ in range(min(MAX_CONCURRENT_CHUNK_FETCHES, len(offsets)))
+    ]
+    try:
+        await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        raise
+
+    # NB: Members may have joined while we were fetching,
+    # so keep going until we get a chunk that is not full.
+    last_offset = offsets[-1] if offsets else start_offset
+    last_chunk_size = (
+        chunk_size_by_offset[last_offset] if offsets else len(first_chunk.member_ids)
     )
+    while last_chunk_size >= MEMBERS_CHUNK_SIZE:
+        last_offset += MEMBERS_CHUNK_SIZE
+        chunk = await _fetch_members_chunk(vk_client, job, offset=last_offset)
+        await on_chunk(last_offset, chunk.member_ids)
+        last_chunk_size = len(chunk.member_ids)
 
 
-async def _list_group_members(
+async def _fetch_members_chunk(
+    vk_client: vk.Client,
+    job: GroupUpdateJob,
+    *,
+    offset: int,
+) -> GetMembersViaExecuteResponse:
+    log.info("Fetching group members", job=job, offset=offset)
+
+    async def get_members(_error: TransientError | None):
+        return await vk.groups.get_members_via_execute(
+            vk_client,
+            GetMembersViaExecuteRequest(
+                group_id=job.group_id,
+                offset=offset,
+                count=MEMBERS_CHUNK_SIZE,
+            ),
+        )
+
+    return await with_transient_error_retry(
+        get_members,
+        # NB: A single flaky request must not throw away the whole fetch.
+        policy=BACKGROUND_RETRY_POLICY,
+    )
+
+
+async def _try_report_progress(
+    pg_pool: asyncpg.Pool,
+    job: GroupUpdateJob,
+    num_updated: int,
+    num_total: int,
+) -> None:
+    try:
+        await _update_job_as_running(
+            pg_pool,
+            job,
+            progress=RunningJobInfo.Progress(
+                num_updated=num_updated,
+                num_total=num_total,
+            ),
+        )
+    except Exception as e:
+        log.warn("Failed to update job as running, continuing...", job=job, error=e)
+
+
+# NB: Sketches are only estimates, not worth failing the job, see `memberships.sketch`.
+async def _try_update_group_sketch(
+    membership_storage: MembershipStorage,
+    job: GroupUpdateJob,
+) -> None:
+    log.info("Updating group members sketch", job=job)
+
+    try:
+        await membership_storage.update_sketch(job.group_id)
+    except Exception as e:
+        log.warn("Failed to update group members sketch", job=job, error=e)
+
+
+async def _update_group_last_updated_at(
     pg_pool: asyncpg.Pool,
     group_id: int,
-) -> list[int]:
+) -> None:
+    log.info("Updating group last updated at", group_id=group_id)
+
     async with pg_pool.acquire() as conn:
-        rows = await conn.fetch(
+        await conn.execute(
             """
-                SELECT user_id
-                FROM vk_group_members
-                WHERE group_id = $1
+                UPDATE vk_groups
+                SET last_updated_at = NOW()
+                WHERE id = $1
             """,
             group_id,
         )
 
-    return TypeAdapter(list[int]).validate_python([row["user_id"] for row in rows])
-
 
 async def get_num_total_members(
     vk_client: vk.Client,
@@ -0,0 +1,61 @@
+import asyncpg
+import structlog
+import vk
+from config import BackgroundConfig
+from memberships import MembershipStorage
+from portraits import PortraitCache
+
+from .executor import JobExecutor
+from .groups import drive_update_jobs
+from .groups.portraits import PortraitBuilder
+
+log = structlog.stdlib.get_logger()
+
+# --------------------------------------------------------------------------------------------------
+
+
+# Runs the job driver and executor until cancelled,
+# both inside the API process and in the standalone worker (see `__main__.py`).
+async def run_background(
+    pg_pool: asyncpg.Pool,
+    vk_client: vk.Client,
+    config: BackgroundConfig,
+) -> None:
+    executor = JobExecutor(
+        max_concurrent_jobs=config.max_concurrent_jobs,
+        max_concurrent_jobs_per_key=config.max_concurrent_jobs_per_user,
+        max_queued_jobs=config.max_queued_jobs,
+    )
+
+    membership_storage = MembershipStorage(
+        pg_pool,
+        backend=config.membership_storage,
+    )
+    portrait_cache = PortraitCache(
+        pg_pool,
+        membership_storage,
+        max_profile_age_n_seconds=config.vk_user_profile_max_age_n_seconds,
+    )
+    # NB: Same limits as update jobs, see `PortraitBuilder`.
+    portrait_executor = JobExecutor(
+        max_concurrent_jobs=config.max_concurrent_jobs,
+        max_concurrent_jobs_per_key=config.max_concurrent_jobs_per_user,
+        max_queued_jobs=config.max_queued_jobs,
+    )
+    portrait_builder = PortraitBuilder(pg_pool, portrait_cache, portrait_executor)
+
+    try:
+        await drive_update_jobs(
+            pg_pool,
+            vk_client,
+            membership_storage,
+            portrait_builder,
+            executor,
+            poll_every_n_seconds=config.poll_every_n_seconds,
+        )
+    finally:
+        # NB: Cancelled jobs keep their checkpoint and are resumed by whoever claims them.
+        await executor.shutdown()
+        # NB: Claimed requests of cancelled builds are left to their views.
+        await portrait_executor.shutdown()
+        log.info("Background subsystems stopped.")
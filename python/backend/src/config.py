@@ -1,7 +1,8 @@
 import os
 from dataclasses import dataclass
+from typing import Literal
 
-from utils import get_env_or_raise
+from utils import get_env_or_default, get_env_or_raise
 
 
 @dataclass
@@ -13,6 +14,15 @@ class BackendConfig:
     auth_private_key: str
     auth_public_key: str
 
+    # NB: Disable when background jobs run in a standalone worker, see `background/__main__.py`.
+    run_background: bool
+
+    # NB: Mounted as a volume, see `docker-compose.yaml`.
+    data_dir: str
+
+    # NB: Cached VK profiles older than this are refetched, see `portraits/profiles.py`.
+    vk_user_profile_max_age_n_seconds: int
+
     @staticmethod
     def load_from_env() -> "BackendConfig":
         source = {
@@ -24,6 +34,13 @@ class BackendConfig:
         vk_redirect_uri = get_env_or_raise("BACKEND_VK_REDIRECT_URI", source)
         auth_private_key = get_env_or_raise("BACKEND_AUTH_PRIVATE_KEY", source).strip()
         auth_public_key = get_env_or_raise("BACKEND_AUTH_PUBLIC_KEY", source).strip()
+        run_background = get_env_or_default(
+            "BACKEND_RUN_BACKGROUND", "true", source
+        ).lower() in ("1", "true", "yes")
+        data_dir = get_env_or_default("BACKEND_DATA_DIR", "data", source)
+        vk_user_profile_max_age_n_seconds = _load_vk_user_profile_max_age_n_seconds(
+            source
+        )
 
         return BackendConfig(
             port=port,
@@ -31,7 +48,71 @@ class BackendConfig:
             vk_redirect_uri=vk_redirect_uri,
             auth_private_key=auth_private_key,
             auth_public_key=auth_public_key,
+            run_background=run_background,
+            data_dir=data_dir,
+            vk_user_profile_max_age_n_seconds=vk_user_profile_max_age_n_seconds,
+        )
+
+
+@dataclass
+class BackgroundConfig:
+    max_concurrent_jobs: int
+    max_concurrent_jobs_per_user: int
+    max_queued_jobs: int
+    poll_every_n_seconds: float
+    # NB: See `memberships.MembershipStorageBackend`.
+    membership_storage: Literal["ROWS", "SNAPSHOTS"]
+    # NB: Average portraits are built in the background too, see `BackendConfig`.
+    vk_user_profile_max_age_n_seconds: int
+
+    @staticmethod
+    def load_from_env() -> "BackgroundConfig":
+        source = {
+            **os.environ,
+        }
+
+        max_concurrent_jobs = int(
+            get_env_or_default("BACKGROUND_MAX_CONCURRENT_JOBS", "4", source)
+        )
+        max_concurrent_jobs_per_user = int(
+            get_env_or_default("BACKGROUND_MAX_CONCURRENT_JOBS_PER_USER", "1", source)
+        )
+        max_queued_jobs = int(
+            get_env_or_default("BACKGROUND_MAX_QUEUED_JOBS", "4", source)
+        )
+        poll_every_n_seconds = float(
+            get_env_or_default("BACKGROUND_POLL_EVERY_N_SECONDS", "60", source)
+        )
+        membership_storage = get_env_or_default(
+            "BACKGROUND_MEMBERSHIP_STORAGE", "SNAPSHOTS", source
+        )
+        if membership_storage not in ("ROWS", "SNAPSHOTS"):
+            raise ValueError(
+                f"Invalid BACKGROUND_MEMBERSHIP_STORAGE: {membership_storage}"
+            )
+        vk_user_profile_max_age_n_seconds = _load_vk_user_profile_max_age_n_seconds(
+            source
+        )
+
+        return BackgroundConfig(
+            max_concurrent_jobs=max_concurrent_jobs,
+            max_concurrent_jobs_per_user=max_concurrent_jobs_per_user,
+            max_queued_jobs=max_queued_jobs,
+            poll_every_n_seconds=poll_every_n_seconds,
+            membership_storage=membership_storage,
+            vk_user_profile_max_age_n_seconds=vk_user_profile_max_age_n_seconds,
+        )
+
+
+# NB: Shared by the API and the background, which both read VK profiles.
+def _load_vk_user_profile_max_age_n_seconds(source: dict[str, str]) -> int:
+    return int(
+        get_env_or_default(
+            "BACKEND_VK_USER_PROFILE_MAX_AGE_N_SECONDS",
+            str(7 * 24 * 60 * 60),
+            source,
         )
+    )
 
 
 @dataclass
@@ -1,19 +1,20 @@
 import asyncio
-import json
-from typing import Any
+from pathlib import Path
 
-import asyncpg
 import background
 import httpx
+import postgres
 import structlog
 import uvicorn
 import vk
 from api import ApiState
+from api.job_events import JobEventsHub
 from app import build_app
-from config import BackendConfig, PostgresConfig, VkConfig
+from config import BackendConfig, BackgroundConfig, PostgresConfig, VkConfig
 from dotenv import load_dotenv
+from memberships import MembershipIndex, MembershipStorage
 from migrations import migrate_postgres
-from pydantic import BaseModel
+from portraits import PortraitCache
 from vk.oauth.authorize import BuildAuthorizeUrlOptions
 
 log = structlog.stdlib.get_logger()
@@ -27,6 +28,7 @@ async def main():
     backend_config = BackendConfig.load_from_env()
     vk_config = VkConfig.load_from_env()
     pg_config = PostgresConfig.load_from_env()
+    background_config = BackgroundConfig.load_from_env()
     log.info("Configs loaded.")
 
     log.info(
@@ -40,7 +42,7 @@ async def main():
     )
 
     log.info("Building Postgres pool...")
-    pg_pool = await connect_postgres(pg_config)
+    pg_pool = await postgres.connection.connect_postgres(pg_config)
     log.info("Postgres pool built.")
     log.info("Migrating Postgres...")
     await migrate_postgres(pg_pool)
@@ -49,6 +51,19 @@ async def main():
     vk_client = vk.Client(
         http_client=httpx.AsyncClient(),
         access_token=vk_config.service_access_token,
+        coalesce_calls=True,
+    )
+
+    job_events = JobEventsHub(pg_pool)
+    membership_storage = MembershipStorage(pg_pool)
+    memberships = MembershipIndex(
+        membership_storage,
+        data_dir=Path(backend_config.data_dir) / "memberships",
+    )
+    portraits = PortraitCache(
+        pg_pool,
+        membership_storage,
+        max_profile_age_n_seconds=backend_config.vk_user_profile_max_age_n_seconds,
     )
 
     log.info("Building the app...")
@@ -57,6 +72,9 @@ async def main():
         backend_config=backend_config,
         pg_pool=pg_pool,
         vk_client=vk_client,
+        job_events=job_events,
+        memberships=memberships,
+        portraits=portraits,
     )
     app = build_app(state)
     log.info("App built.")
@@ -73,14 +91,18 @@ async def main():
     uvicorn_server = uvicorn.Server(config=uvicorn_config)
     log.info("Uvicorn server instantiated.")
 
-    log.info("Starting background subsystems...")
-    _group_update_driver = asyncio.create_task(
-        background.groups.drive_update_jobs(
-            pg_pool,
-            httpx.AsyncClient(),
-            drive_every_n_seconds=5,
+    job_events_task = asyncio.create_task(job_events.run())
+
+    background_task: asyncio.Task | None = None
+    if backend_config.run_background:
+        log.info("Starting background subsystems...")
+        background_task = asyncio.create_task(
+            background.run_background(pg_pool, vk_client, background_config)
+        )
+    else:
+        log.info(
+            "Background subsystems are disabled, run them with `python -m background`"
         )
-    )
 
     try:
         log.info("Starting Uvicorn server...")
@@ -88,38 +110,13 @@ async def main():
         log.info("Uvicorn server stopped gracefully.")
     except Exception as e:
         log.exception("An error occurred while running the Uvicorn server: %s", e)
+    finally:
+        job_events_task.cancel()
 
-
-async def connect_postgres(config: PostgresConfig) -> asyncpg.Pool:
-    pool = await asyncpg.create_pool(dsn=config.dsn, init=_init_conn)
-    if not pool:
-        raise ValueError("Failed to create Postgres connection pool")
-    return pool
-
-
-async def _init_conn(conn: asyncpg.Connection):
-    await conn.set_type_codec(
-        "JSONB",
-        encoder=_jsonb_encoder,
-        decoder=_jsonb_decoder,
-        schema="pg_catalog",
-    )
-
-
-def _jsonb_encoder(
-    # NB: Should be `Unknown`, but there is none.
-    value: Any,
-) -> str:
-    if isinstance(value, BaseModel):
-        return value.model_dump_json()
-    raise TypeError("Encoding JSONB type for Postgres without using Pydantic model")
-
-
-def _jsonb_decoder(
-    # NB: Should be `Unknown`, but there is none.
-    value: Any,
-) -> Any:
-    return json.loads(value)
+        if background_task:
+            log.info("Stopping background subsystems...")
+            background_task.cancel()
+            await asyncio.wait([background_task])
 
 
 if __name__ == "__main__":
@@ -0,0 +1,27 @@
+from . import set_expression
+from .index import MembershipIndex
+from .set_expression import SetExpression
+from .set_ops import (
+    MAX_NUM_PAIRWISE_ARRAYS,
+    at_least_k_sorted,
+    count_pairwise_intersections,
+    difference_sorted,
+    intersect_sorted,
+    union_sorted,
+)
+from .storage import MembershipStorage, MembershipStorageBackend, MemberIdsSnapshot
+
+__all__ = [
+    "set_expression",
+    "MembershipIndex",
+    "MembershipStorage",
+    "MembershipStorageBackend",
+    "MemberIdsSnapshot",
+    "SetExpression",
+    "MAX_NUM_PAIRWISE_ARRAYS",
+    "at_least_k_sorted",
+    "count_pairwise_intersections",
+    "difference_sorted",
+    "intersect_sorted",
+    "union_sorted",
+]
@@ -0,0 +1,301 @@
+import asyncio
+import os
+from collections import OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+
+import numpy as np
+import structlog
+
+from . import set_expression, sketch
+from .set_expression import GroupSet, IntersectionSet, SetExpression
+from .set_ops import count_pairwise_intersections, intersect_sorted
+from .storage import MembershipStorage
+
+log = structlog.stdlib.get_logger()
+
+# --------------------------------------------------------------------------------------------------
+
+# NB: 4 bytes per member, i.e. ~200MB of arrays, mostly page cache of the mapped files.
+MAX_CACHED_MEMBERS = 50_000_000
+
+
+@dataclass
+class _CachedMembers:
+    members_version: int
+    user_ids: np.ndarray
+
+
+# --------------------------------------------------------------------------------------------------
+
+
+# Member ids of groups as sorted `uint32` arrays, for intersecting groups without Postgres.
+#
+# Arrays live in an in-memory LRU and are persisted as `.npy` files under `data_dir`,
+# which are memory-mapped on load, so they survive restarts and are shared via the page cache
+# between processes. Everything is keyed by `vk_groups.members_version`, which is bumped
+# whenever an update job changes the members, so stale arrays are never served.
+class MembershipIndex:
+    def __init__(
+        self,
+        storage: MembershipStorage,
+        *,
+        data_dir: Path,
+        max_cached_members: int = MAX_CACHED_MEMBERS,
+    ) -> None:
+        self.storage = storage
+        self.data_dir = data_dir
+        self.max_cached_members = max_cached_members
+
+        self._cache: OrderedDict[int, _CachedMembers] = OrderedDict()
+        self._num_cached_members = 0
+        self._loading: dict[int, asyncio.Task[_CachedMembers]] = {}
+
+    # Users who are members of all the groups, sorted.
+    #
+    # NB:
+    #   Results are stored with the versions of the groups and served until one of them
+    #   changes, so that popular requests, reopened many times and by many API processes,
+    #   don't load the groups at all.
+    async def intersect(self, group_ids: list[int]) -> np.ndarray:
+        group_ids = sorted(set(group_ids))
+        members_versions = await self._list_members_versions(group_ids)
+
+        # NB: A single group is its own intersection, no need to store it twice.
+        is_materialized = len(group_ids) > 1
+
+        if is_materialized:
+            intersection = await self.storage.read_intersection(
+                group_ids,
+                members_versions,
+            )
+            if intersection is not None:
+                return intersection
+
+        member_ids = await asyncio.gather(
+            *(
+                self._get_user_ids(group_id, members_version)
+                for group_id, members_version in zip(group_ids, members_versions)
+            )
+        )
+        intersection = await asyncio.to_thread(intersect_sorted, member_ids)
+
+        if is_materialized:
+            # NB: Members may be newer than `members_versions`, but never older,
+            # so at worst the result is recomputed once more than needed.
+            await self.storage.write_intersection(
+                group_ids,
+                members_versions,
+                intersection,
+            )
+
+        return intersection
+
+    # Users in the audience described by the expression, sorted.
+    #
+    # NB:
+    #   Results are stored with the versions of the groups like intersections,
+    #   see `intersect`, so that paging through an audience doesn't evaluate
+    #   its expression for every page.
+    async def evaluate(self, expression: SetExpression) -> np.ndarray:
+        # NB: Plain intersections are materialized, see `intersect`.
+        if isinstance(expression, IntersectionSet) and all(
+            isinstance(operand, GroupSet) for operand in expression.operands
+        ):
+            return await self.intersect(
+                [operand.group_id for operand in expression.operands]
+            )
+
+        group_ids = set_expression.list_group_ids(expression)
+        members_versions = await self._list_members_versions(group_ids)
+
+        # NB: A single group is its own result, no need to store it twice.
+        is_materialized = not isinstance(expression, GroupSet)
+        expression_fingerprint = set_expression.fingerprint(expression)
+
+        if is_materialized:
+            member_set = await self.storage.read_member_set(
+                expression_fingerprint,
+                members_versions,
+            )
+            if member_set is not None:
+                return member_set
+
+        member_ids = await asyncio.gather(
+            *(
+                self._get_user_ids(group_id, members_version)
+                for group_id, members_version in zip(group_ids, members_versions)
+            )
+        )
+        member_set = await asyncio.to_thread(
+            set_expression.evaluate,
+            expression,
+            dict(zip(group_ids, member_ids)),
+        )
+
+        if is_materialized:
+            # NB: Like in `intersect`, members may be newer than `members_versions`.
+            await self.storage.write_member_set(
+                expression_fingerprint,
+                group_ids,
+                members_versions,
+                member_set,
+            )
+
+        return member_set
+
+    # Sizes of the intersections of every pair of the groups, as a matrix
+    # indexed by the positions in `group_ids`, which must be unique.
+    async def count_pairwise_intersections(self, group_ids: list[int]) -> np.ndarray:
+        member_ids = await self.get_member_ids(group_ids)
+        return await asyncio.to_thread(
+            count_pairwise_intersections,
+            [member_ids[group_id] for group_id in group_ids],
+        )
+
+    # Sketches of the members of the groups, see `sketch.py`.
+    #
+    # NB:
+    #   Update jobs keep sketches up to date, missing or outdated ones, e.g. of groups
+    #   updated before sketches existed, are built from the members and stored.
+    async def get_sketches(self, group_ids: list[int]) -> dict[int, np.ndarray]:
+        stored_sketches = {
+            stored_sketch.id: stored_sketch
+            for stored_sketch in await self.storage.list_sketches(group_ids)
+        }
+
+        async def get_sketch(group_id: int) -> np.ndarray:
+            stored_sketch = stored_sketches.get(group_id)
+            if (
+                stored_sketch
+                and stored_sketch.members_sketch is not None
+                and stored_sketch.members_sketch_version
+                == stored_sketch.members_version
+            ):
+                return sketch.decode_sketch(stored_sketch.members_sketch)
+
+            members_version = stored_sketch.members_version if stored_sketch else 0
+            user_ids = await self._get_user_ids(group_id, members_version)
+            members_sketch = await asyncio.to_thread(sketch.build_sketch, user_ids)
+            if stored_sketch:
+                await self.storage.write_sketch(
+                    group_id,
+                    members_version,
+                    members_sketch,
+                )
+
+            return members_sketch
+
+        members_sketches = await asyncio.gather(*map(get_sketch, group_ids))
+        return dict(zip(group_ids, members_sketches))
+
+    async def get_member_ids(self, group_ids: list[int]) -> dict[int, np.ndarray]:
+        members_versions = await self._list_members_versions(group_ids)
+
+        user_ids = await asyncio.gather(
+            *(
+                self._get_user_ids(group_id, members_version)
+                for group_id, members_version in zip(group_ids, members_versions)
+            )
+        )
+        return dict(zip(group_ids, user_ids))
+
+    # NB: Groups missing from `vk_groups` have no members, so version 0.
+    async def _list_members_versions(self, group_ids: list[int]) -> list[int]:
+        members_versions = await self.storage.list_members_versions(group_ids)
+        return [members_versions.get(group_id, 0) for group_id in group_ids]
+
+    async def _get_user_ids(self, group_id: int, members_version: int) -> np.ndarray:
+        while True:
+            cached = self._cache.get(group_id)
+            # NB: A newer version may have been loaded since we read the version.
+            if cached and cached.members_version >= members_version:
+                self._cache.move_to_end(group_id)
+                return cached.user_ids
+
+            # NB: Concurrent requests for the same group share a single load.
+            task = self._loading.get(group_id)
+            if task is None:
+                task = asyncio.create_task(self._load(group_id, members_version))
+                self._loading[group_id] = task
+                task.add_done_callback(lambda _: self._loading.pop(group_id, None))
+
+            # NB: Don't cancel the load for everyone if one of the requests is cancelled.
+            loaded = await asyncio.shield(task)
+            # NB: Otherwise we joined the load of an older version, retry.
+            if loaded.members_version >= members_version:
+                return loaded.user_ids
+
+    async def _load(self, group_id: int, members_version: int) -> _CachedMembers:
+        try:
+            user_ids = await asyncio.to_thread(
+                np.load,
+                self._path(group_id, members_version),
+                mmap_mode="r",
+            )
+            loaded = _CachedMembers(members_version=members_version, user_ids=user_ids)
+        except FileNotFoundError:
+            loaded = await self._load_from_storage(group_id)
+
+        self._put(group_id, loaded)
+        return loaded
+
+    async def _load_from_storage(self, group_id: int) -> _CachedMembers:
+        log.info("Loading group members into the membership index", group_id=group_id)
+
+        snapshot = await self.storage.read_member_ids(group_id)
+        path = self._path(group_id, snapshot.members_version)
+
+        try:
+            user_ids = await asyncio.to_thread(
+                _save_and_map,
+                path,
+                snapshot.user_ids,
+            )
+        except OSError as e:
+            # NB: The index still works, just without persistence.
+            log.warn("Failed to persist group members", group_id=group_id, error=e)
+            user_ids = snapshot.user_ids
+
+        return _CachedMembers(
+            members_version=snapshot.members_version,
+            user_ids=user_ids,
+        )
+
+    def _put(self, group_id: int, loaded: _CachedMembers) -> None:
+        replaced = self._cache.pop(group_id, None)
+        if replaced:
+            self._num_cached_members -= len(replaced.user_ids)
+
+        self._cache[group_id] = loaded
+        self._num_cached_members += len(loaded.user_ids)
+
+        # NB: Keeps the group that was just loaded, even if it alone is over the limit.
+        while (
+            self._num_cached_members > self.max_cached_members and len(self._cache) > 1
+        ):
+            _, evicted = self._cache.popitem(last=False)
+            self._num_cached_members -= len(evicted.user_ids)
+
+    def _path(self, group_id: int, members_version: int) -> Path:
+        return self.data_dir / f"{group_id}.v{members_version}.npy"
+
+
+# NB:
+#   Written to a temporary file and renamed, so that other processes never map
+#   a partially written file. Files of older versions are removed, processes
+#   that still map them keep working, since unlinking doesn't unmap.
+def _save_and_map(path: Path, user_ids: np.ndarray) -> np.ndarray:
+    path.parent.mkdir(parents=True, exist_ok=True)
+
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    with open(tmp_path, "wb") as f:
+        np.save(f, user_ids)
+    os.replace(tmp_path, path)
+
+    group_id = path.name.split(".", 1)[0]
+    for old_path in path.parent.glob(f"{group_id}.v*.npy"):
+        if old_path != path:
+            old_path.unlink(missing_ok=True)
+
+    return np.load(path, mmap_mode="r")
@@ -0,0 +1,139 @@
+import hashlib
+from collections.abc import Mapping
+from typing import Annotated, Literal, Union
+
+import numpy as np
+from pydantic import BaseModel, Field, TypeAdapter, model_validator
+
+from .set_ops import (
+    at_least_k_sorted,
+    difference_sorted,
+    intersect_sorted,
+    union_sorted,
+)
+
+# --------------------------------------------------------------------------------------------------
+# NB:
+#   Audiences built from group members, e.g. "members of A and B but not C"
+#   is `DIFFERENCE(INTERSECTION(A, B), C)`, "in at least 3 of these 8 groups"
+#   is `AT_LEAST(3, ...)`.
+
+
+class GroupSet(BaseModel):
+    type: Literal["GROUP"]
+    group_id: int
+
+
+class IntersectionSet(BaseModel):
+    type: Literal["INTERSECTION"]
+    operands: list["SetExpression"] = Field(..., min_length=1)
+
+
+class UnionSet(BaseModel):
+    type: Literal["UNION"]
+    operands: list["SetExpression"] = Field(..., min_length=1)
+
+
+class DifferenceSet(BaseModel):
+    type: Literal["DIFFERENCE"]
+    left: "SetExpression"
+    right: "SetExpression"
+
+
+class AtLeastSet(BaseModel):
+    type: Literal["AT_LEAST"]
+    k: int = Field(..., ge=1)
+    operands: list["SetExpression"] = Field(..., min_length=1)
+
+    @model_validator(mode="after")
+    def _ensure_k_fits(self) -> "AtLeastSet":
+        if self.k > len(self.operands):
+            raise ValueError("`k` must not exceed the number of operands")
+
+        return self
+
+
+SetExpression = Annotated[
+    Union[
+        GroupSet,
+        IntersectionSet,
+        UnionSet,
+        DifferenceSet,
+        AtLeastSet,
+    ],
+    Field(..., discriminator="type"),
+]
+
+IntersectionSet.model_rebuild()
+UnionSet.model_rebuild()
+DifferenceSet.model_rebuild()
+AtLeastSet.model_rebuild()
+
+_SET_EXPRESSION_ADAPTER: TypeAdapter[SetExpression] = TypeAdapter(SetExpression)
+
+
+# --------------------------------------------------------------------------------------------------
+
+
+# Unique ids of the groups in the expression, in the order of appearance.
+def list_group_ids(expression: SetExpression) -> list[int]:
+    group_ids: dict[int, None] = {}
+
+    def visit(expression: SetExpression) -> None:
+        match expression:
+            case GroupSet():
+                group_ids[expression.group_id] = None
+            case IntersectionSet() | UnionSet() | AtLeastSet():
+                for operand in expression.operands:
+                    visit(operand)
+            case DifferenceSet():
+                visit(expression.left)
+                visit(expression.right)
+
+    visit(expression)
+    return list(group_ids)
+
+
+# Hash of the expression, the same for equal expressions, e.g. to store results by.
+#
+# NB: Operands are hashed in order, so reordered expressions get different fingerprints.
+def fingerprint(expression: SetExpression) -> str:
+    return hashlib.sha256(_SET_EXPRESSION_ADAPTER.dump_json(expression)).hexdigest()
+
+
+def count_nodes(expression: SetExpression) -> int:
+    match expression:
+        case GroupSet():
+            return 1
+        case IntersectionSet() | UnionSet() | AtLeastSet():
+            return 1 + sum(count_nodes(operand) for operand in expression.operands)
+        case DifferenceSet():
+            return 1 + count_nodes(expression.left) + count_nodes(expression.right)
+
+
+# Evaluates the expression over sorted member ids of its groups, the result is sorted.
+def evaluate(
+    expression: SetExpression,
+    member_ids: Mapping[int, np.ndarray],
+) -> np.ndarray:
+    match expression:
+        case GroupSet():
+            return member_ids[expression.group_id]
+        case IntersectionSet():
+            return intersect_sorted(
+                [evaluate(operand, member_ids) for operand in expression.operands]
+            )
+        case UnionSet():
+            return union_sorted(
+                [evaluate(operand, member_ids) for operand in expression.operands]
+            )
+        case DifferenceSet():
+            return difference_sorted(
+                evaluate(expression.left, member_ids),
+                evaluate(expression.right, member_ids),
+            )
+        case AtLeastSet():
+            return at_least_k_sorted(
+                [evaluate(operand, member_ids) for operand in expression.operands],
+                expression.k,
+            )
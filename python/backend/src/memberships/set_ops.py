@@ -0,0 +1,108 @@
+import numpy as np
+
+# --------------------------------------------------------------------------------------------------
+
+
+# Intersects sorted arrays of unique ids, the result is sorted too.
+#
+# NB:
+#   Starts from the smallest array and binary searches its ids in the others,
+#   so the cost is `O(smallest * log(largest))` rather than the total size.
+def intersect_sorted(arrays: list[np.ndarray]) -> np.ndarray:
+    if not arrays:
+        return np.empty(0, dtype=np.uint32)
+
+    arrays = sorted(arrays, key=len)
+    result = np.asarray(arrays[0])
+
+    for other in arrays[1:]:
+        if len(result) == 0 or len(other) == 0:
+            return np.empty(0, dtype=np.uint32)
+
+        indices = np.searchsorted(other, result)
+        np.minimum(indices, len(other) - 1, out=indices)
+        result = result[other[indices] == result]
+
+    return result
+
+
+# Unites sorted arrays of unique ids, the result is sorted and unique.
+def union_sorted(arrays: list[np.ndarray]) -> np.ndarray:
+    if not arrays:
+        return np.empty(0, dtype=np.uint32)
+
+    return np.unique(np.concatenate(arrays))
+
+
+# Ids of sorted `left` that are missing from sorted `right`.
+def difference_sorted(left: np.ndarray, right: np.ndarray) -> np.ndarray:
+    if len(left) == 0 or len(right) == 0:
+        return left
+
+    indices = np.searchsorted(right, left)
+    np.minimum(indices, len(right) - 1, out=indices)
+    return left[right[indices] != left]
+
+
+# Ids present in at least `k` of the sorted arrays of unique ids.
+#
+# NB: `k = 1` is the union and `k = len(arrays)` is the intersection, both are cheaper.
+def at_least_k_sorted(arrays: list[np.ndarray], k: int) -> np.ndarray:
+    if k <= 1:
+        return union_sorted(arrays)
+    if k > len(arrays):
+        return np.empty(0, dtype=np.uint32)
+    if k == len(arrays):
+        return intersect_sorted(arrays)
+
+    ids, counts = np.unique(np.concatenate(arrays), return_counts=True)
+    return ids[counts >= k]
+
+
+# NB: Bitmasks of `count_pairwise_intersections` are 64-bit.
+MAX_NUM_PAIRWISE_ARRAYS = 64
+
+_PAIRWISE_CHUNK_SIZE = 65_536
+
+
+# Sizes of the intersections of every pair of sorted arrays of unique ids, as a matrix,
+# the diagonal is the sizes of the arrays.
+#
+# NB:
+#   A single pass over all ids instead of an intersection per pair: every id gets
+#   a bitmask of the arrays it is in, and ids sharing a bitmask are counted together,
+#   since there are usually far fewer distinct bitmasks than ids.
+def count_pairwise_intersections(arrays: list[np.ndarray]) -> np.ndarray:
+    num_arrays = len(arrays)
+    if num_arrays > MAX_NUM_PAIRWISE_ARRAYS:
+        raise ValueError(f"At most {MAX_NUM_PAIRWISE_ARRAYS} arrays are supported")
+
+    # NB: Ids are 32-bit, so an id and the index of its array fit into a single key.
+    keys = np.concatenate(
+        [np.empty(0, dtype=np.uint64)]
+        + [
+            (np.asarray(array).astype(np.uint64) << np.uint64(32)) | np.uint64(i)
+            for i, array in enumerate(arrays)
+        ]
+    )
+    keys.sort()
+
+    result = np.zeros((num_arrays, num_arrays), dtype=np.int64)
+    if len(keys) == 0:
+        return result
+
+    ids = keys >> np.uint64(32)
+    bits = np.left_shift(np.uint64(1), keys & np.uint64(0xFFFFFFFF))
+    del keys
+
+    starts = np.flatnonzero(np.concatenate([[True], ids[1:] != ids[:-1]]))
+    masks, counts = np.unique(np.bitwise_or.reduceat(bits, starts), return_counts=True)
+
+    array_bits = np.arange(num_arrays, dtype=np.uint64)
+    for start in range(0, len(masks), _PAIRWISE_CHUNK_SIZE):
+        chunk = slice(start, start + _PAIRWISE_CHUNK_SIZE)
+        # NB: Counts are exact in `float64`, and `float64` products are BLAS-fast.
+        is_in = ((masks[chunk, None] >> array_bits) & np.uint64(1)).astype(np.float64)
+        result += np.rint((is_in * counts[chunk, None]).T @ is_in).astype(np.int64)
+
+    return result
@@ -0,0 +1,205 @@
+from dataclasses import dataclass
+from itertools import pairwise
+
+import numpy as np
+
+# --------------------------------------------------------------------------------------------------
+# NB:
+#   Bottom-k MinHash sketches: the `SKETCH_SIZE` smallest 64-bit hashes of the members.
+#   A single sketch estimates the number of members within ~3%, several of them estimate
+#   the size of their union and intersection, and the Jaccard similarity. Intersections
+#   that are a small share of the union are less precise, e.g. ~8% at a Jaccard of 0.1.
+#   Groups smaller than `SKETCH_SIZE` are sketched in full, so their estimates are exact.
+
+SKETCH_SIZE = 1024
+
+
+@dataclass
+class OverlapEstimate:
+    num_union_members: float
+    num_intersection_members: float
+    jaccard: float
+    is_exact: bool
+
+
+@dataclass
+class PairwiseOverlapEstimate:
+    num_members: np.ndarray
+    # NB: Matrices indexed by the positions of the sketches.
+    num_intersection_members: np.ndarray
+    jaccard: np.ndarray
+    is_exact: bool
+
+
+def build_sketch(user_ids: np.ndarray) -> np.ndarray:
+    hashes = _hash(user_ids)
+    if len(hashes) > SKETCH_SIZE:
+        hashes = np.partition(hashes, SKETCH_SIZE - 1)[:SKETCH_SIZE]
+
+    return np.sort(hashes)
+
+
+def encode_sketch(sketch: np.ndarray) -> bytes:
+    return sketch.astype("<u8").tobytes()
+
+
+def decode_sketch(data: bytes) -> np.ndarray:
+    return np.frombuffer(data, dtype="<u8").astype(np.uint64)
+
+
+def estimate_num_members(sketch: np.ndarray) -> float:
+    if len(sketch) < SKETCH_SIZE:
+        return float(len(sketch))
+
+    return (SKETCH_SIZE - 1) / _to_unit_interval(sketch[SKETCH_SIZE - 1])
+
+
+# NB:
+#   The `SKETCH_SIZE` smallest hashes of the union are a uniform sample of it,
+#   and each of them is in a group's sketch iff it is in the group,
+#   so the share of them found in all sketches estimates the Jaccard similarity.
+def estimate_overlap(sketches: list[np.ndarray]) -> OverlapEstimate:
+    if not sketches:
+        return OverlapEstimate(
+            num_union_members=0,
+            num_intersection_members=0,
+            jaccard=0,
+            is_exact=True,
+        )
+
+    union = np.unique(np.concatenate(sketches))[:SKETCH_SIZE]
+    is_in_all = np.ones(len(union), dtype=bool)
+    for sketch in sketches:
+        is_in_all &= _contains_sorted(sketch, union)
+    num_in_all = int(np.count_nonzero(is_in_all))
+
+    if len(union) < SKETCH_SIZE:
+        return OverlapEstimate(
+            num_union_members=float(len(union)),
+            num_intersection_members=float(num_in_all),
+            jaccard=num_in_all / len(union) if len(union) else 0,
+            is_exact=True,
+        )
+
+    num_union_members = estimate_num_members(union)
+    jaccard = num_in_all / SKETCH_SIZE
+    return OverlapEstimate(
+        num_union_members=num_union_members,
+        num_intersection_members=jaccard * num_union_members,
+        jaccard=jaccard,
+        is_exact=False,
+    )
+
+
+# NB:
+#   A sketch holds all the hashes of its group up to its largest one, so up to the smaller
+#   of the largest hashes of two sketches, both groups, their union and intersection are
+#   known exactly, which is a uniform sample of the union of at least `SKETCH_SIZE` hashes.
+#   Hashes found in both sketches are always below it, so they're counted for all pairs
+#   at once, rather than merging the sketches of every pair.
+def estimate_pairwise_overlaps(sketches: list[np.ndarray]) -> PairwiseOverlapEstimate:
+    # NB: Sketches of small groups are complete, there is no hash they could be missing.
+    is_complete = np.array(
+        [len(sketch) < SKETCH_SIZE for sketch in sketches], dtype=bool
+    )
+    largest_hashes = np.array(
+        [
+            _MAX_HASH if is_complete[i] else sketch[-1]
+            for i, sketch in enumerate(sketches)
+        ],
+        dtype=np.uint64,
+    )
+    thresholds = np.minimum(largest_hashes[:, None], largest_hashes[None, :])
+
+    num_below = np.array(
+        [
+            np.searchsorted(sketch, thresholds[i], side="right")
+            for i, sketch in enumerate(sketches)
+        ],
+        dtype=np.int64,
+    ).reshape(len(sketches), len(sketches))
+    num_shared = _count_shared_hashes(sketches)
+    num_sampled = num_below + num_below.T - num_shared
+
+    jaccard = np.divide(
+        num_shared,
+        num_sampled,
+        out=np.zeros(num_shared.shape, dtype=np.float64),
+        where=num_sampled > 0,
+    )
+    # NB: The threshold is one of the sampled hashes, see `estimate_num_members`.
+    num_union_members = np.where(
+        thresholds == _MAX_HASH,
+        num_sampled,
+        (num_sampled - 1) / ((thresholds.astype(np.float64) + 1) / 2.0**64),
+    )
+
+    num_members = np.array([estimate_num_members(sketch) for sketch in sketches])
+    # NB: Tiny intersections of large groups are noisy, but never larger than either group.
+    num_intersection_members = np.minimum(
+        jaccard * num_union_members,
+        np.minimum(num_members[:, None], num_members[None, :]),
+    )
+
+    return PairwiseOverlapEstimate(
+        num_members=num_members,
+        num_intersection_members=num_intersection_members,
+        jaccard=jaccard,
+        is_exact=bool(np.all(is_complete)),
+    )
+
+
+# --------------------------------------------------------------------------------------------------
+
+_MAX_HASH = np.iinfo(np.uint64).max
+
+_SHARED_HASHES_CHUNK_SIZE = 16_384
+
+
+def _count_shared_hashes(sketches: list[np.ndarray]) -> np.ndarray:
+    num_sketches = len(sketches)
+    result = np.zeros((num_sketches, num_sketches), dtype=np.int64)
+    if num_sketches == 0:
+        return result
+
+    hashes, rows = np.unique(np.concatenate(sketches), return_inverse=True)
+    columns = np.repeat(
+        np.arange(num_sketches),
+        [len(sketch) for sketch in sketches],
+    )
+    order = np.argsort(rows, kind="stable")
+    rows, columns = rows[order], columns[order]
+
+    # NB: A dense hash-by-sketch matrix would be too large, so it's multiplied in chunks.
+    chunk_starts = range(
+        0, len(hashes) + _SHARED_HASHES_CHUNK_SIZE, _SHARED_HASHES_CHUNK_SIZE
+    )
+    bounds = np.searchsorted(rows, chunk_starts)
+    for chunk_start, (lo, hi) in zip(chunk_starts, pairwise(bounds)):
+        is_in = np.zeros((_SHARED_HASHES_CHUNK_SIZE, num_sketches), dtype=np.float32)
+        is_in[rows[lo:hi] - chunk_start, columns[lo:hi]] = 1
+        result += np.rint(is_in.T @ is_in).astype(np.int64)
+
+    return result
+
+
+# NB: The SplitMix64 finalizer, a fast well-mixing hash of 64-bit integers.
+def _hash(user_ids: np.ndarray) -> np.ndarray:
+    with np.errstate(over="ignore"):
+        z = user_ids.astype(np.uint64) + np.uint64(0x9E3779B97F4A7C15)
+        z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+        return z ^ (z >> np.uint64(31))
+
+
+def _to_unit_interval(value: np.uint64) -> float:
+    return (float(value) + 1) / 2.0**64
+
+
+def _contains_sorted(haystack: np.ndarray, needles: np.ndarray) -> np.ndarray:
+    if len(haystack) == 0:
+        return np.zeros(len(needles), dtype=bool)
+
+    indices = np.searchsorted(haystack, needles)
+    np.minimum(indices, len(haystack) - 1, out=indices)
+    return haystack[indices] == needles
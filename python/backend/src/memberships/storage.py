@@ -0,0 +1,218 @@
+import asyncio
+from dataclasses import dataclass
+from typing import Literal
+from uuid import UUID
+
+import asyncpg
+import numpy as np
+import postgres
+
+from . import sketch
+
+# --------------------------------------------------------------------------------------------------
+
+# NB:
+#   "ROWS" is a `vk_group_members` row per membership, "SNAPSHOTS" is a compressed
+#   `vk_group_member_snapshots` row per group, an order of magnitude smaller and faster to read.
+MembershipStorageBackend = Literal["ROWS", "SNAPSHOTS"]
+
+
+@dataclass
+class MemberIdsSnapshot:
+    members_version: int
+    # NB: Sorted `uint32`, VK user ids are positive `INT`s.
+    user_ids: np.ndarray
+
+
+# --------------------------------------------------------------------------------------------------
+
+
+# The single entry point for reading and writing group members.
+#
+# Reads work with either backend, since each group is stored in exactly one of them,
+# so `backend` only picks how update jobs write, and groups move over as they are refreshed.
+class MembershipStorage:
+    def __init__(
+        self,
+        pg_pool: asyncpg.Pool,
+        *,
+        backend: MembershipStorageBackend = "SNAPSHOTS",
+    ) -> None:
+        self.pg_pool = pg_pool
+        self.backend = backend
+
+    # Missing groups are omitted.
+    async def list_members_versions(self, group_ids: list[int]) -> dict[int, int]:
+        return await postgres.vk_groups.list_members_versions(
+            self.pg_pool,
+            group_ids=group_ids,
+        )
+
+    # NB: The version and the members are read in one snapshot, so that they match
+    # even if an update job applies its diff in between.
+    async def read_member_ids(self, group_id: int) -> MemberIdsSnapshot:
+        async with self.pg_pool.acquire() as conn:
+            async with conn.transaction(isolation="repeatable_read", readonly=True):
+                members_version = await conn.fetchval(
+                    """
+                        SELECT members_version
+                        FROM vk_groups
+                        WHERE id = $1
+                    """,
+                    group_id,
+                )
+                snapshot = await postgres.vk_group_member_snapshots.select_by_group_id(
+                    conn,
+                    group_id=group_id,
+                )
+                if not snapshot:
+                    user_ids = await postgres.vk_group_members.copy_sorted_user_ids(
+                        conn,
+                        group_id=group_id,
+                    )
+
+        if snapshot:
+            user_ids = await asyncio.to_thread(
+                postgres.vk_group_member_snapshots.decode_user_ids,
+                snapshot.encoding,
+                snapshot.data,
+            )
+
+        return MemberIdsSnapshot(
+            members_version=members_version or 0,
+            user_ids=user_ids,
+        )
+
+    # The stored intersection of `group_ids` (sorted and unique),
+    # or `None` if there is none or some of the groups have changed since.
+    async def read_intersection(
+        self,
+        group_ids: list[int],
+        members_versions: list[int],
+    ) -> np.ndarray | None:
+        intersection = await postgres.group_member_intersections.select_by_group_ids(
+            self.pg_pool,
+            group_ids=group_ids,
+        )
+        if not intersection or intersection.members_versions != members_versions:
+            return None
+
+        return await asyncio.to_thread(
+            postgres.vk_group_member_snapshots.decode_user_ids,
+            intersection.encoding,
+            intersection.data,
+        )
+
+    async def write_intersection(
+        self,
+        group_ids: list[int],
+        members_versions: list[int],
+        user_ids: np.ndarray,
+    ) -> None:
+        data = await asyncio.to_thread(
+            postgres.vk_group_member_snapshots.encode_user_ids,
+            user_ids,
+        )
+        await postgres.group_member_intersections.upsert(
+            self.pg_pool,
+            intersection=postgres.group_member_intersections.GroupMemberIntersection(
+                group_ids=group_ids,
+                members_versions=members_versions,
+                num_members=len(user_ids),
+                encoding=postgres.vk_group_member_snapshots.ENCODING_DELTA_SHUFFLE_ZLIB,
+                data=data,
+            ),
+        )
+
+    # The stored result of the expression with `expression_fingerprint`,
+    # or `None` if there is none or some of its groups have changed since.
+    async def read_member_set(
+        self,
+        expression_fingerprint: str,
+        members_versions: list[int],
+    ) -> np.ndarray | None:
+        member_set = await postgres.group_member_sets.select_by_expression_fingerprint(
+            self.pg_pool,
+            expression_fingerprint=expression_fingerprint,
+        )
+        if not member_set or member_set.members_versions != members_versions:
+            return None
+
+        return await asyncio.to_thread(
+            postgres.vk_group_member_snapshots.decode_user_ids,
+            member_set.encoding,
+            member_set.data,
+        )
+
+    async def write_member_set(
+        self,
+        expression_fingerprint: str,
+        group_ids: list[int],
+        members_versions: list[int],
+        user_ids: np.ndarray,
+    ) -> None:
+        data = await asyncio.to_thread(
+            postgres.vk_group_member_snapshots.encode_user_ids,
+            user_ids,
+        )
+        await postgres.group_member_sets.upsert(
+            self.pg_pool,
+            member_set=postgres.group_member_sets.GroupMemberSet(
+                expression_fingerprint=expression_fingerprint,
+                group_ids=group_ids,
+                members_versions=members_versions,
+                num_members=len(user_ids),
+                encoding=postgres.vk_group_member_snapshots.ENCODING_DELTA_SHUFFLE_ZLIB,
+                data=data,
+            ),
+        )
+
+    # Missing groups are omitted.
+    async def list_sketches(
+        self,
+        group_ids: list[int],
+    ) -> list[postgres.vk_groups.VkGroupMembersSketch]:
+        return await postgres.vk_groups.list_members_sketches(
+            self.pg_pool,
+            group_ids=group_ids,
+        )
+
+    async def write_sketch(
+        self,
+        group_id: int,
+        members_version: int,
+        members_sketch: np.ndarray,
+    ) -> None:
+        await postgres.vk_groups.update_members_sketch(
+            self.pg_pool,
+            group_id=group_id,
+            members_sketch=sketch.encode_sketch(members_sketch),
+            members_sketch_version=members_version,
+        )
+
+    # Rebuilds the sketch of the group from its current members.
+    async def update_sketch(self, group_id: int) -> None:
+        snapshot = await self.read_member_ids(group_id)
+        members_sketch = await asyncio.to_thread(sketch.build_sketch, snapshot.user_ids)
+        await self.write_sketch(group_id, snapshot.members_version, members_sketch)
+
+    # Replaces the members of the group with the ones staged by the job.
+    async def apply_staged_members(
+        self,
+        *,
+        job_id: UUID,
+        group_id: int,
+    ) -> postgres.vk_group_member_staging.MembershipDiff:
+        match self.backend:
+            case "ROWS":
+                return await postgres.vk_group_member_staging.apply_to_group_members(
+                    self.pg_pool,
+                    job_id=job_id,
+                    group_id=group_id,
+                )
+            case "SNAPSHOTS":
+                return await postgres.vk_group_member_staging.apply_to_group_member_snapshot(
+                    self.pg_pool,
+                    job_id=job_id,
+                    group_id=group_id,
+                )
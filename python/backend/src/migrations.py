@@ -1,8 +1,14 @@
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
+
 import asyncpg
 
+# NB: API and worker processes may start, and migrate, at the same time.
+MIGRATIONS_ADVISORY_LOCK_ID = 7_892_656
+
 
 async def migrate_postgres(pg_pool: asyncpg.Pool):
-    async with pg_pool.acquire() as conn:
+    async with pg_pool.acquire() as conn, _migrations_lock(conn):
         # ------------------------------------------------------------------------------------------
         # Tools.
 
@@ -69,6 +75,76 @@ async def migrate_postgres(pg_pool: asyncpg.Pool):
                 END $$;
             """
         )
+        await conn.execute(
+            """
+                -- NB: Members below this offset are already in `vk_group_member_staging`,
+                -- a restarted job resumes fetching from here.
+                ALTER TABLE group_update_jobs
+                ADD COLUMN IF NOT EXISTS checkpoint_offset INT;
+            """
+        )
+        await conn.execute(
+            """
+                -- NB: A running job belongs to the worker holding an unexpired lease.
+                ALTER TABLE group_update_jobs
+                ADD COLUMN IF NOT EXISTS lease_owner      TEXT,
+                ADD COLUMN IF NOT EXISTS lease_expires_at TIMESTAMPTZ;
+            """
+        )
+        await conn.execute(
+            """
+                -- NB:
+                --   Users whose requests share the job, see `group_update_jobs.insert_many`.
+                --   `user_id` is the one whose access token the job runs with.
+                ALTER TABLE group_update_jobs
+                ADD COLUMN IF NOT EXISTS requester_user_ids INT[] NOT NULL DEFAULT '{}';
+            """
+        )
+        await conn.execute(
+            """
+                -- NB:
+                --   Notifies `group_update_jobs_changed` with the job id on status and progress
+                --   changes, but not on lease renewals. The id only, since a payload must
+                --   fit in 8000 bytes and errors of failed jobs might not.
+                CREATE OR REPLACE FUNCTION notify_group_update_job_changed()
+                RETURNS TRIGGER AS $$
+                BEGIN
+                    PERFORM pg_notify('group_update_jobs_changed', NEW.id::TEXT);
+                    RETURN NEW;
+                END;
+                $$ LANGUAGE 'plpgsql';
+            """
+        )
+        await conn.execute(
+            """
+                DO $$ BEGIN
+                    CREATE TRIGGER notify_group_update_jobs_changed
+                    AFTER UPDATE ON group_update_jobs
+                    FOR EACH ROW
+                    WHEN (
+                           OLD.status IS DISTINCT FROM NEW.status
+                        OR OLD.info IS DISTINCT FROM NEW.info
+                    )
+                    EXECUTE FUNCTION notify_group_update_job_changed();
+                EXCEPTION
+                    WHEN duplicate_object THEN null;
+                END $$;
+            """
+        )
+        await conn.execute(
+            """
+                CREATE INDEX IF NOT EXISTS group_update_jobs_active_group_id_idx
+                ON group_update_jobs (group_id)
+                WHERE status IN ('PENDING', 'RUNNING');
+            """
+        )
+        await conn.execute(
+            """
+                CREATE INDEX IF NOT EXISTS group_update_jobs_active_user_id_created_at_idx
+                ON group_update_jobs (user_id, created_at)
+                WHERE status IN ('PENDING', 'RUNNING');
+            """
+        )
 
         # ------------------------------------------------------------------------------------------
         # Group member intersection requests.
@@ -102,6 +178,85 @@ async def migrate_postgres(pg_pool: asyncpg.Pool):
             """
         )
 
+        # NB:
+        #   Computed intersections, shared by all requests for the same groups.
+        #   Valid while `members_versions` match `vk_groups.members_version` of the groups.
+        await conn.execute(
+            """
+                CREATE TABLE IF NOT EXISTS group_member_intersections (
+                      -- Sorted and unique.
+                      group_ids INT[] PRIMARY KEY
+
+                    , members_versions BIGINT[]    NOT NULL
+                    , num_members      INT         NOT NULL
+                    , encoding         VARCHAR(32) NOT NULL
+                    , data             BYTEA       NOT NULL
+
+                    , created_at TIMESTAMPTZ DEFAULT NOW()
+                    , updated_at TIMESTAMPTZ DEFAULT NOW()
+                );
+            """
+        )
+        await conn.execute(
+            """
+                -- NB: Already compressed, so TOAST shouldn't try again.
+                ALTER TABLE group_member_intersections
+                ALTER COLUMN data SET STORAGE EXTERNAL;
+            """
+        )
+        await conn.execute(
+            """
+                DO $$ BEGIN
+                    CREATE TRIGGER update_group_member_intersections_updated_at
+                    BEFORE UPDATE ON group_member_intersections
+                    FOR EACH ROW
+                    EXECUTE FUNCTION update_updated_at_column();
+                EXCEPTION
+                    WHEN duplicate_object THEN null;
+                END $$;
+            """
+        )
+
+        # NB:
+        #   Evaluated set expressions, like `group_member_intersections`, so that paging
+        #   through an audience doesn't evaluate its expression for every page.
+        await conn.execute(
+            """
+                CREATE TABLE IF NOT EXISTS group_member_sets (
+                      -- Expressions are too long for an index, so they're hashed.
+                      expression_fingerprint VARCHAR(64) PRIMARY KEY
+
+                    , group_ids        INT[]       NOT NULL
+                    , members_versions BIGINT[]    NOT NULL
+                    , num_members      INT         NOT NULL
+                    , encoding         VARCHAR(32) NOT NULL
+                    , data             BYTEA       NOT NULL
+
+                    , created_at TIMESTAMPTZ DEFAULT NOW()
+                    , updated_at TIMESTAMPTZ DEFAULT NOW()
+                );
+            """
+        )
+        await conn.execute(
+            """
+                -- NB: Already compressed, so TOAST shouldn't try again.
+                ALTER TABLE group_member_sets
+                ALTER COLUMN data SET STORAGE EXTERNAL;
+            """
+        )
+        await conn.execute(
+            """
+                DO $$ BEGIN
+                    CREATE TRIGGER update_group_member_sets_updated_at
+                    BEFORE UPDATE ON group_member_sets
+                    FOR EACH ROW
+                    EXECUTE FUNCTION update_updated_at_column();
+                EXCEPTION
+                    WHEN duplicate_object THEN null;
+                END $$;
+            """
+        )
+
         # ------------------------------------------------------------------------------------------
         # User average portrait requests.
 
@@ -132,6 +287,54 @@ async def migrate_postgres(pg_pool: asyncpg.Pool):
                 END $$;
             """
         )
+        await conn.execute(
+            """
+                -- NB: Update jobs look up their requests, see `postgres.user_average_portrait_requests`.
+                CREATE INDEX IF NOT EXISTS user_average_portrait_requests_update_job_ids_idx
+                ON user_average_portrait_requests USING GIN (update_job_ids);
+            """
+        )
+        await conn.execute(
+            """
+                -- NB:
+                --   Set while the portrait of the request is being built, so that views and
+                --   the background don't build it at the same time,
+                --   see `postgres.user_average_portrait_requests`.
+                ALTER TABLE user_average_portrait_requests
+                ADD COLUMN IF NOT EXISTS portrait_build_started_at TIMESTAMPTZ;
+            """
+        )
+
+        # NB:
+        #   Computed portraits, shared by all requests for the same groups.
+        #   Valid while `members_versions` match `vk_groups.members_version` of the groups.
+        await conn.execute(
+            """
+                CREATE TABLE IF NOT EXISTS average_portraits (
+                      -- Sorted and unique.
+                      group_ids INT[] PRIMARY KEY
+
+                    , members_versions BIGINT[] NOT NULL
+                    , num_total_users  INT      NOT NULL
+                    , portrait         JSONB    NOT NULL
+
+                    , created_at TIMESTAMPTZ DEFAULT NOW()
+                    , updated_at TIMESTAMPTZ DEFAULT NOW()
+                );
+            """
+        )
+        await conn.execute(
+            """
+                DO $$ BEGIN
+                    CREATE TRIGGER update_average_portraits_updated_at
+                    BEFORE UPDATE ON average_portraits
+                    FOR EACH ROW
+                    EXECUTE FUNCTION update_updated_at_column();
+                EXCEPTION
+                    WHEN duplicate_object THEN null;
+                END $$;
+            """
+        )
 
         # ------------------------------------------------------------------------------------------
         # VK users.
@@ -166,6 +369,24 @@ async def migrate_postgres(pg_pool: asyncpg.Pool):
                 );
             """
         )
+        await conn.execute(
+            """
+                -- NB:
+                --   Profiles of group members are cached here too, see `portraits/profiles.py`,
+                --   and VK doesn't always return sex, nor keeps names and titles that short.
+                --   The rest of the fields are needed to restore the profiles.
+                ALTER TABLE vk_users
+                ALTER COLUMN sex DROP NOT NULL,
+                ALTER COLUMN first_name  TYPE VARCHAR(128),
+                ALTER COLUMN last_name   TYPE VARCHAR(128),
+                ALTER COLUMN deactivated TYPE VARCHAR(32),
+                ALTER COLUMN country     TYPE VARCHAR(128),
+                ALTER COLUMN city        TYPE VARCHAR(128),
+                ADD COLUMN IF NOT EXISTS last_seen_platform SMALLINT,
+                ADD COLUMN IF NOT EXISTS country_id         INT,
+                ADD COLUMN IF NOT EXISTS city_id            INT;
+            """
+        )
 
         # ------------------------------------------------------------------------------------------
         # VK groups.
@@ -188,6 +409,22 @@ async def migrate_postgres(pg_pool: asyncpg.Pool):
                 );
             """
         )
+        await conn.execute(
+            """
+                -- NB: Bumped whenever `vk_group_members` of the group change,
+                -- caches of the members are keyed by it.
+                ALTER TABLE vk_groups
+                ADD COLUMN IF NOT EXISTS members_version BIGINT NOT NULL DEFAULT 0;
+            """
+        )
+        await conn.execute(
+            """
+                -- NB: See `memberships.sketch`, built from `members_sketch_version` of the members.
+                ALTER TABLE vk_groups
+                ADD COLUMN IF NOT EXISTS members_sketch         BYTEA,
+                ADD COLUMN IF NOT EXISTS members_sketch_version BIGINT;
+            """
+        )
 
         await conn.execute(
             """
@@ -200,6 +437,62 @@ async def migrate_postgres(pg_pool: asyncpg.Pool):
             """
         )
 
+        # NB:
+        #   The same memberships as `vk_group_members`, one compressed row per group.
+        #   A group is stored in exactly one of the two, see `memberships.MembershipStorage`.
+        await conn.execute(
+            """
+                CREATE TABLE IF NOT EXISTS vk_group_member_snapshots (
+                      group_id INT PRIMARY KEY
+
+                    , members_version BIGINT      NOT NULL
+                    , num_members     INT         NOT NULL
+                    , encoding        VARCHAR(32) NOT NULL
+                    , data            BYTEA       NOT NULL
+
+                    , created_at TIMESTAMPTZ DEFAULT NOW()
+                    , updated_at TIMESTAMPTZ DEFAULT NOW()
+                );
+            """
+        )
+        await conn.execute(
+            """
+                -- NB: Already compressed, so TOAST shouldn't try again.
+                ALTER TABLE vk_group_member_snapshots
+                ALTER COLUMN data SET STORAGE EXTERNAL;
+            """
+        )
+        await conn.execute(
+            """
+                DO $$ BEGIN
+                    CREATE TRIGGER update_vk_group_member_snapshots_updated_at
+                    BEFORE UPDATE ON vk_group_member_snapshots
+                    FOR EACH ROW
+                    EXECUTE FUNCTION update_updated_at_column();
+                EXCEPTION
+                    WHEN duplicate_object THEN null;
+                END $$;
+            """
+        )
+
+        # NB: Fetched member ids are streamed here by group update jobs and then
+        # diffed against `vk_group_members` inside Postgres.
+        # Unlogged, since this is scratch data that is cheap to refetch.
+        await conn.execute(
+            """
+                CREATE UNLOGGED TABLE IF NOT EXISTS vk_group_member_staging (
+                      job_id  UUID NOT NULL
+                    , user_id INT  NOT NULL
+                );
+            """
+        )
+        await conn.execute(
+            """
+                CREATE INDEX IF NOT EXISTS vk_group_member_staging_job_id_user_id_idx
+                ON vk_group_member_staging (job_id, user_id);
+            """
+        )
+
         # ------------------------------------------------------------------------------------------
         # Auth.
 
@@ -229,3 +522,12 @@ async def migrate_postgres(pg_pool: asyncpg.Pool):
                 )
             """
         )
+
+
+@asynccontextmanager
+async def _migrations_lock(conn: asyncpg.Connection) -> AsyncIterator[None]:
+    await conn.execute("SELECT pg_advisory_lock($1)", MIGRATIONS_ADVISORY_LOCK_ID)
+    try:
+        yield
+    finally:
+        await conn.execute("SELECT pg_advisory_unlock($1)", MIGRATIONS_ADVISORY_LOCK_ID)
@@ -0,0 +1,11 @@
+from . import profiles
+from .build import AveragePortrait, build_portrait
+from .cache import CachedAveragePortrait, PortraitCache
+
+__all__ = [
+    "profiles",
+    "AveragePortrait",
+    "build_portrait",
+    "CachedAveragePortrait",
+    "PortraitCache",
+]
@@ -1,6 +1,11 @@
 from collections import Counter
+from collections.abc import Hashable, Sequence
+from dataclasses import dataclass
 from datetime import datetime
+from enum import Enum
+from typing import TypeVar
 
+import numpy as np
 from pydantic import BaseModel
 from vk.users import (
     Alcohol,
@@ -226,7 +231,9 @@ def display_alcohol(a: Alcohol) -> str:
 
 
 def build_portrait(users: list[User]) -> AveragePortrait:
-    sex_counts = Counter(user.sex for user in users if user.sex is not None)
+    columns = _pack_users(users)
+
+    sex_counts = _count_enum_codes(columns.sex, Sex)
     most_common_sex = AveragePortrait.PortraitStats(
         label="Пол",
         value=display_sex(sex_counts.most_common(1)[0][0]) if sex_counts else "-",
@@ -241,13 +248,7 @@ def build_portrait(users: list[User]) -> AveragePortrait:
         ],
     )
 
-    age_counts = Counter()
-    for user in users:
-        years_passed = datetime.now().year - (user.bdate.year if user.bdate else 1904)
-        if user.bdate is not None and years_passed <= 100:
-            age = (datetime.now() - user.bdate).days // 365
-            category = display_age(age)
-            age_counts[category] += 1
+    age_counts = _count_age_categories(columns.bdate_ordinal, now=datetime.now())
     most_common_age = AveragePortrait.PortraitStats(
         label="Возраст",
         value=f"{age_counts.most_common(1)[0][0] if age_counts else '-'}",
@@ -262,7 +263,7 @@ def build_portrait(users: list[User]) -> AveragePortrait:
         ],
     )
 
-    city_counts = Counter(user.city.title for user in users if user.city is not None)
+    city_counts = _count_codes(columns.city, columns.city_titles)
     most_common_city = AveragePortrait.PortraitStats(
         label="Живёт в",
         value=city_counts.most_common(1)[0][0] if city_counts else "-",
@@ -277,9 +278,7 @@ def build_portrait(users: list[User]) -> AveragePortrait:
         ],
     )
 
-    relation_counts = Counter(
-        user.relation for user in users if user.relation is not None
-    )
+    relation_counts = _count_enum_codes(columns.relation, Relation)
     most_common_relation = AveragePortrait.PortraitStats(
         label="Семейное положение",
         value=display_relation(relation_counts.most_common(1)[0][0])
@@ -298,11 +297,7 @@ def build_portrait(users: list[User]) -> AveragePortrait:
 
     main_stats = [sex_stats, age_stats, city_stats, relation_stats]
 
-    political_counts = Counter(
-        user.personal.political
-        for user in users
-        if user.personal is not None and user.personal.political is not None
-    )
+    political_counts = _count_enum_codes(columns.political, Political)
     most_common_political = AveragePortrait.PortraitStats(
         label="Политические предпочтения",
         value=display_political(political_counts.most_common(1)[0][0])
@@ -319,10 +314,7 @@ def build_portrait(users: list[User]) -> AveragePortrait:
         ],
     )
 
-    langs_counts = Counter()
-    for user in users:
-        if user.personal is not None and user.personal.langs:
-            langs_counts.update(user.personal.langs)
+    langs_counts = _count_codes(columns.langs, columns.lang_names)
     most_common_lang = AveragePortrait.PortraitStats(
         label="Знает языки",
         value=", ".join([lang for lang, _count in langs_counts.most_common(2)])
@@ -339,11 +331,7 @@ def build_portrait(users: list[User]) -> AveragePortrait:
         ],
     )
 
-    people_main_counts = Counter(
-        user.personal.people_main
-        for user in users
-        if user.personal is not None and user.personal.people_main is not None
-    )
+    people_main_counts = _count_enum_codes(columns.people_main, PeopleMain)
     most_common_people_main = AveragePortrait.PortraitStats(
         label="Главное в людях",
         value=display_peoplemain(people_main_counts.most_common(1)[0][0])
@@ -362,11 +350,7 @@ def build_portrait(users: list[User]) -> AveragePortrait:
         ],
     )
 
-    life_main_counts = Counter(
-        user.personal.life_main
-        for user in users
-        if user.personal is not None and user.personal.life_main is not None
-    )
+    life_main_counts = _count_enum_codes(columns.life_main, LifeMain)
     most_common_life_main = AveragePortrait.PortraitStats(
         label="Главное в жизни",
         value=display_lifemain(life_main_counts.most_common(1)[0][0])
@@ -385,11 +369,7 @@ def build_portrait(users: list[User]) -> AveragePortrait:
         ],
     )
 
-    smoking_counts = Counter(
-        user.personal.smoking
-        for user in users
-        if user.personal is not None and user.personal.smoking is not None
-    )
+    smoking_counts = _count_enum_codes(columns.smoking, Smoking)
     most_common_smoking = AveragePortrait.PortraitStats(
         label="Отношение к курению",
         value=display_smoking(smoking_counts.most_common(1)[0][0])
@@ -410,11 +390,7 @@ def build_portrait(users: list[User]) -> AveragePortrait:
         ],
     )
 
-    alcohol_counts = Counter(
-        user.personal.alcohol
-        for user in users
-        if user.personal is not None and user.personal.alcohol is not None
-    )
+    alcohol_counts = _count_enum_codes(columns.alcohol, Alcohol)
     most_common_alcohol = AveragePortrait.PortraitStats(
         label="Отношение к алкоголю",
         value=display_alcohol(alcohol_counts.most_common(1)[0][0])
@@ -456,8 +432,8 @@ def build_portrait(users: list[User]) -> AveragePortrait:
         most_common_alcohol,
     ]
 
-    hidden_amount = sum(1 for user in users if not user.can_access_closed)
-    deleted_amount = sum(1 for user in users if user.deactivated)
+    hidden_amount = int(np.count_nonzero(~columns.can_access_closed))
+    deleted_amount = int(np.count_nonzero(columns.is_deactivated))
 
     return AveragePortrait(
         hidden_amount=hidden_amount,
@@ -466,3 +442,154 @@ def build_portrait(users: list[User]) -> AveragePortrait:
         main_stats=main_stats,
         additional_stats=additional_stats,
     )
+
+
+# --------------------------------------------------------------------------------------------------
+
+K = TypeVar("K", bound=Hashable)
+E = TypeVar("E", bound=Enum)
+
+
+# Users packed into columns, so that each statistic is counted by numpy
+# rather than by walking a million pydantic models once more.
+#
+# NB: Code `0` is a missing value, other codes are enum values or indices into the titles.
+@dataclass
+class _UserColumns:
+    sex: np.ndarray
+    # NB: Birth dates are dates, so days since 0001-01-01 are enough, see `toordinal`.
+    bdate_ordinal: np.ndarray
+    city: np.ndarray
+    city_titles: list[str | None]
+    relation: np.ndarray
+    political: np.ndarray
+    # NB: A code per language of every user, rather than per user.
+    langs: np.ndarray
+    lang_names: list[str | None]
+    people_main: np.ndarray
+    life_main: np.ndarray
+    smoking: np.ndarray
+    alcohol: np.ndarray
+    can_access_closed: np.ndarray
+    is_deactivated: np.ndarray
+
+
+# NB:
+#   A single pass over the users, appending to lists is the fastest way to fill the columns.
+#   Enum values are read via `_value_`, since the `value` property is twice as slow.
+def _pack_users(users: list[User]) -> _UserColumns:
+    sex: list[int] = []
+    bdate_ordinal: list[int] = []
+    city: list[int] = []
+    relation: list[int] = []
+    political: list[int] = []
+    langs: list[int] = []
+    people_main: list[int] = []
+    life_main: list[int] = []
+    smoking: list[int] = []
+    alcohol: list[int] = []
+    can_access_closed: list[bool] = []
+    is_deactivated: list[bool] = []
+
+    # NB: Titles get codes in the order they are first seen, see `_count_codes`.
+    city_codes: dict[str, int] = {}
+    lang_codes: dict[str, int] = {}
+
+    for user in users:
+        sex.append(user.sex._value_ if user.sex else 0)
+        bdate_ordinal.append(user.bdate.toordinal() if user.bdate else 0)
+        city.append(
+            city_codes.setdefault(user.city.title, len(city_codes) + 1)
+            if user.city
+            else 0
+        )
+        relation.append(user.relation._value_ if user.relation else 0)
+        can_access_closed.append(user.can_access_closed)
+        is_deactivated.append(bool(user.deactivated))
+
+        personal = user.personal
+        if personal is None:
+            political.append(0)
+            people_main.append(0)
+            life_main.append(0)
+            smoking.append(0)
+            alcohol.append(0)
+            continue
+
+        political.append(personal.political._value_ if personal.political else 0)
+        people_main.append(personal.people_main._value_ if personal.people_main else 0)
+        life_main.append(personal.life_main._value_ if personal.life_main else 0)
+        smoking.append(personal.smoking._value_ if personal.smoking else 0)
+        alcohol.append(personal.alcohol._value_ if personal.alcohol else 0)
+        for lang in personal.langs:
+            langs.append(lang_codes.setdefault(lang, len(lang_codes) + 1))
+
+    return _UserColumns(
+        sex=np.array(sex, dtype=np.int8),
+        bdate_ordinal=np.array(bdate_ordinal, dtype=np.int32),
+        city=np.array(city, dtype=np.int32),
+        city_titles=[None, *city_codes],
+        relation=np.array(relation, dtype=np.int8),
+        political=np.array(political, dtype=np.int8),
+        langs=np.array(langs, dtype=np.int32),
+        lang_names=[None, *lang_codes],
+        people_main=np.array(people_main, dtype=np.int8),
+        life_main=np.array(life_main, dtype=np.int8),
+        smoking=np.array(smoking, dtype=np.int8),
+        alcohol=np.array(alcohol, dtype=np.int8),
+        can_access_closed=np.array(can_access_closed, dtype=bool),
+        is_deactivated=np.array(is_deactivated, dtype=bool),
+    )
+
+
+# Counts the codes into a `Counter` of `keys[code]`, skipping missing values.
+#
+# NB:
+#   Keys are inserted in the order they are first seen, as if they were counted one by one,
+#   since `Counter.most_common` breaks ties by insertion order.
+def _count_codes(codes: np.ndarray, keys: Sequence[K | None]) -> Counter[K]:
+    codes = codes[codes != 0]
+    unique_codes, first_indices, counts = np.unique(
+        codes,
+        return_index=True,
+        return_counts=True,
+    )
+
+    counter: Counter[K] = Counter()
+    for i in np.argsort(first_indices):
+        counter[keys[unique_codes[i]]] = int(counts[i])
+
+    return counter
+
+
+def _count_enum_codes(codes: np.ndarray, enum: type[E]) -> Counter[E]:
+    keys: list[E | None] = [None] * (max(member.value for member in enum) + 1)
+    for member in enum:
+        keys[member.value] = member
+
+    return _count_codes(codes, keys)
+
+
+# NB:
+#   Only full dates at most 100 years ago are counted, dates without a year are parsed
+#   into 1904. Ages below 13 fall into "58+", as `display_age` has always done.
+def _count_age_categories(bdate_ordinal: np.ndarray, *, now: datetime) -> Counter[str]:
+    bdate_ordinal = bdate_ordinal[bdate_ordinal != 0]
+    years = (bdate_ordinal - _UNIX_EPOCH_ORDINAL).astype("datetime64[D]").astype(
+        "datetime64[Y]"
+    ).astype(np.int64) + 1970
+    bdate_ordinal = bdate_ordinal[now.year - years <= 100]
+
+    # NB: Same as `(now - bdate).days // 365`, since birth dates are at midnight.
+    ages = (now.toordinal() - bdate_ordinal.astype(np.int64)) // 365
+    unique_ages, codes = np.unique(ages, return_inverse=True)
+
+    categories = sorted({display_age(int(age)) for age in unique_ages})
+    category_codes = np.array(
+        [categories.index(display_age(int(age))) + 1 for age in unique_ages],
+        dtype=np.int32,
+    )
+    return _count_codes(category_codes[codes.reshape(-1)], [None, *categories])
+
+
+_UNIX_EPOCH_ORDINAL = datetime(1970, 1, 1).toordinal()
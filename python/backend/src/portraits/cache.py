@@ -0,0 +1,192 @@
+import asyncio
+
+import asyncpg
+import postgres
+import structlog
+import vk
+from memberships import MembershipStorage
+from pydantic import BaseModel
+from vk.pagination import VK_PAGINATION_MAX_ITEMS
+
+from . import profiles
+from .build import AveragePortrait, build_portrait
+
+log = structlog.stdlib.get_logger()
+
+# --------------------------------------------------------------------------------------------------
+
+
+class CachedAveragePortrait(BaseModel):
+    num_total_users: int
+    average_portrait: AveragePortrait
+
+
+# Average portraits of group sets, computed once per version of the groups' members.
+#
+# NB:
+#   Portraits are keyed by the sorted groups and their `members_version`s, not by
+#   requests, so that identical group sets requested by different users share one.
+#   The portrait of a request is built in the background once its update jobs complete
+#   (see `background/groups/portraits.py`), so views usually only read it.
+#   Concurrent builds of the same portrait in a process share one, see `build`.
+class PortraitCache:
+    def __init__(
+        self,
+        pg_pool: asyncpg.Pool,
+        membership_storage: MembershipStorage,
+        *,
+        max_profile_age_n_seconds: int,
+    ) -> None:
+        self.pg_pool = pg_pool
+        self.membership_storage = membership_storage
+        self.max_profile_age_n_seconds = max_profile_age_n_seconds
+
+        # Running builds by sorted groups and their `members_version`s.
+        self._builds: dict[
+            tuple[tuple[int, ...], tuple[int, ...]],
+            asyncio.Task[CachedAveragePortrait],
+        ] = {}
+
+    # The stored portrait of the groups,
+    # or `None` if there is none or some of the groups have changed since.
+    async def get(self, group_ids: list[int]) -> CachedAveragePortrait | None:
+        group_ids = sorted(set(group_ids))
+
+        stored = await postgres.average_portraits.select_by_group_ids(
+            self.pg_pool,
+            group_ids=group_ids,
+        )
+        if not stored:
+            return None
+
+        members_versions = await self.membership_storage.list_members_versions(
+            group_ids
+        )
+        # NB: Groups missing from `vk_groups` have no members, so version 0.
+        if stored.members_versions != [
+            members_versions.get(group_id, 0) for group_id in group_ids
+        ]:
+            return None
+
+        return CachedAveragePortrait(
+            num_total_users=stored.num_total_users,
+            average_portrait=AveragePortrait.model_validate(stored.portrait),
+        )
+
+    # Computes the portrait of the current members of the groups and stores it,
+    # or waits for the same portrait being computed already.
+    #
+    # NB:
+    #   The running build keeps going if the caller that started it goes away,
+    #   since others may be waiting for it and the portrait is stored either way.
+    async def build(
+        self,
+        vk_client: vk.Client,
+        group_ids: list[int],
+    ) -> CachedAveragePortrait:
+        group_ids = sorted(set(group_ids))
+
+        members_versions = await self.membership_storage.list_members_versions(
+            group_ids
+        )
+        key = (
+            tuple(group_ids),
+            tuple(members_versions.get(group_id, 0) for group_id in group_ids),
+        )
+
+        build = self._builds.get(key)
+        if not build:
+            build = asyncio.create_task(self._build(vk_client, group_ids))
+            self._builds[key] = build
+
+            def forget(_: asyncio.Task) -> None:
+                if self._builds.get(key) is build:
+                    del self._builds[key]
+
+            build.add_done_callback(forget)
+
+        return await asyncio.shield(build)
+
+    # NB:
+    #   Members of every group are counted, so users in several groups are counted
+    #   several times. Groups go in sorted order, so that ties in the stats are broken
+    #   the same way whichever order the groups were requested in.
+    async def _build(
+        self,
+        vk_client: vk.Client,
+        group_ids: list[int],
+    ) -> CachedAveragePortrait:
+        all_users: list[vk.users.User] = []
+        members_versions: list[int] = []
+
+        log.info("Getting all users...", group_ids=group_ids)
+        for i, group_id in enumerate(group_ids):
+            log.info(
+                "Fetching group members",
+                group_id=group_id,
+                progress=f"{i + 1}/{len(group_ids)}",
+            )
+            snapshot = await self.membership_storage.read_member_ids(group_id)
+            members_versions.append(snapshot.members_version)
+
+            group_users = await self._get_group_users(
+                vk_client,
+                group_id=group_id,
+                user_ids=snapshot.user_ids.tolist(),
+            )
+            log.info(
+                "Fetched group users",
+                group_id=group_id,
+                num_users=len(group_users),
+            )
+            all_users.extend(group_users)
+        log.info("Got all users", num_users=len(all_users))
+
+        # NB: Takes a while for large audiences, so it runs off the event loop.
+        average_portrait = await asyncio.to_thread(build_portrait, all_users)
+
+        await postgres.average_portraits.upsert(
+            self.pg_pool,
+            group_ids=group_ids,
+            members_versions=members_versions,
+            num_total_users=len(all_users),
+            portrait=average_portrait,
+        )
+        log.info("Stored average portrait", group_ids=group_ids)
+
+        return CachedAveragePortrait(
+            num_total_users=len(all_users),
+            average_portrait=average_portrait,
+        )
+
+    async def _get_group_users(
+        self,
+        vk_client: vk.Client,
+        *,
+        group_id: int,
+        user_ids: list[int],
+    ) -> list[vk.users.User]:
+        group_users: list[vk.users.User] = []
+        limit = 8 * VK_PAGINATION_MAX_ITEMS
+
+        for i in range(0, len(user_ids), limit):
+            batch_ids = user_ids[i : i + limit]
+
+            log.info(
+                "Fetching group users",
+                group_id=group_id,
+                offset=i,
+                num_users=len(batch_ids),
+            )
+            batch_users = await profiles.get_users(
+                self.pg_pool,
+                vk_client,
+                user_ids=batch_ids,
+                max_age_n_seconds=self.max_profile_age_n_seconds,
+            )
+            if not batch_users:
+                break
+
+            group_users.extend(batch_users)
+
+        return group_users
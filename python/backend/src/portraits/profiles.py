@@ -0,0 +1,63 @@
+from datetime import timedelta
+
+import asyncpg
+import postgres
+import structlog
+import vk
+from utils import utc_now
+from vk.errors import TransientError, with_transient_error_retry
+from vk.users.get_via_execute import GetUsersViaExecuteRequest
+
+log = structlog.stdlib.get_logger()
+
+# --------------------------------------------------------------------------------------------------
+
+
+# Profiles of the users, in the order of `user_ids`, without users VK didn't return.
+#
+# NB:
+#   Profiles are cached in `vk_users`: ones updated at most `max_age_n_seconds` ago
+#   are reused, the rest are fetched from VK in a single `execute` and stored,
+#   so reopening a portrait doesn't refetch all the members of its groups.
+async def get_users(
+    pg_pool: asyncpg.Pool,
+    vk_client: vk.Client,
+    *,
+    user_ids: list[int],
+    max_age_n_seconds: int,
+) -> list[vk.users.User]:
+    now = utc_now()
+
+    async with pg_pool.acquire() as conn:
+        cached_users = await postgres.vk_users.list_fresh_by_ids(
+            conn,
+            user_ids=user_ids,
+            updated_after=now - timedelta(seconds=max_age_n_seconds),
+        )
+    users_by_id = {user.id: user for user in cached_users}
+
+    missing_user_ids = [user_id for user_id in user_ids if user_id not in users_by_id]
+    if missing_user_ids:
+        # TODO: Try `users.get` without `execute`.
+        async def get_missing_users(_error: TransientError | None):
+            return await vk.users.get_users_via_execute(
+                vk_client,
+                GetUsersViaExecuteRequest(user_ids=missing_user_ids),
+            )
+
+        response = await with_transient_error_retry(get_missing_users)
+
+        async with pg_pool.acquire() as conn:
+            await postgres.vk_users.upsert_many(conn, response.users, now)
+
+        for user in response.users:
+            users_by_id[user.id] = user
+
+    log.info(
+        "Got user profiles",
+        num_users=len(user_ids),
+        num_cached_users=len(cached_users),
+        num_fetched_users=len(users_by_id) - len(cached_users),
+    )
+
+    return [users_by_id[user_id] for user_id in user_ids if user_id in users_by_id]
@@ -1,6 +1,15 @@
 from . import (
+    average_portraits,
+    bulk,
+    connection,
     group_member_intersection_requests,
+    group_member_intersections,
+    group_member_sets,
     group_update_jobs,
+    listen,
+    user_average_portrait_requests,
+    vk_group_member_snapshots,
+    vk_group_member_staging,
     vk_group_members,
     vk_groups,
     vk_oauth_tokens,
@@ -8,10 +17,19 @@ from . import (
 )
 
 __all__ = [
+    "bulk",
+    "connection",
     "vk_users",
     "vk_oauth_tokens",
     "vk_groups",
     "group_update_jobs",
+    "listen",
     "vk_group_members",
+    "vk_group_member_staging",
+    "vk_group_member_snapshots",
     "group_member_intersection_requests",
+    "group_member_intersections",
+    "group_member_sets",
+    "user_average_portrait_requests",
+    "average_portraits",
 ]
@@ -0,0 +1,66 @@
+from typing import Any
+
+import asyncpg
+from pydantic import BaseModel
+
+
+class StoredAveragePortrait(BaseModel):
+    # NB: Sorted and unique.
+    group_ids: list[int]
+    members_versions: list[int]
+    num_total_users: int
+    # NB: A `portraits.AveragePortrait`, validated by the caller.
+    portrait: dict[str, Any]
+
+
+async def select_by_group_ids(
+    pg_pool: asyncpg.Pool,
+    *,
+    group_ids: list[int],
+) -> StoredAveragePortrait | None:
+    async with pg_pool.acquire() as conn:
+        row = await conn.fetchrow(
+            """
+                SELECT group_ids
+                     , members_versions
+                     , num_total_users
+                     , portrait
+                FROM average_portraits
+                WHERE group_ids = $1
+            """,
+            group_ids,
+        )
+    if not row:
+        return None
+
+    return StoredAveragePortrait.model_validate(row)
+
+
+async def upsert(
+    pg_pool: asyncpg.Pool,
+    *,
+    group_ids: list[int],
+    members_versions: list[int],
+    num_total_users: int,
+    portrait: BaseModel,
+) -> None:
+    async with pg_pool.acquire() as conn:
+        await conn.execute(
+            """
+                INSERT INTO average_portraits (
+                      group_ids
+                    , members_versions
+                    , num_total_users
+                    , portrait
+                )
+                VALUES ($1, $2, $3, $4)
+                ON CONFLICT (group_ids) DO UPDATE
+                SET members_versions = EXCLUDED.members_versions
+                  , num_total_users = EXCLUDED.num_total_users
+                  , portrait = EXCLUDED.portrait
+            """,
+            group_ids,
+            members_versions,
+            num_total_users,
+            portrait,
+        )
@@ -0,0 +1,121 @@
+from collections.abc import Iterable, Mapping, Sequence
+from typing import Any
+
+import asyncpg
+import numpy as np
+
+# --------------------------------------------------------------------------------------------------
+
+
+# Bulk-inserts `records` into `table`: `COPY` into a temporary table,
+# then a single `INSERT ... SELECT ... {on_conflict}`.
+#
+# Columns listed in `casts` (name -> SQL type) are copied as text and cast on insert.
+# Use it for types without a binary `COPY` codec, e.g. our `JSONB`.
+#
+# Returns the number of inserted (or updated) rows.
+async def copy_insert(
+    conn: asyncpg.Connection,
+    *,
+    table: str,
+    columns: Sequence[str],
+    records: Iterable[Sequence[Any]],
+    on_conflict: str = "",
+    casts: Mapping[str, str] | None = None,
+) -> int:
+    casts = casts or {}
+    staging_table = f"_bulk_{table}"
+
+    staged_columns = ", ".join(
+        f"{column}::TEXT AS {column}" if column in casts else column
+        for column in columns
+    )
+    inserted_columns = ", ".join(columns)
+    selected_columns = ", ".join(
+        f"{column}::{casts[column]}" if column in casts else column
+        for column in columns
+    )
+
+    async with conn.transaction():
+        await conn.execute(
+            f"""
+                CREATE TEMPORARY TABLE {staging_table}
+                ON COMMIT DROP
+                AS SELECT {staged_columns}
+                FROM {table}
+                WITH NO DATA
+            """
+        )
+
+        await conn.copy_records_to_table(
+            staging_table,
+            records=records,
+            columns=list(columns),
+        )
+
+        status = await conn.execute(
+            f"""
+                INSERT INTO {table} ({inserted_columns})
+                SELECT {selected_columns}
+                FROM {staging_table}
+                {on_conflict}
+            """
+        )
+
+        # NB: Allows calling this function several times in the same transaction.
+        await conn.execute(f"DROP TABLE {staging_table}")
+
+    # NB: Status looks like "INSERT 0 42".
+    return int(status.split()[-1])
+
+
+# Runs `query`, which must select a single non-null `INT` column, via binary `COPY`
+# and decodes the result with numpy. Millions of records are too slow to decode one by one.
+async def copy_ints_from_query(
+    conn: asyncpg.Connection,
+    query: str,
+    *args: Any,
+) -> np.ndarray:
+    chunks: list[bytes] = []
+
+    async def on_chunk(chunk: bytes) -> None:
+        chunks.append(chunk)
+
+    await conn.copy_from_query(query, *args, output=on_chunk, format="binary")
+
+    return _decode_binary_copy_of_ints(b"".join(chunks))
+
+
+_BINARY_COPY_SIGNATURE = b"PGCOPY\n\xff\r\n\x00"
+
+# NB: Every tuple is a field count, a field length and a single `INT` field.
+_BINARY_COPY_INT_TUPLE = np.dtype(
+    [
+        ("num_fields", ">i2"),
+        ("length", ">i4"),
+        ("value", ">i4"),
+    ]
+)
+
+
+# See https://www.postgresql.org/docs/current/sql-copy.html#id-1.9.3.55.9.4.
+def _decode_binary_copy_of_ints(data: bytes) -> np.ndarray:
+    if not data.startswith(_BINARY_COPY_SIGNATURE):
+        raise ValueError("Invalid binary COPY signature")
+
+    # NB: Signature, flags, then the header extension and its length.
+    header_extension_length = int.from_bytes(data[15:19], "big")
+    tuples_start = 19 + header_extension_length
+    # NB: The trailer is a `-1` field count.
+    tuples_end = len(data) - 2
+
+    tuples = np.frombuffer(
+        data,
+        dtype=_BINARY_COPY_INT_TUPLE,
+        offset=tuples_start,
+        count=(tuples_end - tuples_start) // _BINARY_COPY_INT_TUPLE.itemsize,
+    )
+    if np.any(tuples["length"] != 4):
+        raise ValueError("Unexpected NULL or non-INT field in binary COPY")
+
+    return tuples["value"].astype(np.int64)
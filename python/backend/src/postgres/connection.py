@@ -0,0 +1,40 @@
+import json
+from typing import Any
+
+import asyncpg
+from config import PostgresConfig
+from pydantic import BaseModel
+
+# --------------------------------------------------------------------------------------------------
+
+
+async def connect_postgres(config: PostgresConfig) -> asyncpg.Pool:
+    pool = await asyncpg.create_pool(dsn=config.dsn, init=_init_conn)
+    if not pool:
+        raise ValueError("Failed to create Postgres connection pool")
+    return pool
+
+
+async def _init_conn(conn: asyncpg.Connection):
+    await conn.set_type_codec(
+        "JSONB",
+        encoder=_jsonb_encoder,
+        decoder=_jsonb_decoder,
+        schema="pg_catalog",
+    )
+
+
+def _jsonb_encoder(
+    # NB: Should be `Unknown`, but there is none.
+    value: Any,
+) -> str:
+    if isinstance(value, BaseModel):
+        return value.model_dump_json()
+    raise TypeError("Encoding JSONB type for Postgres without using Pydantic model")
+
+
+def _jsonb_decoder(
+    # NB: Should be `Unknown`, but there is none.
+    value: Any,
+) -> Any:
+    return json.loads(value)
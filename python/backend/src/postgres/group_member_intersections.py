@@ -0,0 +1,68 @@
+import asyncpg
+from pydantic import BaseModel
+
+# --------------------------------------------------------------------------------------------------
+# NB: Members are encoded like in `vk_group_member_snapshots`.
+
+
+class GroupMemberIntersection(BaseModel):
+    # NB: Sorted and unique.
+    group_ids: list[int]
+    members_versions: list[int]
+    num_members: int
+    encoding: str
+    data: bytes
+
+
+async def select_by_group_ids(
+    pg_pool: asyncpg.Pool,
+    *,
+    group_ids: list[int],
+) -> GroupMemberIntersection | None:
+    async with pg_pool.acquire() as conn:
+        row = await conn.fetchrow(
+            """
+                SELECT group_ids
+                     , members_versions
+                     , num_members
+                     , encoding
+                     , data
+                FROM group_member_intersections
+                WHERE group_ids = $1
+            """,
+            group_ids,
+        )
+    if not row:
+        return None
+
+    return GroupMemberIntersection.model_validate(row)
+
+
+async def upsert(
+    pg_pool: asyncpg.Pool,
+    *,
+    intersection: GroupMemberIntersection,
+) -> None:
+    async with pg_pool.acquire() as conn:
+        await conn.execute(
+            """
+                INSERT INTO group_member_intersections (
+                      group_ids
+                    , members_versions
+                    , num_members
+                    , encoding
+                    , data
+                )
+                VALUES ($1, $2, $3, $4, $5)
+                ON CONFLICT (group_ids) DO UPDATE
+                SET members_versions = EXCLUDED.members_versions
+                  , num_members = EXCLUDED.num_members
+                  , encoding = EXCLUDED.encoding
+                  , data = EXCLUDED.data
+            """,
+            intersection.group_ids,
+            intersection.members_versions,
+            intersection.num_members,
+            intersection.encoding,
+            intersection.data,
+        )
@@ -0,0 +1,74 @@
+import asyncpg
+from pydantic import BaseModel
+
+# --------------------------------------------------------------------------------------------------
+# NB: Members are encoded like in `vk_group_member_snapshots`.
+
+
+class GroupMemberSet(BaseModel):
+    # NB: See `memberships.set_expression.fingerprint`.
+    expression_fingerprint: str
+    # NB: In the order of appearance in the expression.
+    group_ids: list[int]
+    members_versions: list[int]
+    num_members: int
+    encoding: str
+    data: bytes
+
+
+async def select_by_expression_fingerprint(
+    pg_pool: asyncpg.Pool,
+    *,
+    expression_fingerprint: str,
+) -> GroupMemberSet | None:
+    async with pg_pool.acquire() as conn:
+        row = await conn.fetchrow(
+            """
+                SELECT expression_fingerprint
+                     , group_ids
+                     , members_versions
+                     , num_members
+                     , encoding
+                     , data
+                FROM group_member_sets
+                WHERE expression_fingerprint = $1
+            """,
+            expression_fingerprint,
+        )
+    if not row:
+        return None
+
+    return GroupMemberSet.model_validate(row)
+
+
+async def upsert(
+    pg_pool: asyncpg.Pool,
+    *,
+    member_set: GroupMemberSet,
+) -> None:
+    async with pg_pool.acquire() as conn:
+        await conn.execute(
+            """
+                INSERT INTO group_member_sets (
+                      expression_fingerprint
+                    , group_ids
+                    , members_versions
+                    , num_members
+                    , encoding
+                    , data
+                )
+                VALUES ($1, $2, $3, $4, $5, $6)
+                ON CONFLICT (expression_fingerprint) DO UPDATE
+                SET group_ids = EXCLUDED.group_ids
+                  , members_versions = EXCLUDED.members_versions
+                  , num_members = EXCLUDED.num_members
+                  , encoding = EXCLUDED.encoding
+                  , data = EXCLUDED.data
+            """,
+            member_set.expression_fingerprint,
+            member_set.group_ids,
+            member_set.members_versions,
+            member_set.num_members,
+            member_set.encoding,
+            member_set.data,
+        )
@@ -5,9 +5,31 @@ import asyncpg
 from job import JobInfo, JobStatus, PendingJobInfo
 from pydantic import BaseModel, TypeAdapter
 
+from .bulk import copy_insert
+
 # --------------------------------------------------------------------------------------------------
 
+# Notified whenever new jobs are inserted, so that the driver doesn't have to poll.
+NEW_JOBS_CHANNEL = "group_update_jobs_new"
+
+# Notified with the job id whenever a job's status or progress changes, see `migrations.py`.
+JOB_CHANGES_CHANNEL = "group_update_jobs_changed"
+
+# NB: First key of `pg_advisory_xact_lock(key1, key2)`, the second one is the group id.
+GROUP_LOCK_NAMESPACE = 1
 
+
+# Returns one job id per group id, in the same order.
+#
+# NB:
+#   Single-flight: a group that already has a pending or running job gets that job's id,
+#   so concurrent requests for the same group share one refresh instead of each
+#   refetching it. Only groups without one get a new job.
+#
+#   A shared job runs with its first requester's access token and counts against only
+#   that user's `max_jobs_per_user`, since the others add no load. Every requester is
+#   recorded, so that the job falls back to another one's token if the first one's
+#   is missing or revoked, see `background/groups`.
 async def insert_many(
     pg_pool: asyncpg.Pool,
     *,
@@ -15,33 +37,93 @@ async def insert_many(
     user_id: int,
     group_ids: list[int],
 ) -> list[UUID]:
-    job_ids = []
+    unique_group_ids = sorted(set(group_ids))
+    job_info = PendingJobInfo(type=JobStatus.Pending)
 
     async with pg_pool.acquire() as conn:
-        for group_id in group_ids:
-            job_id = uuid4()
-            job_info = PendingJobInfo(type=JobStatus.Pending)
+        async with conn.transaction():
+            # NB: Concurrent requests for the same group wait here until this one commits.
+            # Ids are sorted, so that overlapping requests lock in the same order.
+            await conn.execute(
+                """
+                    SELECT pg_advisory_xact_lock($1, group_id)
+                    FROM UNNEST($2::INT[]) AS group_id
+                """,
+                GROUP_LOCK_NAMESPACE,
+                unique_group_ids,
+            )
+
+            rows = await conn.fetch(
+                """
+                    SELECT DISTINCT ON (group_id) group_id
+                                                , id
+                    FROM group_update_jobs
+                    WHERE group_id = ANY($1)
+                      AND status IN ('PENDING', 'RUNNING')
+                    ORDER BY group_id, created_at ASC
+                """,
+                unique_group_ids,
+            )
+            job_id_by_group_id: dict[int, UUID] = {
+                row["group_id"]: row["id"] for row in rows
+            }
+
+            new_job_ids = {
+                group_id: uuid4()
+                for group_id in unique_group_ids
+                if group_id not in job_id_by_group_id
+            }
+            job_id_by_group_id.update(new_job_ids)
 
             await conn.execute(
                 """
-                    INSERT INTO group_update_jobs (
-                        id, request_id, user_id,
-                        group_id, status, info
-                    )
-                    VALUES ($1, $2, $3, $4, $5, $6::JSONB)
-                    
+                    UPDATE group_update_jobs
+                    SET requester_user_ids = ARRAY_APPEND(requester_user_ids, $2)
+                    WHERE id = ANY($1)
+                      AND NOT ($2 = ANY(requester_user_ids))
                 """,
-                job_id,
-                request_id,
+                [row["id"] for row in rows],
                 user_id,
-                group_id,
-                JobStatus.Pending,
-                job_info,
             )
 
-            job_ids.append(job_id)
+            if not new_job_ids:
+                return [job_id_by_group_id[group_id] for group_id in group_ids]
+
+            await copy_insert(
+                conn,
+                table="group_update_jobs",
+                columns=[
+                    "id",
+                    "request_id",
+                    "user_id",
+                    "requester_user_ids",
+                    "group_id",
+                    "status",
+                    "info",
+                ],
+                records=[
+                    (
+                        job_id,
+                        request_id,
+                        user_id,
+                        [user_id],
+                        group_id,
+                        JobStatus.Pending.value,
+                        job_info.model_dump_json(),
+                    )
+                    for group_id, job_id in new_job_ids.items()
+                ],
+                casts={"info": "JSONB"},
+            )
+
+            # NB: Delivered on commit, so listeners never see uncommitted jobs.
+            await conn.execute(
+                "SELECT pg_notify($1, $2)",
+                NEW_JOBS_CHANNEL,
+                str(request_id),
+            )
 
-    return job_ids
+    return [job_id_by_group_id[group_id] for group_id in group_ids]
 
 
 # --------------------------------------------------------------------------------------------------
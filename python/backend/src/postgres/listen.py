@@ -0,0 +1,53 @@
+import asyncio
+from collections.abc import Callable
+
+import asyncpg
+import structlog
+
+log = structlog.stdlib.get_logger()
+
+# --------------------------------------------------------------------------------------------------
+
+# NB: How often the listening connection is pinged, so that a dead one is replaced.
+CHECK_EVERY_N_SECONDS = 30
+
+
+# `LISTEN`s on `channel` until cancelled, calling `on_notification` with every payload.
+#
+# The connection is taken from the pool for good and replaced if it dies.
+# Notifications sent while reconnecting are lost, so `on_connected` is called
+# after every (re)connect to let the caller catch up.
+async def listen_forever(
+    pg_pool: asyncpg.Pool,
+    *,
+    channel: str,
+    on_notification: Callable[[str], None],
+    on_connected: Callable[[], None],
+) -> None:
+    def listener(
+        _conn: asyncpg.Connection,
+        _pid: int,
+        _channel: str,
+        payload: str,
+    ) -> None:
+        on_notification(payload)
+
+    while True:
+        try:
+            async with pg_pool.acquire() as conn:
+                await conn.add_listener(channel, listener)
+                log.info("Listening for notifications...", channel=channel)
+
+                on_connected()
+
+                try:
+                    while True:
+                        await asyncio.sleep(CHECK_EVERY_N_SECONDS)
+                        await conn.execute("SELECT 1")
+                finally:
+                    if not conn.is_closed():
+                        await conn.remove_listener(channel, listener)
+        except Exception as e:
+            log.error("Listener failed, reconnecting...", channel=channel, exc_info=e)
+
+        await asyncio.sleep(CHECK_EVERY_N_SECONDS)
@@ -0,0 +1,122 @@
+from datetime import timedelta
+from uuid import UUID
+
+import asyncpg
+from pydantic import BaseModel
+
+
+class AveragePortraitRequest(BaseModel):
+    id: UUID
+    user_id: int
+    group_ids: list[int]
+    update_job_ids: list[UUID]
+
+
+async def select_by_id(
+    pg_pool: asyncpg.Pool,
+    *,
+    request_id: UUID,
+) -> AveragePortraitRequest | None:
+    async with pg_pool.acquire() as conn:
+        row = await conn.fetchrow(
+            """
+                SELECT *
+                FROM user_average_portrait_requests
+                WHERE id = $1
+            """,
+            request_id,
+        )
+
+    if not row:
+        return None
+
+    return AveragePortraitRequest.model_validate(row)
+
+
+# Claims the portrait builds of the requests with the update job whose update jobs
+# have all completed, and returns the requests.
+#
+# NB:
+#   Jobs are shared by requests for the same groups (see `group_update_jobs.insert_many`),
+#   so the job may be the last one of several requests. A job claims only after it's
+#   marked completed, so when the last jobs of a request complete at the same time,
+#   at least the later claim sees all of them completed. If both do, the second one
+#   waits for the row lock and then sees `portrait_build_started_at` set, so only one
+#   of them claims the request.
+async def claim_portrait_builds(
+    pg_pool: asyncpg.Pool,
+    *,
+    update_job_id: UUID,
+) -> list[AveragePortraitRequest]:
+    async with pg_pool.acquire() as conn:
+        rows = await conn.fetch(
+            """
+                WITH claimed_requests AS (
+                    UPDATE user_average_portrait_requests r
+                    SET portrait_build_started_at = NOW()
+                    WHERE r.update_job_ids @> ARRAY[$1]::UUID[]
+                      AND r.portrait_build_started_at IS NULL
+                      AND NOT EXISTS (
+                          SELECT 1
+                          FROM group_update_jobs j
+                          WHERE j.id = ANY(r.update_job_ids)
+                            AND j.status IN ('PENDING', 'RUNNING')
+                      )
+                    RETURNING r.*
+                )
+
+                SELECT *
+                FROM claimed_requests
+                ORDER BY created_at ASC
+            """,
+            update_job_id,
+        )
+
+    return [AveragePortraitRequest.model_validate(row) for row in rows]
+
+
+# Claims the portrait build of the request, e.g. for a view that found no portrait.
+# Returns `False` if someone else has claimed it less than `stale_after` ago.
+#
+# NB: Older claims are taken over, since whoever made them has probably crashed.
+async def claim_portrait_build(
+    pg_pool: asyncpg.Pool,
+    *,
+    request_id: UUID,
+    stale_after: timedelta,
+) -> bool:
+    async with pg_pool.acquire() as conn:
+        status = await conn.execute(
+            """
+                UPDATE user_average_portrait_requests
+                SET portrait_build_started_at = NOW()
+                WHERE id = $1
+                  AND (
+                         portrait_build_started_at IS NULL
+                      OR portrait_build_started_at < NOW() - $2::INTERVAL
+                  )
+            """,
+            request_id,
+            stale_after,
+        )
+
+    # NB: Status looks like "UPDATE 1".
+    return status != "UPDATE 0"
+
+
+# Releases the portrait builds claimed by `claim_portrait_builds` or `claim_portrait_build`,
+# once they are done or have failed, so that a later build isn't mistaken for a running one.
+async def release_portrait_builds(
+    pg_pool: asyncpg.Pool,
+    *,
+    request_ids: list[UUID],
+) -> None:
+    async with pg_pool.acquire() as conn:
+        await conn.execute(
+            """
+                UPDATE user_average_portrait_requests
+                SET portrait_build_started_at = NULL
+                WHERE id = ANY($1)
+            """,
+            request_ids,
+        )
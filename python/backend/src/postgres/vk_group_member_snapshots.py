@@ -0,0 +1,105 @@
+import zlib
+
+import asyncpg
+import numpy as np
+from pydantic import BaseModel
+
+# --------------------------------------------------------------------------------------------------
+# NB: The whole membership of a group in a single compressed row.
+
+
+# NB:
+#   Sorted ids are delta-encoded, so that they become small numbers, the bytes of the deltas
+#   are grouped by significance, so that the mostly zero high bytes are adjacent, and then
+#   compressed. That's ~1.5 bytes per member, against ~50 bytes of a `vk_group_members` row
+#   with its index.
+ENCODING_DELTA_SHUFFLE_ZLIB = "DELTA_SHUFFLE_ZLIB"
+
+
+def encode_user_ids(user_ids: np.ndarray) -> bytes:
+    deltas = np.diff(user_ids.astype(np.uint32), prepend=np.uint32(0)).astype("<u4")
+    shuffled = deltas.view(np.uint8).reshape(-1, 4).T.tobytes()
+    return zlib.compress(shuffled, 1)
+
+
+def decode_user_ids(encoding: str, data: bytes) -> np.ndarray:
+    if encoding != ENCODING_DELTA_SHUFFLE_ZLIB:
+        raise ValueError(f"Unknown group member snapshot encoding: {encoding}")
+
+    shuffled = np.frombuffer(zlib.decompress(data), dtype=np.uint8)
+    deltas = shuffled.reshape(4, -1).T.copy().view("<u4").ravel()
+    return np.cumsum(deltas, dtype=np.uint32)
+
+
+class GroupMemberSnapshot(BaseModel):
+    group_id: int
+    members_version: int
+    num_members: int
+    encoding: str
+    data: bytes
+
+
+async def select_by_group_id(
+    conn: asyncpg.Connection,
+    *,
+    group_id: int,
+) -> GroupMemberSnapshot | None:
+    row = await conn.fetchrow(
+        """
+            SELECT group_id
+                 , members_version
+                 , num_members
+                 , encoding
+                 , data
+            FROM vk_group_member_snapshots
+            WHERE group_id = $1
+        """,
+        group_id,
+    )
+    if not row:
+        return None
+
+    return GroupMemberSnapshot.model_validate(row)
+
+
+async def upsert(
+    conn: asyncpg.Connection,
+    *,
+    snapshot: GroupMemberSnapshot,
+) -> None:
+    await conn.execute(
+        """
+            INSERT INTO vk_group_member_snapshots (
+                  group_id
+                , members_version
+                , num_members
+                , encoding
+                , data
+            )
+            VALUES ($1, $2, $3, $4, $5)
+            ON CONFLICT (group_id) DO UPDATE
+            SET members_version = EXCLUDED.members_version
+              , num_members = EXCLUDED.num_members
+              , encoding = EXCLUDED.encoding
+              , data = EXCLUDED.data
+        """,
+        snapshot.group_id,
+        snapshot.members_version,
+        snapshot.num_members,
+        snapshot.encoding,
+        snapshot.data,
+    )
+
+
+async def delete_by_group_id(
+    conn: asyncpg.Connection,
+    *,
+    group_id: int,
+) -> None:
+    await conn.execute(
+        """
+            DELETE FROM vk_group_member_snapshots
+            WHERE group_id = $1
+        """,
+        group_id,
+    )
@@ -0,0 +1,226 @@
+import asyncio
+from uuid import UUID
+
+import asyncpg
+import numpy as np
+from pydantic import BaseModel
+
+from . import vk_group_member_snapshots, vk_group_members, vk_groups
+from .bulk import copy_ints_from_query
+
+# --------------------------------------------------------------------------------------------------
+
+
+async def copy_user_ids(
+    pg_pool: asyncpg.Pool,
+    *,
+    job_id: UUID,
+    user_ids: list[int],
+) -> None:
+    async with pg_pool.acquire() as conn:
+        await conn.copy_records_to_table(
+            "vk_group_member_staging",
+            records=[(job_id, user_id) for user_id in user_ids],
+            columns=["job_id", "user_id"],
+        )
+
+
+async def delete_by_job_id(
+    pg_pool: asyncpg.Pool,
+    *,
+    job_id: UUID,
+) -> None:
+    async with pg_pool.acquire() as conn:
+        await _delete_by_job_id(conn, job_id=job_id)
+
+
+async def count_by_job_id(
+    pg_pool: asyncpg.Pool,
+    *,
+    job_id: UUID,
+) -> int:
+    async with pg_pool.acquire() as conn:
+        count = await conn.fetchval(
+            """
+                SELECT COUNT(*)
+                FROM vk_group_member_staging
+                WHERE job_id = $1
+            """,
+            job_id,
+        )
+
+    return count
+
+
+# --------------------------------------------------------------------------------------------------
+
+
+class MembershipDiff(BaseModel):
+    num_removed: int
+    num_added: int
+
+
+# NB:
+#   Writes the members as rows of `vk_group_members`. A snapshot of the group is dropped,
+#   so if the group was stored as one, all its members count as added.
+async def apply_to_group_members(
+    pg_pool: asyncpg.Pool,
+    *,
+    job_id: UUID,
+    group_id: int,
+) -> MembershipDiff:
+    async with pg_pool.acquire() as conn:
+        async with conn.transaction():
+            await vk_groups.select_members_version_for_update(conn, group_id=group_id)
+            await vk_group_member_snapshots.delete_by_group_id(conn, group_id=group_id)
+
+            delete_status = await conn.execute(
+                """
+                    DELETE FROM vk_group_members m
+                    WHERE m.group_id = $1
+                      AND NOT EXISTS (
+                          SELECT 1
+                          FROM vk_group_member_staging s
+                          WHERE s.job_id = $2
+                            AND s.user_id = m.user_id
+                      )
+                """,
+                group_id,
+                job_id,
+            )
+
+            insert_status = await conn.execute(
+                """
+                    INSERT INTO vk_group_members (group_id, user_id)
+                    SELECT DISTINCT $1::INT, s.user_id
+                    FROM vk_group_member_staging s
+                    WHERE s.job_id = $2
+                      AND NOT EXISTS (
+                          SELECT 1
+                          FROM vk_group_members m
+                          WHERE m.group_id = $1
+                            AND m.user_id = s.user_id
+                      )
+                    ON CONFLICT (group_id, user_id) DO NOTHING
+                """,
+                group_id,
+                job_id,
+            )
+
+            await _delete_by_job_id(conn, job_id=job_id)
+
+            # NB: Statuses look like "DELETE 42" and "INSERT 0 42".
+            diff = MembershipDiff(
+                num_removed=int(delete_status.split()[-1]),
+                num_added=int(insert_status.split()[-1]),
+            )
+
+            # NB: In the same transaction, so that a version always names one set of members.
+            if diff.num_removed or diff.num_added:
+                await vk_groups.bump_members_version(conn, group_id=group_id)
+
+    return diff
+
+
+# NB:
+#   Writes the members as a single compressed row of `vk_group_member_snapshots`,
+#   diffing them in memory. Rows of the group in `vk_group_members` are dropped.
+async def apply_to_group_member_snapshot(
+    pg_pool: asyncpg.Pool,
+    *,
+    job_id: UUID,
+    group_id: int,
+) -> MembershipDiff:
+    async with pg_pool.acquire() as conn:
+        async with conn.transaction():
+            members_version = await vk_groups.select_members_version_for_update(
+                conn,
+                group_id=group_id,
+            )
+            current_snapshot = await vk_group_member_snapshots.select_by_group_id(
+                conn,
+                group_id=group_id,
+            )
+            if current_snapshot:
+                current_user_ids = await asyncio.to_thread(
+                    vk_group_member_snapshots.decode_user_ids,
+                    current_snapshot.encoding,
+                    current_snapshot.data,
+                )
+            else:
+                current_user_ids = await vk_group_members.copy_sorted_user_ids(
+                    conn,
+                    group_id=group_id,
+                )
+            staged_user_ids = await _copy_sorted_user_ids(conn, job_id=job_id)
+
+            diff = MembershipDiff(
+                num_removed=len(
+                    np.setdiff1d(current_user_ids, staged_user_ids, assume_unique=True)
+                ),
+                num_added=len(
+                    np.setdiff1d(staged_user_ids, current_user_ids, assume_unique=True)
+                ),
+            )
+
+            # NB: A group stored as rows is moved into a snapshot even if it didn't change.
+            is_changed = bool(diff.num_removed or diff.num_added)
+            if is_changed or not current_snapshot:
+                if is_changed:
+                    await vk_groups.bump_members_version(conn, group_id=group_id)
+
+                data = await asyncio.to_thread(
+                    vk_group_member_snapshots.encode_user_ids,
+                    staged_user_ids,
+                )
+                await vk_group_member_snapshots.upsert(
+                    conn,
+                    snapshot=vk_group_member_snapshots.GroupMemberSnapshot(
+                        group_id=group_id,
+                        members_version=(members_version or 0) + int(is_changed),
+                        num_members=len(staged_user_ids),
+                        encoding=vk_group_member_snapshots.ENCODING_DELTA_SHUFFLE_ZLIB,
+                        data=data,
+                    ),
+                )
+                await vk_group_members.delete_by_group_id(conn, group_id=group_id)
+
+            await _delete_by_job_id(conn, job_id=job_id)
+
+    return diff
+
+
+# --------------------------------------------------------------------------------------------------
+
+
+# Sorted and deduplicated `uint32`.
+async def _copy_sorted_user_ids(
+    conn: asyncpg.Connection,
+    *,
+    job_id: UUID,
+) -> np.ndarray:
+    user_ids = await copy_ints_from_query(
+        conn,
+        """
+            SELECT DISTINCT user_id
+            FROM vk_group_member_staging
+            WHERE job_id = $1
+            ORDER BY user_id
+        """,
+        job_id,
+    )
+    return user_ids.astype(np.uint32)
+
+
+async def _delete_by_job_id(
+    conn: asyncpg.Connection,
+    *,
+    job_id: UUID,
+) -> None:
+    await conn.execute(
+        """
+            DELETE FROM vk_group_member_staging
+            WHERE job_id = $1
+        """,
+        job_id,
+    )
@@ -1,24 +1,40 @@
 import asyncpg
-from pydantic import BaseModel, TypeAdapter
+import numpy as np
 
+from .bulk import copy_ints_from_query
 
-class VkGroupMember(BaseModel):
-    user_id: int
+# --------------------------------------------------------------------------------------------------
+# NB: One row per membership, see `memberships.MembershipStorage` for the other layout.
 
 
-async def list_by_group_id(
-    pg_pool: asyncpg.Pool,
+# Sorted `uint32`, VK user ids are positive `INT`s.
+async def copy_sorted_user_ids(
+    conn: asyncpg.Connection,
     *,
     group_id: int,
-) -> list[VkGroupMember]:
-    async with pg_pool.acquire() as conn:
-        rows = await conn.fetch(
-            """
-                SELECT user_id
-                FROM vk_group_members
-                WHERE group_id = $1
-            """,
-            group_id,
-        )
+) -> np.ndarray:
+    user_ids = await copy_ints_from_query(
+        conn,
+        """
+            SELECT user_id
+            FROM vk_group_members
+            WHERE group_id = $1
+            ORDER BY user_id
+        """,
+        group_id,
+    )
+    return user_ids.astype(np.uint32)
 
-    return TypeAdapter(list[VkGroupMember]).validate_python(rows)
+
+async def delete_by_group_id(
+    conn: asyncpg.Connection,
+    *,
+    group_id: int,
+) -> None:
+    await conn.execute(
+        """
+            DELETE FROM vk_group_members
+            WHERE group_id = $1
+        """,
+        group_id,
+    )
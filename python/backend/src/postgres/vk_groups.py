@@ -1,7 +1,11 @@
+from datetime import datetime
+
 import asyncpg
 import vk
 from pydantic import BaseModel, TypeAdapter
 
+from .bulk import copy_insert
+
 # --------------------------------------------------------------------------------------------------
 
 
@@ -10,31 +14,46 @@ async def upsert_only_vk_data(
     *,
     groups: list[vk.groups.GroupById],
 ) -> None:
+    # NB:
+    #   A single `ON CONFLICT DO UPDATE` can't touch the same row twice, and URLs
+    #   may resolve to the same group (e.g. `club123` and its screen name).
+    unique_groups = {group.id: group for group in groups}
+
     async with pg_pool.acquire() as conn:
-        for group in groups:
-            await conn.execute(
-                """
-                    INSERT INTO vk_groups (
-                        id, name, screen_name, members_count,
-                        photo_50, photo_100, photo_200
-                    )
-                    VALUES ($1, $2, $3, $4, $5, $6, $7)
-                    ON CONFLICT (id) DO UPDATE
-                    SET name = EXCLUDED.name
-                      , screen_name = EXCLUDED.screen_name
-                      , members_count = EXCLUDED.members_count
-                      , photo_50 = EXCLUDED.photo_50
-                      , photo_100 = EXCLUDED.photo_100
-                      , photo_200 = EXCLUDED.photo_200
-                """,
-                group.id,
-                group.name,
-                group.screen_name,
-                group.members_count,
-                group.photo_50,
-                group.photo_100,
-                group.photo_200,
-            )
+        await copy_insert(
+            conn,
+            table="vk_groups",
+            columns=[
+                "id",
+                "name",
+                "screen_name",
+                "members_count",
+                "photo_50",
+                "photo_100",
+                "photo_200",
+            ],
+            records=[
+                (
+                    group.id,
+                    group.name,
+                    group.screen_name,
+                    group.members_count,
+                    group.photo_50,
+                    group.photo_100,
+                    group.photo_200,
+                )
+                for group in unique_groups.values()
+            ],
+            on_conflict="""
+                ON CONFLICT (id) DO UPDATE
+                SET name = EXCLUDED.name
+                  , screen_name = EXCLUDED.screen_name
+                  , members_count = EXCLUDED.members_count
+                  , photo_50 = EXCLUDED.photo_50
+                  , photo_100 = EXCLUDED.photo_100
+                  , photo_200 = EXCLUDED.photo_200
+            """,
+        )
 
 
 # --------------------------------------------------------------------------------------------------
@@ -48,6 +67,8 @@ class VkGroup(BaseModel):
     photo_50: str | None = None
     photo_100: str | None = None
     photo_200: str | None = None
+    last_updated_at: datetime | None = None
+    members_version: int = 0
 
 
 async def list_by_ids(
@@ -58,7 +79,16 @@ async def list_by_ids(
     async with pg_pool.acquire() as conn:
         rows = await conn.fetch(
             """
-                SELECT *
+                -- NB: Not `*`, so that sketches aren't fetched along.
+                SELECT id
+                     , name
+                     , screen_name
+                     , members_count
+                     , photo_50
+                     , photo_100
+                     , photo_200
+                     , last_updated_at
+                     , members_version
                 FROM vk_groups
                 WHERE id = ANY($1)
             """,
@@ -66,3 +96,113 @@ async def list_by_ids(
         )
 
     return TypeAdapter(list[VkGroup]).validate_python(rows)
+
+
+# NB: Locks the group, so that its members are changed by one transaction at a time.
+async def select_members_version_for_update(
+    conn: asyncpg.Connection,
+    *,
+    group_id: int,
+) -> int | None:
+    return await conn.fetchval(
+        """
+            SELECT members_version
+            FROM vk_groups
+            WHERE id = $1
+            FOR UPDATE
+        """,
+        group_id,
+    )
+
+
+async def bump_members_version(
+    conn: asyncpg.Connection,
+    *,
+    group_id: int,
+) -> None:
+    await conn.execute(
+        """
+            UPDATE vk_groups
+            SET members_version = members_version + 1
+            WHERE id = $1
+        """,
+        group_id,
+    )
+
+
+# Missing groups are omitted.
+async def list_members_versions(
+    pg_pool: asyncpg.Pool,
+    *,
+    group_ids: list[int],
+) -> dict[int, int]:
+    async with pg_pool.acquire() as conn:
+        rows = await conn.fetch(
+            """
+                SELECT id
+                     , members_version
+                FROM vk_groups
+                WHERE id = ANY($1)
+            """,
+            group_ids,
+        )
+
+    return {row["id"]: row["members_version"] for row in rows}
+
+
+# --------------------------------------------------------------------------------------------------
+
+
+class VkGroupMembersSketch(BaseModel):
+    id: int
+    members_version: int
+    members_sketch: bytes | None
+    members_sketch_version: int | None
+
+
+# Missing groups are omitted.
+async def list_members_sketches(
+    pg_pool: asyncpg.Pool,
+    *,
+    group_ids: list[int],
+) -> list[VkGroupMembersSketch]:
+    async with pg_pool.acquire() as conn:
+        rows = await conn.fetch(
+            """
+                SELECT id
+                     , members_version
+                     , members_sketch
+                     , members_sketch_version
+                FROM vk_groups
+                WHERE id = ANY($1)
+            """,
+            group_ids,
+        )
+
+    return TypeAdapter(list[VkGroupMembersSketch]).validate_python(rows)
+
+
+# NB: Never replaces a sketch of newer members.
+async def update_members_sketch(
+    pg_pool: asyncpg.Pool,
+    *,
+    group_id: int,
+    members_sketch: bytes,
+    members_sketch_version: int,
+) -> None:
+    async with pg_pool.acquire() as conn:
+        await conn.execute(
+            """
+                UPDATE vk_groups
+                SET members_sketch = $2
+                  , members_sketch_version = $3
+                WHERE id = $1
+                  AND (
+                         members_sketch_version IS NULL
+                      OR members_sketch_version < $3
+                  )
+            """,
+            group_id,
+            members_sketch,
+            members_sketch_version,
+        )
@@ -1,7 +1,44 @@
-from datetime import datetime
+from collections.abc import Sequence
+from datetime import date, datetime
+from typing import Any
 
 import asyncpg
 import vk
+from pydantic import TypeAdapter
+
+from . import bulk
+
+_COLUMNS = [
+    "id",
+    "first_name",
+    "last_name",
+    "can_access_closed",
+    "deactivated",
+    "last_seen",
+    "last_seen_platform",
+    "sex",
+    "bdate",
+    "country_id",
+    "country",
+    "city_id",
+    "city",
+    "relation",
+    "political",
+    "langs",
+    "people_main",
+    "life_main",
+    "smoking",
+    "alcohol",
+    "last_updated_at",
+]
+
+_ON_CONFLICT_UPDATE = "ON CONFLICT (id) DO UPDATE SET " + ", ".join(
+    f"{column} = EXCLUDED.{column}" for column in _COLUMNS if column != "id"
+)
+
+_USERS_ADAPTER = TypeAdapter(list[vk.users.User])
+
+# --------------------------------------------------------------------------------------------------
 
 
 async def upsert(
@@ -9,89 +46,128 @@ async def upsert(
     user: vk.users.User,
     last_updated_at: datetime,
 ) -> None:
-    if user.personal and user.personal.political:
-        political = user.personal.political.value
-    else:
-        political = None
-
-    if user.personal and user.personal.people_main:
-        people_main = user.personal.people_main.value
-    else:
-        people_main = None
-
-    if user.personal and user.personal.life_main:
-        life_main = user.personal.life_main.value
-    else:
-        life_main = None
-
-    if user.personal and user.personal.smoking:
-        smoking = user.personal.smoking.value
-    else:
-        smoking = None
-
-    if user.personal and user.personal.alcohol:
-        alcohol = user.personal.alcohol.value
-    else:
-        alcohol = None
+    columns = ", ".join(_COLUMNS)
+    placeholders = ", ".join(f"${i + 1}" for i in range(len(_COLUMNS)))
 
     await conn.execute(
-        """
-            INSERT INTO vk_users(
-                  id
-                , first_name
-                , last_name
-                , can_access_closed
-                , deactivated
-                , last_seen
-                , sex
-                , bdate
-                , country
-                , city
-                , relation
-                , political
-                , langs
-                , people_main
-                , life_main
-                , smoking
-                , alcohol
-                , last_updated_at
-            )
-            VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11, $12, $13, $14, $15, $16, $17, $18)
-            ON CONFLICT (id) DO UPDATE
-            SET first_name = EXCLUDED.first_name
-              , last_name = EXCLUDED.last_name
-              , can_access_closed = EXCLUDED.can_access_closed
-              , deactivated = EXCLUDED.deactivated
-              , last_seen = EXCLUDED.last_seen
-              , sex = EXCLUDED.sex
-              , bdate = EXCLUDED.bdate
-              , country = EXCLUDED.country
-              , city = EXCLUDED.city
-              , relation = EXCLUDED.relation
-              , political = EXCLUDED.political
-              , langs = EXCLUDED.langs
-              , people_main = EXCLUDED.people_main
-              , life_main = EXCLUDED.life_main
-              , smoking = EXCLUDED.smoking
-              , alcohol = EXCLUDED.alcohol
-              , last_updated_at = EXCLUDED.last_updated_at
+        f"""
+            INSERT INTO vk_users({columns})
+            VALUES ({placeholders})
+            {_ON_CONFLICT_UPDATE}
+        """,
+        *_to_record(user, last_updated_at),
+    )
+
+
+async def upsert_many(
+    conn: asyncpg.Connection,
+    users: Sequence[vk.users.User],
+    last_updated_at: datetime,
+) -> None:
+    await bulk.copy_insert(
+        conn,
+        table="vk_users",
+        columns=_COLUMNS,
+        records=(_to_record(user, last_updated_at) for user in users),
+        on_conflict=_ON_CONFLICT_UPDATE,
+    )
+
+
+# Profiles of the users updated after `updated_after`, in no particular order.
+async def list_fresh_by_ids(
+    conn: asyncpg.Connection,
+    *,
+    user_ids: list[int],
+    updated_after: datetime,
+) -> list[vk.users.User]:
+    rows = await conn.fetch(
+        f"""
+            SELECT {", ".join(_COLUMNS)}
+            FROM vk_users
+            WHERE id = ANY($1::INT[])
+              AND last_updated_at > $2
+              -- NB: Rows from before ids were stored can't be restored into profiles.
+              AND (city IS NULL OR city_id IS NOT NULL)
+              AND (country IS NULL OR country_id IS NOT NULL)
         """,
+        user_ids,
+        updated_after,
+    )
+
+    return _USERS_ADAPTER.validate_python([_to_user_fields(row) for row in rows])
+
+
+# --------------------------------------------------------------------------------------------------
+
+
+def _to_record(user: vk.users.User, last_updated_at: datetime) -> tuple[Any, ...]:
+    personal = user.personal
+
+    return (
         user.id,
         user.first_name,
         user.last_name,
         user.can_access_closed,
         user.deactivated,
         user.last_seen.time if user.last_seen else None,
+        user.last_seen.platform if user.last_seen else None,
         user.sex.value if user.sex else None,
         user.bdate,
+        user.country.id if user.country else None,
         user.country.title if user.country else None,
+        user.city.id if user.city else None,
         user.city.title if user.city else None,
         user.relation.value if user.relation else None,
-        political,
-        user.personal.langs if user.personal else None,
-        people_main,
-        life_main,
-        smoking,
-        alcohol,
+        personal.political.value if personal and personal.political else None,
+        personal.langs if personal else None,
+        personal.people_main.value if personal and personal.people_main else None,
+        personal.life_main.value if personal and personal.life_main else None,
+        personal.smoking.value if personal and personal.smoking else None,
+        personal.alcohol.value if personal and personal.alcohol else None,
         last_updated_at,
     )
+
+
+# NB: Fields as VK returns them, so that they go through the same validators.
+def _to_user_fields(row: asyncpg.Record) -> dict[str, Any]:
+    fields: dict[str, Any] = {
+        "id": row["id"],
+        "first_name": row["first_name"],
+        "last_name": row["last_name"],
+        "can_access_closed": row["can_access_closed"],
+        "deactivated": row["deactivated"],
+        "sex": row["sex"],
+        "bdate": _format_bdate(row["bdate"]) if row["bdate"] else None,
+        "relation": row["relation"],
+    }
+
+    if row["last_seen"]:
+        fields["last_seen"] = {
+            "time": row["last_seen"],
+            "platform": row["last_seen_platform"],
+        }
+    if row["country_id"] is not None:
+        fields["country"] = {"id": row["country_id"], "title": row["country"]}
+    if row["city_id"] is not None:
+        fields["city"] = {"id": row["city_id"], "title": row["city"]}
+
+    # NB: Stored for every user VK returned `personal` for, see `_to_record`.
+    if row["langs"] is not None:
+        fields["personal"] = {
+            "political": row["political"],
+            "langs": row["langs"],
+            "people_main": row["people_main"],
+            "life_main": row["life_main"],
+            "smoking": row["smoking"],
+            "alcohol": row["alcohol"],
+        }
+
+    return fields
+
+
+# NB: Dates without a year are parsed into 1904, see `vk.users.get.parse_date`.
+def _format_bdate(bdate: date) -> str:
+    if bdate.year == 1904:
+        return f"{bdate.day}.{bdate.month}"
+
+    return f"{bdate.day}.{bdate.month}.{bdate.year}"
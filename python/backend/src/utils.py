@@ -13,5 +13,20 @@ def get_env_or_raise(name: str, config: dict[str, str] | None = None) -> str:
     return value
 
 
+def get_env_or_default(
+    name: str,
+    default: str,
+    config: dict[str, str] | None = None,
+) -> str:
+    if config is None:
+        value = os.environ.get(name)
+    else:
+        value = config.get(name)
+
+    if value is None:
+        return default
+    return value
+
+
 def utc_now() -> datetime.datetime:
     return datetime.datetime.now(datetime.timezone.utc)
@@ -1,14 +1,20 @@
-from . import groups, oauth, stats, users
+from . import groups, oauth, retry, stats, users
 from .client import Client
+from .coalescer import ExecuteCoalescer
 from .execute import VK_EXECUTE_MAX_REQUESTS
 from .pagination import VK_PAGINATION_MAX_ITEMS
+from .rate_limit import RateLimiter, RateLimitStats
 
 __all__ = [
     "groups",
     "users",
     "VK_PAGINATION_MAX_ITEMS",
     "Client",
+    "ExecuteCoalescer",
     "oauth",
+    "retry",
     "stats",
     "VK_EXECUTE_MAX_REQUESTS",
+    "RateLimiter",
+    "RateLimitStats",
 ]
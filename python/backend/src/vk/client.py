@@ -1,36 +1,129 @@
 import json
-from typing import NoReturn, TypeVar
+from typing import Any, Literal, NoReturn, TypeVar
 
 import httpx
 import pendulum
 import structlog
+from httpx import USE_CLIENT_DEFAULT
+from httpx._client import UseClientDefault
 from httpx._types import HeaderTypes, QueryParamTypes, RequestData
-from pydantic import BaseModel, ValidationError
+from pydantic import BaseModel, TypeAdapter, ValidationError
 
+from .coalescer import ExecuteCoalescer
 from .errors import (
     VK_ACCESS_DENIED_CODE,
+    VK_AUTHORIZATION_FAILED_CODE,
     VK_RATE_LIMIT_CODE,
+    VK_TRANSIENT_ERROR_CODES,
     AccessDeniedError,
+    AuthorizationError,
+    NetworkError,
     RateLimitError,
     RequestValidationError,
+    ServerError,
+    TransientApiError,
+    VkApiError,
 )
+from .idle_cache import IdleCache
+from .rate_limit import RateLimiter
+from .request import VK_API_VERSION
 
 log = structlog.stdlib.get_logger()
 
 Model = TypeVar("Model", bound=BaseModel)
+T = TypeVar("T")
+
+
+class _RawResponse(BaseModel):
+    response: Any
+
+
+_response_adapters: dict[Any, TypeAdapter] = {}
+
+
+def _get_response_adapter(response_type: Any) -> TypeAdapter:
+    adapter = _response_adapters.get(response_type)
+    if adapter is None:
+        adapter = TypeAdapter(response_type)
+        _response_adapters[response_type] = adapter
+    return adapter
 
 
 class Client:
-    def __init__(self, http_client: httpx.AsyncClient, access_token: str) -> None:
+    def __init__(
+        self,
+        http_client: httpx.AsyncClient,
+        access_token: str,
+        rate_limiter: RateLimiter | None = None,
+        *,
+        coalesce_calls: bool = False,
+        coalescers: IdleCache[ExecuteCoalescer] | None = None,
+    ) -> None:
         self.http_client = http_client
         self.access_token = access_token
+        self.rate_limiter = rate_limiter or RateLimiter()
+
+        # NB: If enabled, calls made via `_call` by concurrent tasks are packed
+        # into `execute` requests, see `ExecuteCoalescer`.
+        self.coalesce_calls = coalesce_calls
+        self._coalescers = coalescers if coalescers is not None else IdleCache()
 
     def with_new_access_token(self, access_token: str) -> "Client":
-        return Client(http_client=self.http_client, access_token=access_token)
+        return Client(
+            http_client=self.http_client,
+            access_token=access_token,
+            # NB: Share the limiter, so that all clients with the same access token
+            # share the same rate limit budget.
+            rate_limiter=self.rate_limiter,
+            coalesce_calls=self.coalesce_calls,
+            coalescers=self._coalescers,
+        )
+
+    async def _wait_for_rate_limit(self) -> None:
+        waited_n_seconds = await self.rate_limiter.bucket(self.access_token).acquire()
+        if waited_n_seconds > 0.001:
+            log.debug("Waited for rate limit", waited_n_seconds=waited_n_seconds)
 
     def build_default_headers(self) -> HeaderTypes:
         return {"Authorization": f"Bearer {self.access_token}"}
 
+    async def _call(
+        self,
+        method: str,
+        params: dict[str, Any],
+        response_type: type[T],
+    ) -> T:
+        response_adapter = _get_response_adapter(response_type)
+
+        if not self.coalesce_calls:
+            return await self._call_directly(method, params, response_adapter)
+
+        coalescer = self._coalescers.get_or_create(
+            self.access_token,
+            lambda: ExecuteCoalescer(self),
+        )
+        return await coalescer.call(method, params, response_adapter)
+
+    async def _call_directly(
+        self,
+        method: str,
+        params: dict[str, Any],
+        response_adapter: TypeAdapter,
+    ) -> Any:
+        raw_response = await self._get(
+            url=f"https://api.vk.com/method/{method}",
+            params={**params, "v": params.get("v", VK_API_VERSION)},
+            response_model=_RawResponse,
+        )
+
+        try:
+            return response_adapter.validate_python(raw_response.response, strict=False)
+        except ValidationError as error:
+            raise RequestValidationError(
+                message="Request validation error",
+                response=None,
+            ) from error
+
     async def _get(
         self,
         url: str,
@@ -38,24 +131,14 @@ class Client:
         response_model: type[Model],
         pass_auth: bool = True,
     ) -> Model:
-        raw_response = await self.http_client.get(
+        return await self._request(
+            "GET",
             url=url,
             params=params,
-            headers=self.build_default_headers() if pass_auth else {},
+            response_model=response_model,
+            pass_auth=pass_auth,
         )
 
-        try:
-            return response_model.model_validate_json(
-                json_data=raw_response.text,
-                # NB: Using `strict=True` prevents Pydantic from coercing types.
-                # Example: `int` (UNIX timestamp) -> `datetime`.
-                strict=False,
-            )
-
-        except ValidationError as error:
-            _try_handle_validation_error(raw_response, error)
-
-    # TODO: Extract common code to `_request` and merge with `_get`.
     async def _post(
         self,
         url: str,
@@ -64,13 +147,48 @@ class Client:
         pass_auth: bool = True,
         timeout: float = 30.0,
     ) -> Model:
-        raw_response = await self.http_client.post(
+        return await self._request(
+            "POST",
             url=url,
             data=data,
-            headers=self.build_default_headers() if pass_auth else {},
+            response_model=response_model,
+            pass_auth=pass_auth,
             timeout=timeout,
         )
 
+    async def _request(
+        self,
+        method: Literal["GET", "POST"],
+        *,
+        url: str,
+        response_model: type[Model],
+        params: QueryParamTypes | None = None,
+        data: RequestData | None = None,
+        pass_auth: bool = True,
+        timeout: float | UseClientDefault = USE_CLIENT_DEFAULT,
+    ) -> Model:
+        if pass_auth:
+            await self._wait_for_rate_limit()
+
+        try:
+            raw_response = await self.http_client.request(
+                method,
+                url=url,
+                params=params,
+                data=data,
+                headers=self.build_default_headers() if pass_auth else {},
+                timeout=timeout,
+            )
+        except httpx.TransportError as error:
+            # NB: Covers timeouts, connection resets and protocol errors.
+            raise NetworkError(f"Network error: {error!r}") from error
+
+        if raw_response.is_server_error:
+            raise ServerError(
+                message=f"Server error: {raw_response.status_code}",
+                response=raw_response,
+            )
+
         try:
             return response_model.model_validate_json(
                 json_data=raw_response.text,
@@ -80,51 +198,88 @@ class Client:
             )
 
         except ValidationError as error:
-            _try_handle_validation_error(raw_response, error)
+            self._try_handle_validation_error(raw_response, error)
 
+    def _try_handle_validation_error(
+        self,
+        response: httpx.Response,
+        validation_error: ValidationError,
+    ) -> NoReturn:
+        try:
+            as_json = json.loads(response.text)
+        except json.JSONDecodeError:
+            as_json = {}
 
-def _try_handle_validation_error(
-    response: httpx.Response,
-    validation_error: ValidationError,
-) -> NoReturn:
-    as_json = json.loads(response.text)
+        error = as_json.get("error", None) if isinstance(as_json, dict) else None
+        if isinstance(error, dict):
+            error_code = error.get("error_code", None)
+            error_msg = error.get("error_msg", "")
+        else:
+            error_code = None
+            error_msg = ""
 
-    error = as_json.get("error", None)
-    if isinstance(error, dict):
-        error_code = error.get("error_code", None)
-    else:
-        error_code = None
+        log.debug(
+            "Handling validation error",
+            as_json=as_json,
+            error=error,
+            error_code=error_code,
+        )
 
-    log.debug(
-        "Handling validation error", as_json=as_json, error=error, error_code=error_code
-    )
+        raise self._build_error(
+            response=response,
+            error_code=error_code,
+            error_msg=error_msg,
+        ) from validation_error
 
-    if error_code == VK_RATE_LIMIT_CODE:
-        # TODO: Implement and pass different backoff strategies to handle rate limits.
-        now = pendulum.now()
-        next_second = now.set(microsecond=0).add(seconds=1)
+    def _build_error(
+        self,
+        *,
+        response: httpx.Response | None,
+        error_code: int | None,
+        error_msg: str,
+    ) -> VkApiError:
+        if error_code == VK_RATE_LIMIT_CODE:
+            # NB: VK rejected the request despite the local limiter (e.g. the same
+            # token is used elsewhere), so make the next requests wait a bit.
+            self.rate_limiter.bucket(self.access_token).drain()
 
-        rate_limit_error = RateLimitError(
-            message="Rate limit error",
-            response=response,
-            # NB:
-            #   VK API doesn't provide the exact "retry after" value,
-            #   but all of their rate limits are per second.
-            retry_after_n_seconds=(next_second - now).total_seconds(),
-            # NB: The above doesn't work :(
-            # retry_after_n_seconds=0.1,
-        )
-        raise rate_limit_error from validation_error
+            # NB: The actual backoff is decided by `RetryPolicy`, this is only a hint.
+            now = pendulum.now()
+            next_second = now.set(microsecond=0).add(seconds=1)
+
+            return RateLimitError(
+                message="Rate limit error",
+                response=response,
+                # NB:
+                #   VK API doesn't provide the exact "retry after" value,
+                #   but all of their rate limits are per second.
+                retry_after_n_seconds=(next_second - now).total_seconds(),
+                # NB: The above doesn't work :(
+                # retry_after_n_seconds=0.1,
+            )
 
-    if error_code == VK_ACCESS_DENIED_CODE:
-        access_denied_error = AccessDeniedError(
-            message="Access to the groups list is denied due to the user's privacy settings",
+        if error_code in VK_TRANSIENT_ERROR_CODES:
+            return TransientApiError(
+                message=f"Transient VK API error: {error_msg}",
+                response=response,
+                error_code=error_code,
+            )
+
+        if error_code == VK_AUTHORIZATION_FAILED_CODE:
+            return AuthorizationError(
+                message=f"Authorization failed: {error_msg}",
+                response=response,
+            )
+
+        if error_code == VK_ACCESS_DENIED_CODE:
+            return AccessDeniedError(
+                message="Access to the groups list is denied due to the user's privacy settings",
+                response=response,
+            )
+
+        return RequestValidationError(
+            message=f"Request validation error: {error_msg}"
+            if error_msg
+            else "Request validation error",
             response=response,
         )
-        raise access_denied_error from validation_error
-
-    request_validation_error = RequestValidationError(
-        message="Request validation error",
-        response=response,
-    )
-    raise request_validation_error from validation_error
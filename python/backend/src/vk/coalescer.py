@@ -0,0 +1,195 @@
+import asyncio
+import json
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Any
+
+import structlog
+from pydantic import BaseModel, Field, TypeAdapter
+
+from .execute import VK_EXECUTE_MAX_REQUESTS
+from .request import VK_API_VERSION
+
+if TYPE_CHECKING:
+    from .client import Client
+
+log = structlog.stdlib.get_logger()
+
+# --------------------------------------------------------------------------------------------------
+
+# How long to wait for other calls before sending a batch.
+DEFAULT_MAX_DELAY_N_SECONDS = 0.005
+
+
+@dataclass
+class _PendingCall:
+    method: str
+    params: dict[str, Any]
+    response_adapter: TypeAdapter
+    future: asyncio.Future
+
+
+class _ExecuteError(BaseModel):
+    method: str | None = None
+    error_code: int
+    error_msg: str = ""
+
+
+class _ExecuteResponse(BaseModel):
+    # NB: Failed calls are `false` in `response`,
+    # their errors are listed in `execute_errors` in the same order.
+    response: list[Any]
+    execute_errors: list[_ExecuteError] = Field(default_factory=list)
+
+
+# --------------------------------------------------------------------------------------------------
+
+
+# Packs calls made by concurrent tasks into a single `execute` request,
+# so they cost one HTTP round-trip and one rate limit slot instead of up to 25.
+class ExecuteCoalescer:
+    def __init__(
+        self,
+        client: "Client",
+        *,
+        max_delay_n_seconds: float = DEFAULT_MAX_DELAY_N_SECONDS,
+        max_calls: int = VK_EXECUTE_MAX_REQUESTS,
+    ) -> None:
+        self.client = client
+        self.max_delay_n_seconds = max_delay_n_seconds
+        self.max_calls = max_calls
+
+        self._pending: list[_PendingCall] = []
+        self._flush_handle: asyncio.TimerHandle | None = None
+        # NB: Keep references, so that the tasks aren't garbage collected mid-flight.
+        self._tasks: set[asyncio.Task] = set()
+
+    def is_busy(self) -> bool:
+        return bool(self._pending or self._tasks)
+
+    async def call(
+        self,
+        method: str,
+        params: dict[str, Any],
+        response_adapter: TypeAdapter,
+    ) -> Any:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append(
+            _PendingCall(
+                method=method,
+                # NB: Version is set once for the whole `execute`.
+                params={k: v for k, v in params.items() if k != "v" and v is not None},
+                response_adapter=response_adapter,
+                future=future,
+            )
+        )
+
+        if len(self._pending) >= self.max_calls:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.max_delay_n_seconds, self._flush)
+
+        return await future
+
+    def _flush(self) -> None:
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+
+        while self._pending:
+            batch = self._pending[: self.max_calls]
+            self._pending = self._pending[self.max_calls :]
+
+            task = asyncio.create_task(self._execute(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _execute(self, batch: list[_PendingCall]) -> None:
+        # NB: Callers may have been cancelled while waiting for the batch.
+        batch = [call for call in batch if not call.future.done()]
+        if not batch:
+            return
+
+        if len(batch) == 1:
+            await self._execute_one(batch[0])
+            return
+
+        log.debug(
+            "Executing coalesced calls",
+            num_calls=len(batch),
+            methods=sorted({call.method for call in batch}),
+        )
+
+        joined_calls = ",".join(
+            f"API.{call.method}({json.dumps(call.params, ensure_ascii=False)})"
+            for call in batch
+        )
+        code = f"""return[{joined_calls}];"""
+
+        try:
+            response = await self.client._post(
+                url="https://api.vk.com/method/execute",
+                data={"code": code, "v": VK_API_VERSION},
+                response_model=_ExecuteResponse,
+                timeout=60.0,
+            )
+        except BaseException as error:
+            # NB: The whole `execute` failed (rate limit, network, etc.),
+            # so every caller gets the same error and decides whether to retry.
+            for call in batch:
+                if not call.future.done():
+                    call.future.set_exception(error)
+            if not isinstance(error, Exception):
+                raise
+            return
+
+        execute_errors = iter(response.execute_errors)
+
+        for call, result in zip(batch, response.response):
+            if call.future.done():
+                continue
+
+            if result is False:
+                execute_error = next(execute_errors, None)
+                call.future.set_exception(
+                    self.client._build_error(
+                        response=None,
+                        error_code=execute_error.error_code if execute_error else None,
+                        error_msg=execute_error.error_msg if execute_error else "",
+                    )
+                )
+                continue
+
+            try:
+                call.future.set_result(
+                    call.response_adapter.validate_python(result, strict=False)
+                )
+            except Exception as error:
+                call.future.set_exception(error)
+
+        for call in batch[len(response.response) :]:
+            if not call.future.done():
+                call.future.set_exception(
+                    self.client._build_error(
+                        response=None,
+                        error_code=None,
+                        error_msg="Missing result in execute response",
+                    )
+                )
+
+    async def _execute_one(self, call: _PendingCall) -> None:
+        try:
+            result = await self.client._call_directly(
+                call.method,
+                call.params,
+                call.response_adapter,
+            )
+        except BaseException as error:
+            if not call.future.done():
+                call.future.set_exception(error)
+            if not isinstance(error, Exception):
+                raise
+            return
+
+        if not call.future.done():
+            call.future.set_result(result)
@@ -1,16 +1,29 @@
 import asyncio
+import time
 from typing import Awaitable, Callable, TypeVar
 
 import structlog
 from httpx import Response
 
+from .retry import DEFAULT_RETRY_POLICY, RetryPolicy
+
 log = structlog.stdlib.get_logger()
 
 # --------------------------------------------------------------------------------------------------
 
+VK_UNKNOWN_ERROR_CODE = 1
+VK_AUTHORIZATION_FAILED_CODE = 5
 VK_RATE_LIMIT_CODE = 6
+VK_FLOOD_CONTROL_CODE = 9
+VK_INTERNAL_SERVER_ERROR_CODE = 10
 VK_ACCESS_DENIED_CODE = 260
 
+VK_TRANSIENT_ERROR_CODES = (
+    VK_UNKNOWN_ERROR_CODE,
+    VK_FLOOD_CONTROL_CODE,
+    VK_INTERNAL_SERVER_ERROR_CODE,
+)
+
 # --------------------------------------------------------------------------------------------------
 
 
@@ -22,7 +35,7 @@ class VkApiError(Exception):
 
 
 class RequestValidationError(VkApiError):
-    def __init__(self, message: str, response: Response):
+    def __init__(self, message: str, response: Response | None):
         super().__init__(message)
         self.response = response
 
@@ -40,9 +53,13 @@ T = TypeVar("T")
 Action = Callable[[TransientError | None], Awaitable[T]]
 
 
-async def with_transient_error_retry(action: Action[T]) -> T:
+async def with_transient_error_retry(
+    action: Action[T],
+    policy: RetryPolicy = DEFAULT_RETRY_POLICY,
+) -> T:
     attempt = 0
     last_error: TransientError | None = None
+    started_at = time.monotonic()
 
     while True:
         try:
@@ -50,26 +67,43 @@ async def with_transient_error_retry(action: Action[T]) -> T:
             return await action(last_error)
 
         except TransientError as e:
-            if isinstance(e, RateLimitError):
-                log.debug(
-                    "Rate limit error, sleeping before next attempt",
-                    retry_after_n_seconds=e.retry_after_n_seconds,
+            delay_n_seconds = policy.next_delay_n_seconds(
+                attempt=attempt,
+                elapsed_n_seconds=time.monotonic() - started_at,
+                retry_after_n_seconds=(
+                    e.retry_after_n_seconds if isinstance(e, RateLimitError) else None
+                ),
+            )
+            if delay_n_seconds is None:
+                log.warning(
+                    "Transient error, giving up",
+                    error=e,
+                    error_type=type(e).__name__,
                     attempt=attempt,
                 )
-                last_error = e
-                await asyncio.sleep(e.retry_after_n_seconds)
-                continue
+                raise
 
-            # Handle other transient errors here.
-
-            raise
+            log.debug(
+                "Transient error, sleeping before next attempt",
+                error=e,
+                error_type=type(e).__name__,
+                delay_n_seconds=delay_n_seconds,
+                attempt=attempt,
+            )
+            last_error = e
+            await asyncio.sleep(delay_n_seconds)
 
 
 # --------------------------------------------------------------------------------------------------
 
 
 class RateLimitError(TransientError):
-    def __init__(self, message: str, response: Response, retry_after_n_seconds: float):
+    def __init__(
+        self,
+        message: str,
+        response: Response | None,
+        retry_after_n_seconds: float,
+    ):
         super().__init__(message)
         self.response = response
         self.retry_after_n_seconds = retry_after_n_seconds
@@ -78,7 +112,46 @@ class RateLimitError(TransientError):
 # --------------------------------------------------------------------------------------------------
 
 
+# Timeouts, connection resets and other transport-level failures.
+class NetworkError(TransientError):
+    pass
+
+
+# --------------------------------------------------------------------------------------------------
+
+
+# VK responded with 5xx status code.
+class ServerError(TransientError):
+    def __init__(self, message: str, response: Response | None):
+        super().__init__(message)
+        self.response = response
+
+
+# --------------------------------------------------------------------------------------------------
+
+
+# VK responded with an error code that is worth retrying, see `VK_TRANSIENT_ERROR_CODES`.
+class TransientApiError(TransientError):
+    def __init__(self, message: str, response: Response | None, error_code: int):
+        super().__init__(message)
+        self.response = response
+        self.error_code = error_code
+
+
+# --------------------------------------------------------------------------------------------------
+
+
 class AccessDeniedError(VkApiError):
-    def __init__(self, message: str, response: Response):
+    def __init__(self, message: str, response: Response | None):
+        super().__init__(message)
+        self.response = response
+
+
+# --------------------------------------------------------------------------------------------------
+
+
+# The access token is invalid, expired or revoked by the user.
+class AuthorizationError(VkApiError):
+    def __init__(self, message: str, response: Response | None):
         super().__init__(message)
         self.response = response
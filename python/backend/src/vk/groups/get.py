@@ -16,17 +16,12 @@ class GetGroupsResponse(pydantic.BaseModel):
     count: int
 
 
-class _GetGroupsResponseOuter(pydantic.BaseModel):
-    response: GetGroupsResponse
-
-
 async def get_groups(
     client: Client,
     request: GetGroupsRequest,
 ) -> GetGroupsResponse:
-    response = await client._get(
-        url="https://api.vk.com/method/groups.get",
+    return await client._call(
+        "groups.get",
         params=request.model_dump(),
-        response_model=_GetGroupsResponseOuter,
+        response_type=GetGroupsResponse,
     )
-    return response.response
@@ -27,18 +27,12 @@ class GetByIdResponse(BaseModel):
     groups: list[GroupById]
 
 
-class _GetByIdResponseOuter(BaseModel):
-    response: GetByIdResponse
-
-
 async def get_by_id(
     client: Client,
     request: GetByIdRequest,
 ) -> GetByIdResponse:
-    response = await client._get(
-        url="https://api.vk.com/method/groups.getById",
+    return await client._call(
+        "groups.getById",
         params=request.model_dump(),
-        response_model=_GetByIdResponseOuter,
+        response_type=GetByIdResponse,
     )
-
-    return response.response
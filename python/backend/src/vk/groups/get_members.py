@@ -22,18 +22,12 @@ class GetMembersResponse(pydantic.BaseModel):
     member_ids: list[int] = Field(validation_alias=AliasChoices("items"))
 
 
-class _GetMembersResponseOuter(pydantic.BaseModel):
-    response: GetMembersResponse
-
-
 async def get_members(
     client: Client,
     request: GetMembersRequest,
 ) -> GetMembersResponse:
-    response = await client._get(
-        url="https://api.vk.com/method/groups.getMembers",
+    return await client._call(
+        "groups.getMembers",
         params=request.model_dump(),
-        response_model=_GetMembersResponseOuter,
+        response_type=GetMembersResponse,
     )
-
-    return response.response
@@ -0,0 +1,57 @@
+import time
+from collections import OrderedDict
+from collections.abc import Callable, Iterator
+from typing import Generic, Protocol, TypeVar
+
+# --------------------------------------------------------------------------------------------------
+
+# NB: Long enough for a token bucket to refill, so that dropping one loses nothing.
+DEFAULT_IDLE_N_SECONDS = 10 * 60
+
+
+class _Evictable(Protocol):
+    def is_busy(self) -> bool: ...
+
+
+V = TypeVar("V", bound=_Evictable)
+
+
+# --------------------------------------------------------------------------------------------------
+
+
+# Keeps one entry per access token, dropping the ones nobody has used for `idle_n_seconds`,
+# so that a long-running process doesn't keep an entry for every user it has ever seen.
+#
+# NB:
+#   Entries are kept in the order they were last used, so pruning stops at the first
+#   recent one. Busy entries (e.g. with waiters) are never dropped, since a new entry
+#   for the same access token would let requests bypass them.
+class IdleCache(Generic[V]):
+    def __init__(self, *, idle_n_seconds: float = DEFAULT_IDLE_N_SECONDS) -> None:
+        self.idle_n_seconds = idle_n_seconds
+        self._entries: OrderedDict[str, tuple[V, float]] = OrderedDict()
+
+    def get_or_create(self, access_token: str, create: Callable[[], V]) -> V:
+        now = time.monotonic()
+        self._evict_idle(now)
+
+        entry = self._entries.pop(access_token, None)
+        value = entry[0] if entry else create()
+        self._entries[access_token] = (value, now)
+
+        return value
+
+    def items(self) -> Iterator[tuple[str, V]]:
+        for access_token, (value, _used_at) in self._entries.items():
+            yield access_token, value
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _evict_idle(self, now: float) -> None:
+        while self._entries:
+            access_token, (value, used_at) = next(iter(self._entries.items()))
+            if now - used_at < self.idle_n_seconds or value.is_busy():
+                return
+
+            del self._entries[access_token]
@@ -0,0 +1,130 @@
+import asyncio
+import time
+from dataclasses import dataclass
+
+import structlog
+
+from .idle_cache import DEFAULT_IDLE_N_SECONDS, IdleCache
+
+log = structlog.stdlib.get_logger()
+
+# --------------------------------------------------------------------------------------------------
+
+# NB: VK allows 3 requests per second for user access tokens.
+# Service tokens have higher limits, but we don't rely on that.
+VK_REQUESTS_PER_SECOND = 3
+
+
+# --------------------------------------------------------------------------------------------------
+
+
+@dataclass
+class RateLimitStats:
+    # Number of requests currently waiting for a free slot.
+    queue_depth: int
+    # Total number of requests that went through the limiter.
+    num_acquired: int
+    # Number of requests that had to wait for a free slot.
+    num_waited: int
+    total_wait_n_seconds: float
+    max_wait_n_seconds: float
+
+
+class TokenBucket:
+    def __init__(self, *, rate: float, capacity: float) -> None:
+        self.rate = rate
+        self.capacity = capacity
+
+        self._tokens = capacity
+        self._refilled_at = time.monotonic()
+        # NB: `asyncio.Lock` wakes up waiters in FIFO order,
+        # so requests are served in the order they arrived.
+        self._lock = asyncio.Lock()
+
+        self._queue_depth = 0
+        self._num_acquired = 0
+        self._num_waited = 0
+        self._total_wait_n_seconds = 0.0
+        self._max_wait_n_seconds = 0.0
+
+    async def acquire(self) -> float:
+        started_at = time.monotonic()
+        self._queue_depth += 1
+
+        try:
+            async with self._lock:
+                while True:
+                    self._refill()
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        break
+
+                    await asyncio.sleep((1 - self._tokens) / self.rate)
+        finally:
+            self._queue_depth -= 1
+
+        waited_n_seconds = time.monotonic() - started_at
+        self._num_acquired += 1
+        # NB: Lock acquisition alone takes a few microseconds, ignore it.
+        if waited_n_seconds > 0.001:
+            self._num_waited += 1
+            self._total_wait_n_seconds += waited_n_seconds
+            self._max_wait_n_seconds = max(self._max_wait_n_seconds, waited_n_seconds)
+
+        return waited_n_seconds
+
+    # NB: Waiters hold on to the bucket, so it must outlive them.
+    def is_busy(self) -> bool:
+        return self._queue_depth > 0 or self._lock.locked()
+
+    def drain(self) -> None:
+        # Called when VK rejects a request anyway (e.g. the same token is used
+        # by another process), so that the next requests back off a bit.
+        self._refill()
+        self._tokens = min(self._tokens, 0)
+
+    def stats(self) -> RateLimitStats:
+        return RateLimitStats(
+            queue_depth=self._queue_depth,
+            num_acquired=self._num_acquired,
+            num_waited=self._num_waited,
+            total_wait_n_seconds=self._total_wait_n_seconds,
+            max_wait_n_seconds=self._max_wait_n_seconds,
+        )
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        elapsed = now - self._refilled_at
+        self._refilled_at = now
+        self._tokens = min(self.capacity, self._tokens + elapsed * self.rate)
+
+
+# --------------------------------------------------------------------------------------------------
+
+
+# Keeps one token bucket per access token, so that every `Client`
+# with the same access token shares the same budget.
+class RateLimiter:
+    def __init__(
+        self,
+        *,
+        requests_per_second: float = VK_REQUESTS_PER_SECOND,
+        burst: float = VK_REQUESTS_PER_SECOND,
+        idle_n_seconds: float = DEFAULT_IDLE_N_SECONDS,
+    ) -> None:
+        self.requests_per_second = requests_per_second
+        self.burst = burst
+        self._buckets: IdleCache[TokenBucket] = IdleCache(idle_n_seconds=idle_n_seconds)
+
+    def bucket(self, access_token: str) -> TokenBucket:
+        return self._buckets.get_or_create(
+            access_token,
+            lambda: TokenBucket(rate=self.requests_per_second, capacity=self.burst),
+        )
+
+    def stats(self) -> dict[str, RateLimitStats]:
+        # NB: Never expose access tokens, only their short suffix.
+        return {
+            f"...{access_token[-6:]}": bucket.stats()
+            for access_token, bucket in self._buckets.items()
+        }
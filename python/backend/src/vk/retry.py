@@ -0,0 +1,89 @@
+import random
+from dataclasses import dataclass, field
+from typing import Protocol
+
+# --------------------------------------------------------------------------------------------------
+
+
+class Backoff(Protocol):
+    def delay_n_seconds(self, attempt: int) -> float: ...
+
+
+@dataclass
+class ConstantBackoff:
+    n_seconds: float
+
+    def delay_n_seconds(self, attempt: int) -> float:
+        return self.n_seconds
+
+
+@dataclass
+class ExponentialBackoff:
+    base_n_seconds: float = 0.35
+    multiplier: float = 2.0
+    max_n_seconds: float = 30.0
+    # NB: "Full jitter" spreads retries of concurrent callers, so they don't hit
+    # VK at the same moment again.
+    jitter: bool = True
+
+    def delay_n_seconds(self, attempt: int) -> float:
+        delay = min(
+            self.max_n_seconds,
+            self.base_n_seconds * self.multiplier ** max(attempt - 1, 0),
+        )
+        if self.jitter:
+            return random.uniform(0, delay)
+        return delay
+
+
+# --------------------------------------------------------------------------------------------------
+
+
+@dataclass
+class RetryPolicy:
+    backoff: Backoff = field(default_factory=ExponentialBackoff)
+    # `None` means unlimited.
+    max_attempts: int | None = 10
+    deadline_n_seconds: float | None = 60.0
+
+    def next_delay_n_seconds(
+        self,
+        *,
+        attempt: int,
+        elapsed_n_seconds: float,
+        retry_after_n_seconds: float | None = None,
+    ) -> float | None:
+        # NB: `None` means that the caller should give up.
+        if self.max_attempts is not None and attempt >= self.max_attempts:
+            return None
+
+        delay = self.backoff.delay_n_seconds(attempt)
+        if retry_after_n_seconds is not None:
+            delay = max(delay, retry_after_n_seconds)
+
+        if (
+            self.deadline_n_seconds is not None
+            and elapsed_n_seconds + delay > self.deadline_n_seconds
+        ):
+            return None
+
+        return delay
+
+
+# --------------------------------------------------------------------------------------------------
+
+DEFAULT_RETRY_POLICY = RetryPolicy()
+
+# For requests made while a user waits for the response.
+INTERACTIVE_RETRY_POLICY = RetryPolicy(
+    backoff=ExponentialBackoff(max_n_seconds=5.0),
+    max_attempts=6,
+    deadline_n_seconds=20.0,
+)
+
+# For background jobs, where losing progress is much worse than waiting.
+BACKGROUND_RETRY_POLICY = RetryPolicy(
+    backoff=ExponentialBackoff(max_n_seconds=60.0),
+    max_attempts=None,
+    deadline_n_seconds=15 * 60.0,
+)
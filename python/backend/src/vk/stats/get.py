@@ -43,18 +43,14 @@ class GetStatsResponse(pydantic.BaseModel):
     stats: list[Stats]
 
 
-class _GetStatsResponseOuter(pydantic.BaseModel):
-    response: list[Stats]
-
-
 async def get_stats(
     client: Client,
     request: GetStatsRequest,
 ) -> GetStatsResponse:
-    response = await client._get(
-        url="https://api.vk.com/method/stats.get",
+    stats = await client._call(
+        "stats.get",
         params=request.model_dump(),
-        response_model=_GetStatsResponseOuter,
+        response_type=list[Stats],
     )
 
-    return GetStatsResponse(stats=response.response)
+    return GetStatsResponse(stats=stats)
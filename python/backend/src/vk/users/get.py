@@ -155,18 +155,14 @@ class GetUsersResponse(pydantic.BaseModel):
     users: list[User]
 
 
-class _GetUsersResponseOuter(pydantic.BaseModel):
-    response: list[User]
-
-
 async def get_users(
     client: Client,
     request: GetUsersRequest,
 ) -> GetUsersResponse:
-    response = await client._get(
-        url="https://api.vk.com/method/users.get",
+    users = await client._call(
+        "users.get",
         params=request.model_dump(),
-        response_model=_GetUsersResponseOuter,
+        response_type=list[User],
     )
 
-    return GetUsersResponse(users=response.response)
+    return GetUsersResponse(users=users)
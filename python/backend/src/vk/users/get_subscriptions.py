@@ -18,17 +18,12 @@ class GetSubscriptionsResponse(pydantic.BaseModel):
     groups: Subscriptions
 
 
-class _GetSubscriptionsResponseOuter(pydantic.BaseModel):
-    response: GetSubscriptionsResponse
-
-
 async def get_subscriptions(
     client: Client,
     request: GetSubscriptionsRequest,
 ) -> GetSubscriptionsResponse:
-    response = await client._get(
-        url="https://api.vk.com/method/users.getSubscriptions",
+    return await client._call(
+        "users.getSubscriptions",
         params=request.model_dump(),
-        response_model=_GetSubscriptionsResponseOuter,
+        response_type=GetSubscriptionsResponse,
     )
-    return response.response
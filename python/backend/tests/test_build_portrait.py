@@ -0,0 +1,99 @@
+import json
+import random
+from datetime import datetime
+from pathlib import Path
+
+import pytest
+from portraits import build, build_portrait
+from vk.users import User
+
+# NB:
+#   Portraits built by the previous, per-user implementation of `build_portrait`
+#   from the same users, see `_users`. Ages depend on the current time, so it's frozen.
+GOLDEN_PORTRAITS_PATH = Path(__file__).parent / "data" / "build_portrait.json"
+
+NOW = datetime(2026, 1, 15, 12, 30)
+
+_CITIES = ["Москва", "Санкт-Петербург", "Казань"] + [f"Город {i}" for i in range(20)]
+_LANGS = ["Русский", "English", "Deutsch", "Français", "Español"]
+
+
+class _FrozenDatetime(datetime):
+    @classmethod
+    def now(cls, tz=None) -> datetime:  # type: ignore
+        return NOW
+
+
+# NB:
+#   Random users with every field optional, partial and future birth dates, ages below 13
+#   and over 100, repeated languages, and few distinct values in small groups, so that
+#   the most common values tie.
+def _users(seed: int, num_users: int) -> list[User]:
+    rng = random.Random(seed)
+    cities = _CITIES[:3] if num_users < 100 else _CITIES
+
+    def user(id: int) -> User:
+        data: dict = {
+            "id": id,
+            "first_name": "Имя",
+            "last_name": "Фамилия",
+            "can_access_closed": rng.random() < 0.8,
+        }
+        if rng.random() < 0.1:
+            data["deactivated"] = rng.choice(["deleted", "banned"])
+        if rng.random() < 0.9:
+            data["sex"] = rng.choice([0, 1, 2])
+
+        day, month = rng.randint(1, 28), rng.randint(1, 12)
+        birth_date = rng.random()
+        if birth_date < 0.6:
+            data["bdate"] = f"{day}.{month}.{rng.randint(1915, 2027)}"
+        elif birth_date < 0.8:
+            data["bdate"] = f"{day}.{month}"
+
+        if rng.random() < 0.7:
+            city = rng.choice(cities)
+            data["city"] = {"id": _CITIES.index(city), "title": city}
+        if rng.random() < 0.5:
+            data["relation"] = rng.randint(0, 8)
+
+        if rng.random() < 0.6:
+            data["personal"] = {
+                field: rng.randint(0, max_value)
+                for field, max_value in [
+                    ("political", 9),
+                    ("people_main", 6),
+                    ("life_main", 8),
+                    ("smoking", 5),
+                    ("alcohol", 5),
+                ]
+                if rng.random() < 0.7
+            }
+            if rng.random() < 0.5:
+                data["personal"]["langs"] = rng.sample(_LANGS, rng.randint(0, 3)) + (
+                    ["English"] if rng.random() < 0.1 else []
+                )
+
+        return User.model_validate(data)
+
+    return [user(id) for id in range(1, num_users + 1)]
+
+
+def _load_golden_portraits() -> list[dict]:
+    return json.loads(GOLDEN_PORTRAITS_PATH.read_text())
+
+
+# --------------------------------------------------------------------------------------------------
+
+
+@pytest.mark.parametrize(
+    "golden",
+    _load_golden_portraits(),
+    ids=lambda golden: f"seed={golden['seed']}-num_users={golden['num_users']}",
+)
+def test_builds_the_same_portraits_as_before(golden: dict, monkeypatch):
+    monkeypatch.setattr(build, "datetime", _FrozenDatetime)
+
+    portrait = build_portrait(_users(golden["seed"], golden["num_users"]))
+
+    assert portrait.model_dump(mode="json") == golden["portrait"]
@@ -0,0 +1,181 @@
+import asyncio
+from urllib.parse import parse_qs
+
+import httpx
+import pytest
+import vk
+from vk.errors import (
+    AccessDeniedError,
+    RateLimitError,
+    RequestValidationError,
+    TransientApiError,
+)
+from vk.rate_limit import RateLimiter
+
+pytestmark = pytest.mark.anyio
+
+
+# Answers `execute` with `responses` and direct calls with `{"response": <method>}`,
+# recording the requests.
+class _FakeVk:
+    def __init__(self, *responses: dict) -> None:
+        self.responses = list(responses)
+        self.requests: list[httpx.Request] = []
+
+    def handle(self, request: httpx.Request) -> httpx.Response:
+        self.requests.append(request)
+
+        method = request.url.path.rsplit("/", 1)[-1]
+        if method != "execute":
+            return httpx.Response(200, json={"response": method})
+
+        return httpx.Response(200, json=self.responses.pop(0))
+
+    def client(self) -> vk.Client:
+        return vk.Client(
+            http_client=httpx.AsyncClient(transport=httpx.MockTransport(self.handle)),
+            access_token="token",
+            rate_limiter=RateLimiter(requests_per_second=1000, burst=1000),
+            coalesce_calls=True,
+        )
+
+
+def _execute_code(request: httpx.Request) -> str:
+    return parse_qs(request.content.decode())["code"][0]
+
+
+# --------------------------------------------------------------------------------------------------
+
+
+async def test_packs_concurrent_calls_into_one_execute():
+    fake_vk = _FakeVk({"response": [1, [2, 3], "x"]})
+    client = fake_vk.client()
+
+    results = await asyncio.gather(
+        client._call("users.get", {"user_ids": "1"}, int),
+        client._call("groups.getMembers", {"group_id": 2, "offset": None}, list[int]),
+        client._call("groups.getById", {"group_ids": "x"}, str),
+    )
+
+    assert results == [1, [2, 3], "x"]
+    assert len(fake_vk.requests) == 1
+
+    code = _execute_code(fake_vk.requests[0])
+    assert code.startswith("return[") and code.endswith("];")
+    assert 'API.users.get({"user_ids": "1"})' in code
+    # NB: `None` params are dropped rather than sent as `null`.
+    assert 'API.groups.getMembers({"group_id": 2})' in code
+
+
+async def test_sends_a_single_call_directly():
+    fake_vk = _FakeVk()
+    client = fake_vk.client()
+
+    assert await client._call("users.get", {"user_ids": "1"}, str) == "users.get"
+    assert [r.url.path for r in fake_vk.requests] == ["/method/users.get"]
+
+
+async def test_maps_false_slots_to_their_errors_in_order():
+    fake_vk = _FakeVk(
+        {
+            "response": [False, 1, False, False, False],
+            "execute_errors": [
+                {"method": "users.get", "error_code": 6, "error_msg": "Too many"},
+                {"method": "groups.get", "error_code": 10, "error_msg": "Internal"},
+                {"method": "groups.get", "error_code": 260, "error_msg": "Denied"},
+                {"method": "users.get", "error_code": 100, "error_msg": "Bad param"},
+            ],
+        }
+    )
+    client = fake_vk.client()
+
+    results = await asyncio.gather(
+        *(client._call("users.get", {"user_ids": str(i)}, int) for i in range(5)),
+        return_exceptions=True,
+    )
+
+    assert isinstance(results[0], RateLimitError)
+    assert results[1] == 1
+    assert isinstance(results[2], TransientApiError)
+    assert results[2].error_code == 10
+    assert isinstance(results[3], AccessDeniedError)
+    assert isinstance(results[4], RequestValidationError)
+    assert "Bad param" in str(results[4])
+
+
+async def test_fails_calls_missing_from_the_response():
+    fake_vk = _FakeVk({"response": [1]})
+    client = fake_vk.client()
+
+    results = await asyncio.gather(
+        client._call("users.get", {"user_ids": "1"}, int),
+        client._call("users.get", {"user_ids": "2"}, int),
+        return_exceptions=True,
+    )
+
+    assert results[0] == 1
+    assert isinstance(results[1], RequestValidationError)
+
+
+async def test_fails_only_the_call_with_an_invalid_result():
+    fake_vk = _FakeVk({"response": [1, "not a number"]})
+    client = fake_vk.client()
+
+    results = await asyncio.gather(
+        client._call("users.get", {"user_ids": "1"}, int),
+        client._call("users.get", {"user_ids": "2"}, int),
+        return_exceptions=True,
+    )
+
+    assert results[0] == 1
+    assert isinstance(results[1], Exception)
+
+
+async def test_fails_every_call_when_the_execute_fails():
+    fake_vk = _FakeVk({"error": {"error_code": 6, "error_msg": "Too many requests"}})
+    client = fake_vk.client()
+
+    results = await asyncio.gather(
+        client._call("users.get", {"user_ids": "1"}, int),
+        client._call("users.get", {"user_ids": "2"}, int),
+        return_exceptions=True,
+    )
+
+    assert all(isinstance(result, RateLimitError) for result in results)
+
+
+async def test_splits_batches_over_the_execute_limit():
+    num_calls = vk.VK_EXECUTE_MAX_REQUESTS + 1
+    fake_vk = _FakeVk({"response": list(range(vk.VK_EXECUTE_MAX_REQUESTS))})
+    client = fake_vk.client()
+
+    results = await asyncio.gather(
+        *(
+            client._call("users.get", {"user_ids": str(i)}, int | str)
+            for i in range(num_calls)
+        )
+    )
+
+    assert results[: vk.VK_EXECUTE_MAX_REQUESTS] == list(
+        range(vk.VK_EXECUTE_MAX_REQUESTS)
+    )
+    # NB: The one left over goes directly.
+    assert results[-1] == "users.get"
+    assert sorted(r.url.path for r in fake_vk.requests) == [
+        "/method/execute",
+        "/method/users.get",
+    ]
+
+
+async def test_shares_coalescers_between_clients_of_the_same_access_token():
+    fake_vk = _FakeVk({"response": [1, 2]})
+    client = fake_vk.client()
+    other_client = client.with_new_access_token("token")
+
+    results = await asyncio.gather(
+        client._call("users.get", {"user_ids": "1"}, int),
+        other_client._call("users.get", {"user_ids": "2"}, int),
+    )
+
+    assert results == [1, 2]
+    assert len(fake_vk.requests) == 1
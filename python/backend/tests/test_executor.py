@@ -0,0 +1,114 @@
+import asyncio
+
+import pytest
+from background import JobExecutor
+
+pytestmark = pytest.mark.anyio
+
+
+class _Jobs:
+    def __init__(self) -> None:
+        self.running: set[str] = set()
+        self.max_running = 0
+        self.release = asyncio.Event()
+
+    def job(self, name: str):
+        async def run() -> None:
+            self.running.add(name)
+            self.max_running = max(self.max_running, len(self.running))
+            try:
+                await self.release.wait()
+            finally:
+                self.running.discard(name)
+
+        return run
+
+
+async def _settle() -> None:
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+# --------------------------------------------------------------------------------------------------
+
+
+async def test_limits_running_jobs_globally_and_per_key():
+    executor = JobExecutor(
+        max_concurrent_jobs=3,
+        max_concurrent_jobs_per_key=2,
+        max_queued_jobs=10,
+    )
+    jobs = _Jobs()
+
+    for name in ["a1", "a2", "a3", "b1", "b2"]:
+        assert executor.submit(jobs.job(name), key=name[0], name=name)
+    await _settle()
+
+    # NB: "a3" waits for a slot of its key, without blocking "b1" behind it.
+    assert jobs.running == {"a1", "a2", "b1"}
+    assert executor.stats().num_queued == 2
+
+    jobs.release.set()
+    while executor.stats().num_completed < 5:
+        await asyncio.sleep(0.01)
+
+    assert jobs.max_running == 3
+    assert executor.stats().num_running == 0
+
+
+async def test_rejects_jobs_over_the_queue_limit():
+    executor = JobExecutor(
+        max_concurrent_jobs=1,
+        max_concurrent_jobs_per_key=1,
+        max_queued_jobs=1,
+    )
+    jobs = _Jobs()
+
+    assert executor.num_free_slots() == 2
+    assert executor.submit(jobs.job("1"), key=1, name="1")
+    assert executor.submit(jobs.job("2"), key=1, name="2")
+    assert executor.num_free_slots() == 0
+    assert not executor.submit(jobs.job("3"), key=2, name="3")
+    assert executor.stats().num_rejected == 1
+
+    await executor.shutdown()
+
+
+async def test_counts_failed_jobs_and_keeps_going():
+    executor = JobExecutor(
+        max_concurrent_jobs=1,
+        max_concurrent_jobs_per_key=1,
+        max_queued_jobs=1,
+    )
+    jobs = _Jobs()
+    jobs.release.set()
+
+    async def crash() -> None:
+        raise RuntimeError("crash")
+
+    executor.submit(crash, key=1, name="crash")
+    executor.submit(jobs.job("next"), key=1, name="next")
+    while executor.stats().num_completed < 1:
+        await asyncio.sleep(0.01)
+
+    assert executor.stats().num_failed == 1
+
+
+async def test_cancels_running_and_drops_queued_jobs_on_shutdown():
+    executor = JobExecutor(
+        max_concurrent_jobs=1,
+        max_concurrent_jobs_per_key=1,
+        max_queued_jobs=1,
+    )
+    jobs = _Jobs()
+    executor.submit(jobs.job("running"), key=1, name="running")
+    executor.submit(jobs.job("queued"), key=1, name="queued")
+    await _settle()
+
+    await executor.shutdown(timeout_n_seconds=1)
+
+    assert jobs.running == set()
+    assert executor.stats().num_running == 0
+    assert executor.stats().num_queued == 0
+    assert jobs.max_running == 1
+    assert not executor.submit(jobs.job("late"), key=1, name="late")
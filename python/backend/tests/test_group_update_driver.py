@@ -0,0 +1,234 @@
+import asyncio
+from uuid import UUID, uuid4
+
+import asyncpg
+import httpx
+import postgres
+import pytest
+import vk
+from job import JobStatus
+from background import JobExecutor
+from background.groups import driver, update_job
+from background.groups.update_job import GroupUpdateJob
+
+pytestmark = pytest.mark.anyio
+
+
+async def _insert_access_token(pg_pool: asyncpg.Pool, user_id: int) -> None:
+    async with pg_pool.acquire() as conn:
+        await conn.execute(
+            """
+                INSERT INTO vk_oauth_tokens (user_id, access_token)
+                VALUES ($1, $2)
+            """,
+            user_id,
+            f"token-{user_id}",
+        )
+
+
+async def _insert_jobs(
+    pg_pool: asyncpg.Pool,
+    *,
+    user_id: int,
+    group_ids: list[int],
+) -> list[UUID]:
+    return await postgres.group_update_jobs.insert_many(
+        pg_pool,
+        request_id=uuid4(),
+        user_id=user_id,
+        group_ids=group_ids,
+    )
+
+
+# --------------------------------------------------------------------------------------------------
+
+
+async def test_starts_new_jobs_without_waiting_for_the_poll(pg_pool, monkeypatch):
+    started_job_ids: asyncio.Queue = asyncio.Queue()
+
+    async def run_update_job(_vk_client, _pg_pool, _storage, _portraits, job, _wakeup):
+        started_job_ids.put_nowait(job.id)
+
+    monkeypatch.setattr(driver, "_run_update_job", run_update_job)
+    await _insert_access_token(pg_pool, user_id=1)
+
+    executor = JobExecutor(
+        max_concurrent_jobs=1,
+        max_concurrent_jobs_per_key=1,
+        max_queued_jobs=1,
+    )
+    drive = asyncio.create_task(
+        driver.drive_update_jobs(
+            pg_pool,
+            vk.Client(http_client=httpx.AsyncClient(), access_token="service"),
+            None,  # type: ignore
+            None,  # type: ignore
+            executor,
+            poll_every_n_seconds=3600,
+        )
+    )
+    try:
+        # NB: Let the driver start listening and drive once.
+        await asyncio.sleep(0.5)
+
+        [job_id] = await postgres.group_update_jobs.insert_many(
+            pg_pool,
+            request_id=uuid4(),
+            user_id=1,
+            group_ids=[1],
+        )
+
+        assert await asyncio.wait_for(started_job_ids.get(), timeout=5) == job_id
+    finally:
+        drive.cancel()
+        await executor.shutdown()
+
+
+async def test_concurrent_workers_claim_disjoint_jobs(pg_pool):
+    for user_id in range(1, 11):
+        await _insert_jobs(
+            pg_pool,
+            user_id=user_id,
+            group_ids=[user_id * 100 + i for i in range(5)],
+        )
+
+    claims = await asyncio.gather(
+        *(
+            driver._claim_jobs(
+                pg_pool,
+                worker_id=f"worker-{i}",
+                max_jobs_per_user=2,
+                limit=50,
+            )
+            for i in range(3)
+        )
+    )
+    claimed_jobs = [job for claim in claims for job in claim]
+
+    assert len({job.id for job in claimed_jobs}) == len(claimed_jobs)
+    # NB: Only the oldest `max_jobs_per_user` jobs of every user are claimable.
+    assert len(claimed_jobs) == 10 * 2
+    num_jobs_per_user: dict[int, int] = {}
+    for job in claimed_jobs:
+        num_jobs_per_user[job.user_id] = num_jobs_per_user.get(job.user_id, 0) + 1
+    assert set(num_jobs_per_user.values()) == {2}
+
+
+async def test_reclaims_jobs_with_expired_leases(pg_pool):
+    [job_id] = await _insert_jobs(pg_pool, user_id=1, group_ids=[1])
+
+    [claimed] = await driver._claim_jobs(
+        pg_pool,
+        worker_id="a",
+        max_jobs_per_user=1,
+        limit=10,
+    )
+    assert claimed.id == job_id
+    assert (
+        await driver._claim_jobs(
+            pg_pool,
+            worker_id="b",
+            max_jobs_per_user=1,
+            limit=10,
+        )
+        == []
+    )
+
+    async with pg_pool.acquire() as conn:
+        await conn.execute(
+            """
+                UPDATE group_update_jobs
+                SET lease_expires_at = NOW() - INTERVAL '1 second'
+            """
+        )
+    [reclaimed] = await driver._claim_jobs(
+        pg_pool,
+        worker_id="b",
+        max_jobs_per_user=1,
+        limit=10,
+    )
+
+    assert reclaimed.id == job_id
+    assert reclaimed.previous_status == JobStatus.Running
+    job = GroupUpdateJob(id=job_id, group_id=1, lease_owner="a")
+    assert not await update_job._renew_lease(pg_pool, job)
+    assert await update_job._renew_lease(
+        pg_pool, job.model_copy(update={"lease_owner": "b"})
+    )
+
+
+async def test_stops_jobs_whose_lease_was_taken_over(pg_pool, monkeypatch):
+    monkeypatch.setattr(update_job, "JOB_LEASE_RENEW_EVERY_N_SECONDS", 0.01)
+    [job_id] = await _insert_jobs(pg_pool, user_id=1, group_ids=[1])
+    await driver._claim_jobs(pg_pool, worker_id="b", max_jobs_per_user=1, limit=10)
+
+    work = asyncio.create_task(asyncio.sleep(60))
+    job = GroupUpdateJob(id=job_id, group_id=1, lease_owner="a")
+    await asyncio.wait_for(update_job._keep_lease(pg_pool, job, work), timeout=5)
+
+    with pytest.raises(asyncio.CancelledError):
+        await work
+
+
+async def test_fails_jobs_of_users_without_access_tokens(pg_pool, monkeypatch):
+    started_job_ids: list[UUID] = []
+
+    async def run_update_job(_vk_client, _pg_pool, _storage, _portraits, job, _wakeup):
+        started_job_ids.append(job.id)
+
+    monkeypatch.setattr(driver, "_run_update_job", run_update_job)
+    [job_id] = await _insert_jobs(pg_pool, user_id=1, group_ids=[1])
+
+    executor = JobExecutor(
+        max_concurrent_jobs=1,
+        max_concurrent_jobs_per_key=1,
+        max_queued_jobs=1,
+    )
+    await driver._drive_once(
+        pg_pool,
+        vk.Client(http_client=httpx.AsyncClient(), access_token="service"),
+        None,  # type: ignore
+        None,  # type: ignore
+        executor,
+        asyncio.Event(),
+        worker_id="worker",
+    )
+
+    [job] = await postgres.group_update_jobs.list_by_ids(pg_pool, job_ids=[job_id])
+    assert job.status == JobStatus.Failed
+    assert job.info.error == "Missing access token"  # type: ignore
+    assert started_job_ids == []
+
+
+async def test_falls_back_to_access_tokens_of_other_requesters(pg_pool, monkeypatch):
+    started_job_ids: asyncio.Queue = asyncio.Queue()
+
+    async def run_update_job(_vk_client, _pg_pool, _storage, _portraits, job, _wakeup):
+        started_job_ids.put_nowait(job.id)
+
+    monkeypatch.setattr(driver, "_run_update_job", run_update_job)
+    [job_id] = await _insert_jobs(pg_pool, user_id=1, group_ids=[1])
+    await _insert_jobs(pg_pool, user_id=2, group_ids=[1])
+    await _insert_access_token(pg_pool, user_id=2)
+
+    executor = JobExecutor(
+        max_concurrent_jobs=1,
+        max_concurrent_jobs_per_key=1,
+        max_queued_jobs=1,
+    )
+    await driver._drive_once(
+        pg_pool,
+        vk.Client(http_client=httpx.AsyncClient(), access_token="service"),
+        None,  # type: ignore
+        None,  # type: ignore
+        executor,
+        asyncio.Event(),
+        worker_id="worker",
+    )
+    try:
+        assert await asyncio.wait_for(started_job_ids.get(), timeout=5) == job_id
+    finally:
+        await executor.shutdown()
+
+    async with pg_pool.acquire() as conn:
+        assert await conn.fetchval("SELECT user_id FROM group_update_jobs") == 2
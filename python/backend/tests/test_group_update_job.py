@@ -0,0 +1,202 @@
+import asyncio
+from uuid import uuid4
+
+import asyncpg
+import postgres
+import pytest
+from background.groups import driver, update_job
+from background.groups.update_job import GroupUpdateJob
+from job import JobStatus
+from memberships import MembershipStorage
+from vk.errors import AuthorizationError
+from vk.groups.get_members_via_execute import GetMembersViaExecuteResponse
+
+pytestmark = pytest.mark.anyio
+
+CHUNK_SIZE = 10
+
+
+class _Crash(Exception):
+    pass
+
+
+@pytest.fixture
+def member_ids(monkeypatch) -> list[int]:
+    member_ids = list(range(1, 26))
+
+    async def fetch_members_chunk(_vk_client, _job, *, offset: int):
+        return GetMembersViaExecuteResponse(
+            total_count=len(member_ids),
+            member_ids=member_ids[offset : offset + CHUNK_SIZE],
+        )
+
+    monkeypatch.setattr(update_job, "MEMBERS_CHUNK_SIZE", CHUNK_SIZE)
+    monkeypatch.setattr(update_job, "_fetch_members_chunk", fetch_members_chunk)
+    return member_ids
+
+
+async def _insert_running_job(pg_pool: asyncpg.Pool) -> GroupUpdateJob:
+    job = GroupUpdateJob(id=uuid4(), group_id=1, lease_owner="worker")
+
+    async with pg_pool.acquire() as conn:
+        await conn.execute(
+            """
+                INSERT INTO vk_groups (id, name, screen_name, members_count)
+                VALUES ($1, 'group', 'group', 0)
+            """,
+            job.group_id,
+        )
+        await conn.execute(
+            """
+                INSERT INTO group_update_jobs (
+                    id, request_id, user_id, group_id, status, info, lease_owner
+                )
+                VALUES ($1, $2, 1, $3, 'RUNNING', '{"type": "RUNNING"}', $4)
+            """,
+            job.id,
+            uuid4(),
+            job.group_id,
+            job.lease_owner,
+        )
+
+    return job
+
+
+# --------------------------------------------------------------------------------------------------
+
+
+async def test_resumes_after_the_last_partial_chunk(pg_pool, member_ids, monkeypatch):
+    storage = MembershipStorage(pg_pool)
+    job = await _insert_running_job(pg_pool)
+
+    async def crash(**_kwargs):
+        raise _Crash()
+
+    # NB: Every chunk is staged, but the worker dies before applying them.
+    with monkeypatch.context() as m:
+        m.setattr(storage, "apply_staged_members", crash)
+        with pytest.raises(_Crash):
+            await update_job._update_members(None, pg_pool, storage, job)  # type: ignore
+
+    assert await update_job._select_resumable_checkpoint_offset(pg_pool, job) == len(
+        member_ids
+    )
+
+    await update_job._update_members(None, pg_pool, storage, job)  # type: ignore
+
+    snapshot = await storage.read_member_ids(job.group_id)
+    assert snapshot.user_ids.tolist() == member_ids
+
+
+async def test_hands_jobs_over_when_the_access_token_is_rejected(
+    pg_pool, member_ids, monkeypatch
+):
+    storage = MembershipStorage(pg_pool)
+    job = await _insert_running_job(pg_pool)
+    async with pg_pool.acquire() as conn:
+        await conn.execute("UPDATE group_update_jobs SET requester_user_ids = '{1, 2}'")
+
+    async def fetch_members_chunk(_vk_client, _job, *, offset: int):
+        if offset == 0:
+            return GetMembersViaExecuteResponse(
+                total_count=len(member_ids),
+                member_ids=member_ids[:CHUNK_SIZE],
+            )
+
+        # NB: Let the first chunk be staged.
+        await asyncio.sleep(0.1)
+        raise AuthorizationError("Authorization failed", response=None)
+
+    monkeypatch.setattr(update_job, "_fetch_members_chunk", fetch_members_chunk)
+    assert not await update_job.group_update_job(None, pg_pool, storage, job)  # type: ignore
+
+    [updated_job] = await postgres.group_update_jobs.list_by_ids(
+        pg_pool,
+        job_ids=[job.id],
+    )
+    assert updated_job.status == JobStatus.Pending
+    [claimed_job] = await driver._claim_jobs(
+        pg_pool,
+        worker_id="worker",
+        max_jobs_per_user=1,
+        limit=10,
+    )
+    assert claimed_job.user_id == 2
+    assert claimed_job.requester_user_ids == [2]
+    # NB: The next owner resumes the job instead of refetching the staged members.
+    assert (
+        await update_job._select_resumable_checkpoint_offset(pg_pool, job) == CHUNK_SIZE
+    )
+
+
+async def test_fails_jobs_when_no_one_else_requested_them(
+    pg_pool, member_ids, monkeypatch
+):
+    storage = MembershipStorage(pg_pool)
+    job = await _insert_running_job(pg_pool)
+
+    async def fetch_members_chunk(_vk_client, _job, *, offset: int):
+        raise AuthorizationError("Authorization failed", response=None)
+
+    monkeypatch.setattr(update_job, "_fetch_members_chunk", fetch_members_chunk)
+    assert await update_job.group_update_job(None, pg_pool, storage, job)  # type: ignore
+
+    [updated_job] = await postgres.group_update_jobs.list_by_ids(
+        pg_pool,
+        job_ids=[job.id],
+    )
+    assert updated_job.status == JobStatus.Failed
+
+
+async def test_holds_a_bounded_number_of_chunks_with_a_slow_writer(monkeypatch):
+    num_chunks = 40
+    num_chunks_in_memory = 0
+    max_num_chunks_in_memory = 0
+
+    async def fetch_members_chunk(_vk_client, _job, *, offset: int):
+        nonlocal num_chunks_in_memory, max_num_chunks_in_memory
+        await asyncio.sleep(0)
+
+        num_chunks_in_memory += 1
+        max_num_chunks_in_memory = max(max_num_chunks_in_memory, num_chunks_in_memory)
+        num_members = num_chunks * CHUNK_SIZE
+        return GetMembersViaExecuteResponse(
+            total_count=num_members,
+            member_ids=list(range(offset, min(offset + CHUNK_SIZE, num_members))),
+        )
+
+    async def report_progress(*_args) -> None:
+        pass
+
+    monkeypatch.setattr(update_job, "MEMBERS_CHUNK_SIZE", CHUNK_SIZE)
+    monkeypatch.setattr(update_job, "_fetch_members_chunk", fetch_members_chunk)
+    monkeypatch.setattr(update_job, "_try_report_progress", report_progress)
+
+    queue: asyncio.Queue = asyncio.Queue(maxsize=update_job.MAX_QUEUED_CHUNKS)
+
+    async def on_chunk(_offset: int, _member_ids: list[int]) -> None:
+        await queue.put(None)
+
+    async def write_chunks() -> None:
+        nonlocal num_chunks_in_memory
+        while True:
+            await queue.get()
+            # NB: Much slower than fetching.
+            await asyncio.sleep(0.005)
+            num_chunks_in_memory -= 1
+
+    writer = asyncio.create_task(write_chunks())
+    try:
+        await update_job._fetch_member_chunks(
+            None,  # type: ignore
+            None,  # type: ignore
+            GroupUpdateJob(id=uuid4(), group_id=1, lease_owner="worker"),
+            on_chunk=on_chunk,
+        )
+    finally:
+        writer.cancel()
+
+    # NB: The queued chunks, one per fetcher and the one being written.
+    assert max_num_chunks_in_memory <= (
+        update_job.MAX_QUEUED_CHUNKS + update_job.MAX_CONCURRENT_CHUNK_FETCHES + 1
+    )
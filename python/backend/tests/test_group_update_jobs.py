@@ -0,0 +1,127 @@
+import asyncio
+from uuid import uuid4
+
+import postgres
+import pytest
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_notifies_about_new_jobs_once_committed(pg_pool):
+    payloads: asyncio.Queue[str] = asyncio.Queue()
+    request_id = uuid4()
+
+    def listener(_conn, _pid, _channel, payload: str) -> None:
+        payloads.put_nowait(payload)
+
+    async with pg_pool.acquire() as conn:
+        await conn.add_listener(postgres.group_update_jobs.NEW_JOBS_CHANNEL, listener)
+        try:
+            await postgres.group_update_jobs.insert_many(
+                pg_pool,
+                request_id=request_id,
+                user_id=1,
+                group_ids=[1, 2],
+            )
+
+            assert await asyncio.wait_for(payloads.get(), timeout=5) == str(request_id)
+        finally:
+            await conn.remove_listener(
+                postgres.group_update_jobs.NEW_JOBS_CHANNEL,
+                listener,
+            )
+
+
+async def test_concurrent_requests_share_jobs_of_the_same_groups(pg_pool):
+    group_ids = [3, 1, 2]
+
+    results = await asyncio.gather(
+        *(
+            postgres.group_update_jobs.insert_many(
+                pg_pool,
+                request_id=uuid4(),
+                user_id=user_id,
+                group_ids=group_ids[user_id % 3 :] + group_ids[: user_id % 3],
+            )
+            for user_id in range(20)
+        )
+    )
+
+    async with pg_pool.acquire() as conn:
+        rows = await conn.fetch("SELECT id, group_id FROM group_update_jobs")
+    job_id_by_group_id = {row["group_id"]: row["id"] for row in rows}
+
+    assert len(rows) == 3
+    for user_id, job_ids in enumerate(results):
+        order = group_ids[user_id % 3 :] + group_ids[: user_id % 3]
+        # NB: Ids follow the order of the requested groups.
+        assert job_ids == [job_id_by_group_id[group_id] for group_id in order]
+
+
+async def test_creates_new_jobs_once_the_previous_ones_are_completed(pg_pool):
+    [job_id] = await postgres.group_update_jobs.insert_many(
+        pg_pool,
+        request_id=uuid4(),
+        user_id=1,
+        group_ids=[1],
+    )
+    async with pg_pool.acquire() as conn:
+        await conn.execute("UPDATE group_update_jobs SET status = 'SUCCEEDED'")
+
+    [new_job_id] = await postgres.group_update_jobs.insert_many(
+        pg_pool,
+        request_id=uuid4(),
+        user_id=1,
+        group_ids=[1],
+    )
+
+    assert new_job_id != job_id
+
+
+async def test_doesnt_notify_when_all_jobs_are_shared(pg_pool):
+    await postgres.group_update_jobs.insert_many(
+        pg_pool,
+        request_id=uuid4(),
+        user_id=1,
+        group_ids=[1],
+    )
+    payloads: list[str] = []
+
+    def listener(_conn, _pid, _channel, payload: str) -> None:
+        payloads.append(payload)
+
+    async with pg_pool.acquire() as conn:
+        await conn.add_listener(postgres.group_update_jobs.NEW_JOBS_CHANNEL, listener)
+        try:
+            await postgres.group_update_jobs.insert_many(
+                pg_pool,
+                request_id=uuid4(),
+                user_id=2,
+                group_ids=[1],
+            )
+            await asyncio.sleep(0.2)
+        finally:
+            await conn.remove_listener(
+                postgres.group_update_jobs.NEW_JOBS_CHANNEL,
+                listener,
+            )
+
+    assert payloads == []
+
+
+async def test_records_every_requester_of_shared_jobs(pg_pool):
+    for user_id in [1, 2, 1]:
+        await postgres.group_update_jobs.insert_many(
+            pg_pool,
+            request_id=uuid4(),
+            user_id=user_id,
+            group_ids=[1],
+        )
+
+    async with pg_pool.acquire() as conn:
+        [row] = await conn.fetch(
+            "SELECT user_id, requester_user_ids FROM group_update_jobs"
+        )
+
+    assert row["user_id"] == 1
+    assert row["requester_user_ids"] == [1, 2]
@@ -0,0 +1,84 @@
+import asyncio
+
+import pytest
+from vk.coalescer import ExecuteCoalescer
+from vk.idle_cache import IdleCache
+from vk.rate_limit import RateLimiter
+
+pytestmark = pytest.mark.anyio
+
+
+class _Entry:
+    def __init__(self, *, is_busy: bool = False) -> None:
+        self.busy = is_busy
+
+    def is_busy(self) -> bool:
+        return self.busy
+
+
+# --------------------------------------------------------------------------------------------------
+
+
+async def test_reuses_entries_of_the_same_access_token():
+    cache: IdleCache[_Entry] = IdleCache()
+
+    entry = cache.get_or_create("a", _Entry)
+
+    assert cache.get_or_create("a", _Entry) is entry
+    assert len(cache) == 1
+
+
+async def test_evicts_idle_entries():
+    cache: IdleCache[_Entry] = IdleCache(idle_n_seconds=0.01)
+    idle = cache.get_or_create("a", _Entry)
+
+    await asyncio.sleep(0.02)
+    cache.get_or_create("b", _Entry)
+
+    assert [access_token for access_token, _ in cache.items()] == ["b"]
+    assert cache.get_or_create("a", _Entry) is not idle
+
+
+async def test_keeps_recently_used_entries():
+    cache: IdleCache[_Entry] = IdleCache(idle_n_seconds=0.05)
+    cache.get_or_create("a", _Entry)
+
+    await asyncio.sleep(0.03)
+    cache.get_or_create("a", _Entry)
+    await asyncio.sleep(0.03)
+    cache.get_or_create("b", _Entry)
+
+    assert len(cache) == 2
+
+
+async def test_keeps_busy_entries():
+    cache: IdleCache[_Entry] = IdleCache(idle_n_seconds=0.01)
+    busy = cache.get_or_create("a", lambda: _Entry(is_busy=True))
+
+    await asyncio.sleep(0.02)
+    cache.get_or_create("b", _Entry)
+
+    assert cache.get_or_create("a", _Entry) is busy
+
+
+async def test_rate_limiter_keeps_buckets_with_waiters():
+    rate_limiter = RateLimiter(requests_per_second=20, burst=1, idle_n_seconds=0.01)
+    bucket = rate_limiter.bucket("a")
+    await bucket.acquire()
+
+    waiter = asyncio.create_task(bucket.acquire())
+    await asyncio.sleep(0.02)
+    assert bucket.is_busy()
+    assert rate_limiter.bucket("b") is not bucket
+    assert rate_limiter.bucket("a") is bucket
+
+    await waiter
+    assert not bucket.is_busy()
+
+
+async def test_coalescer_is_busy_while_calls_are_pending():
+    coalescer = ExecuteCoalescer(client=None)  # type: ignore
+    assert not coalescer.is_busy()
+
+    coalescer._pending.append(object())  # type: ignore
+    assert coalescer.is_busy()
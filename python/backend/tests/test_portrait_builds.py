@@ -0,0 +1,215 @@
+import asyncio
+from datetime import timedelta
+from types import SimpleNamespace
+from uuid import UUID, uuid4
+
+import asyncpg
+import httpx
+import postgres
+import pytest
+import vk
+from api.users import average_portrait
+from background import JobExecutor
+from background.groups import driver, update_job
+from background.groups.portraits import PortraitBuilder
+from background.groups.update_job import GroupUpdateJob
+from portraits import PortraitCache
+
+pytestmark = pytest.mark.anyio
+
+
+class _PortraitCache:
+    def __init__(self, pg_pool: asyncpg.Pool) -> None:
+        self.pg_pool = pg_pool
+        # NB: Statuses of the update jobs at the time of every build.
+        self.builds: asyncio.Queue[list[str]] = asyncio.Queue()
+
+    async def get(self, _group_ids: list[int]) -> None:
+        return None
+
+    async def build(self, _vk_client: vk.Client, _group_ids: list[int]) -> None:
+        async with self.pg_pool.acquire() as conn:
+            statuses = await conn.fetch("SELECT status FROM group_update_jobs")
+        self.builds.put_nowait([row["status"] for row in statuses])
+
+
+async def _insert_request(
+    pg_pool: asyncpg.Pool,
+    *,
+    group_ids: list[int],
+) -> list[UUID]:
+    request_id = uuid4()
+    job_ids = await postgres.group_update_jobs.insert_many(
+        pg_pool,
+        request_id=request_id,
+        user_id=1,
+        group_ids=group_ids,
+    )
+
+    async with pg_pool.acquire() as conn:
+        await conn.execute(
+            """
+                INSERT INTO user_average_portrait_requests (
+                    id, user_id, group_ids, update_job_ids
+                )
+                VALUES ($1, 1, $2, $3)
+            """,
+            request_id,
+            group_ids,
+            job_ids,
+        )
+
+    return job_ids
+
+
+# --------------------------------------------------------------------------------------------------
+
+
+async def test_claims_requests_once_all_their_jobs_complete(pg_pool):
+    job_ids = await _insert_request(pg_pool, group_ids=[1, 2])
+
+    claim = postgres.user_average_portrait_requests.claim_portrait_builds
+    assert await claim(pg_pool, update_job_id=job_ids[0]) == []
+
+    async with pg_pool.acquire() as conn:
+        await conn.execute("UPDATE group_update_jobs SET status = 'SUCCEEDED'")
+    # NB: The last jobs of the request completing at the same time.
+    claims = await asyncio.gather(
+        *(claim(pg_pool, update_job_id=job_id) for job_id in job_ids)
+    )
+
+    assert sum(len(requests) for requests in claims) == 1
+    assert await claim(pg_pool, update_job_id=job_ids[0]) == []
+
+
+async def test_builds_portraits_after_the_job_succeeds(pg_pool, monkeypatch):
+    async def do_job(_vk_client, _pg_pool, _storage, _job) -> None:
+        pass
+
+    monkeypatch.setattr(update_job, "_do_job", do_job)
+    [job_id] = await _insert_request(pg_pool, group_ids=[1])
+    await driver._claim_jobs(pg_pool, worker_id="worker", max_jobs_per_user=1, limit=1)
+
+    portrait_cache = _PortraitCache(pg_pool)
+    executor = JobExecutor(
+        max_concurrent_jobs=1,
+        max_concurrent_jobs_per_key=1,
+        max_queued_jobs=1,
+    )
+    try:
+        await driver._run_update_job(
+            vk.Client(http_client=httpx.AsyncClient(), access_token="user"),
+            pg_pool,
+            None,  # type: ignore
+            PortraitBuilder(pg_pool, portrait_cache, executor),  # type: ignore
+            GroupUpdateJob(id=job_id, group_id=1, lease_owner="worker"),
+            asyncio.Event(),
+        )
+
+        statuses = await asyncio.wait_for(portrait_cache.builds.get(), timeout=5)
+        assert statuses == ["SUCCEEDED"]
+    finally:
+        await executor.shutdown()
+
+
+async def test_views_dont_build_portraits_claimed_elsewhere(pg_pool, monkeypatch):
+    [job_id] = await _insert_request(pg_pool, group_ids=[1])
+    request_id = await pg_pool.fetchval("SELECT id FROM user_average_portrait_requests")
+    request = await postgres.user_average_portrait_requests.select_by_id(
+        pg_pool,
+        request_id=request_id,
+    )
+    assert request
+
+    async def select_access_token(_pg_pool, *, user_id: int) -> str:
+        return "user"
+
+    monkeypatch.setattr(
+        postgres.vk_oauth_tokens,
+        "select_access_token",
+        select_access_token,
+    )
+    portrait_cache = _PortraitCache(pg_pool)
+    state = SimpleNamespace(
+        pg_pool=pg_pool,
+        portraits=portrait_cache,
+        vk_client=vk.Client(http_client=httpx.AsyncClient(), access_token="app"),
+    )
+
+    async with pg_pool.acquire() as conn:
+        await conn.execute("UPDATE group_update_jobs SET status = 'SUCCEEDED'")
+    claim = postgres.user_average_portrait_requests.claim_portrait_builds
+    assert await claim(pg_pool, update_job_id=job_id) == [request]
+
+    assert await average_portrait._get_or_build_portrait(state, 1, request) is None  # type: ignore
+    assert portrait_cache.builds.empty()
+
+    # NB: The background build is done, so the next view builds the missing portrait.
+    await postgres.user_average_portrait_requests.release_portrait_builds(
+        pg_pool,
+        request_ids=[request.id],
+    )
+    await average_portrait._get_or_build_portrait(state, 1, request)  # type: ignore
+    assert portrait_cache.builds.qsize() == 1
+
+
+async def test_takes_over_stale_portrait_builds(pg_pool):
+    await _insert_request(pg_pool, group_ids=[1])
+    request_id = await pg_pool.fetchval("SELECT id FROM user_average_portrait_requests")
+
+    claim = postgres.user_average_portrait_requests.claim_portrait_build
+    claims = await asyncio.gather(
+        *(
+            claim(pg_pool, request_id=request_id, stale_after=timedelta(minutes=10))
+            for _ in range(5)
+        )
+    )
+    assert claims.count(True) == 1
+
+    assert not await claim(
+        pg_pool,
+        request_id=request_id,
+        stale_after=timedelta(minutes=10),
+    )
+    assert await claim(pg_pool, request_id=request_id, stale_after=timedelta(0))
+
+
+async def test_shares_concurrent_builds_of_the_same_portrait():
+    members_versions = {1: 1, 2: 1}
+
+    class MembershipStorage:
+        async def list_members_versions(self, _group_ids: list[int]) -> dict[int, int]:
+            return dict(members_versions)
+
+    release = asyncio.Event()
+    builds: list[list[int]] = []
+
+    async def build(_vk_client: vk.Client, group_ids: list[int]) -> list[int]:
+        builds.append(group_ids)
+        await release.wait()
+        return group_ids
+
+    portrait_cache = PortraitCache(
+        None,  # type: ignore
+        MembershipStorage(),  # type: ignore
+        max_profile_age_n_seconds=0,
+    )
+    portrait_cache._build = build  # type: ignore
+    vk_client = vk.Client(http_client=httpx.AsyncClient(), access_token="user")
+
+    shared = [
+        asyncio.create_task(portrait_cache.build(vk_client, group_ids))
+        for group_ids in [[1, 2], [2, 1], [2, 1, 2]]
+    ]
+    await asyncio.sleep(0)
+    # NB: A caller going away doesn't cancel the build for the others.
+    shared[0].cancel()
+    # NB: New members make a new portrait.
+    members_versions[2] = 2
+    other = asyncio.create_task(portrait_cache.build(vk_client, [1, 2]))
+    await asyncio.sleep(0)
+
+    release.set()
+    assert await asyncio.gather(*shared[1:], other) == [[1, 2]] * 3
+    assert builds == [[1, 2], [1, 2]]
+    assert portrait_cache._builds == {}
@@ -0,0 +1,109 @@
+import asyncio
+from types import SimpleNamespace
+
+import httpx
+import pytest
+import vk
+from vk import idle_cache, rate_limit
+from vk.rate_limit import RateLimiter, TokenBucket
+
+pytestmark = pytest.mark.anyio
+
+_sleep = asyncio.sleep
+
+
+# NB: Sleeping advances the clock at once, so that waits are exact and instant.
+class _Clock:
+    def __init__(self) -> None:
+        self.now = 0.0
+        self.sleeps: list[float] = []
+
+    def monotonic(self) -> float:
+        return self.now
+
+    async def sleep(self, n_seconds: float) -> None:
+        self.sleeps.append(n_seconds)
+        self.now += n_seconds
+        await _sleep(0)
+
+
+@pytest.fixture
+def clock(monkeypatch) -> _Clock:
+    clock = _Clock()
+    fake_time = SimpleNamespace(monotonic=clock.monotonic)
+    monkeypatch.setattr(rate_limit, "time", fake_time)
+    monkeypatch.setattr(idle_cache, "time", fake_time)
+    monkeypatch.setattr(
+        rate_limit,
+        "asyncio",
+        SimpleNamespace(Lock=asyncio.Lock, sleep=clock.sleep),
+    )
+    return clock
+
+
+# --------------------------------------------------------------------------------------------------
+
+
+async def test_allows_bursts_and_refills_at_the_rate(clock: _Clock):
+    bucket = TokenBucket(rate=2, capacity=3)
+
+    assert [await bucket.acquire() for _ in range(3)] == [0, 0, 0]
+    assert await bucket.acquire() == 0.5
+    assert clock.sleeps == [0.5]
+
+    # NB: Idle time refills the bucket up to its capacity only.
+    clock.now += 60
+    assert [await bucket.acquire() for _ in range(3)] == [0, 0, 0]
+    assert await bucket.acquire() == 0.5
+
+
+async def test_backs_off_once_drained(clock: _Clock):
+    bucket = TokenBucket(rate=2, capacity=3)
+    await bucket.acquire()
+
+    bucket.drain()
+
+    assert await bucket.acquire() == 0.5
+
+
+async def test_serves_waiters_in_arrival_order(clock: _Clock):
+    bucket = TokenBucket(rate=1, capacity=1)
+    await bucket.acquire()
+    served: list[tuple[int, float]] = []
+
+    async def acquire(i: int) -> None:
+        await bucket.acquire()
+        served.append((i, clock.now))
+
+    await asyncio.gather(*(acquire(i) for i in range(5)))
+
+    # NB: One a second, in the order they started waiting.
+    assert served == [(0, 1), (1, 2), (2, 3), (3, 4), (4, 5)]
+    stats = bucket.stats()
+    assert stats.queue_depth == 0
+    assert stats.num_acquired == 6
+    assert stats.num_waited == 5
+
+
+async def test_limits_every_access_token_separately(clock: _Clock):
+    rate_limiter = RateLimiter(requests_per_second=1, burst=1)
+    client = vk.Client(
+        http_client=httpx.AsyncClient(),
+        access_token="token-aaaaaa",
+        rate_limiter=rate_limiter,
+    )
+    other_client = client.with_new_access_token("token-bbbbbb")
+    same_client = other_client.with_new_access_token("token-aaaaaa")
+
+    await client._wait_for_rate_limit()
+    await other_client._wait_for_rate_limit()
+    assert clock.sleeps == []
+
+    # NB: Derived clients with the same access token share its budget.
+    await same_client._wait_for_rate_limit()
+    assert clock.sleeps == [1]
+
+    stats = rate_limiter.stats()
+    assert list(stats) == ["...bbbbbb", "...aaaaaa"]
+    assert stats["...aaaaaa"].num_acquired == 2
+    assert stats["...bbbbbb"].num_acquired == 1
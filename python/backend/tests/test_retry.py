@@ -0,0 +1,140 @@
+import pytest
+from vk.errors import (
+    NetworkError,
+    RateLimitError,
+    RequestValidationError,
+    TransientError,
+    with_transient_error_retry,
+)
+from vk.retry import (
+    BACKGROUND_RETRY_POLICY,
+    INTERACTIVE_RETRY_POLICY,
+    ConstantBackoff,
+    ExponentialBackoff,
+    RetryPolicy,
+)
+
+pytestmark = pytest.mark.anyio
+
+
+def test_exponential_backoff_grows_up_to_the_max():
+    backoff = ExponentialBackoff(
+        base_n_seconds=1,
+        multiplier=2,
+        max_n_seconds=5,
+        jitter=False,
+    )
+
+    assert [backoff.delay_n_seconds(attempt) for attempt in range(1, 6)] == [
+        1,
+        2,
+        4,
+        5,
+        5,
+    ]
+
+
+def test_exponential_backoff_jitters_below_the_delay():
+    backoff = ExponentialBackoff(base_n_seconds=1, multiplier=2, max_n_seconds=5)
+
+    for attempt in range(1, 10):
+        delay = backoff.delay_n_seconds(attempt)
+        assert 0 <= delay <= min(5, 2 ** (attempt - 1))
+
+
+def test_policy_gives_up_after_max_attempts():
+    policy = RetryPolicy(backoff=ConstantBackoff(1), max_attempts=3)
+
+    assert policy.next_delay_n_seconds(attempt=2, elapsed_n_seconds=0) == 1
+    assert policy.next_delay_n_seconds(attempt=3, elapsed_n_seconds=0) is None
+
+
+def test_policy_gives_up_past_the_deadline():
+    policy = RetryPolicy(
+        backoff=ConstantBackoff(2),
+        max_attempts=None,
+        deadline_n_seconds=10,
+    )
+
+    assert policy.next_delay_n_seconds(attempt=100, elapsed_n_seconds=8) == 2
+    assert policy.next_delay_n_seconds(attempt=100, elapsed_n_seconds=8.5) is None
+
+
+def test_policy_waits_at_least_retry_after():
+    policy = RetryPolicy(backoff=ConstantBackoff(0.1))
+
+    delay = policy.next_delay_n_seconds(
+        attempt=1,
+        elapsed_n_seconds=0,
+        retry_after_n_seconds=0.7,
+    )
+
+    assert delay == 0.7
+
+
+def test_predefined_policies():
+    # NB: Users wait for interactive requests, background jobs can take their time.
+    assert INTERACTIVE_RETRY_POLICY.max_attempts is not None
+    assert INTERACTIVE_RETRY_POLICY.deadline_n_seconds is not None
+    assert BACKGROUND_RETRY_POLICY.max_attempts is None
+    assert BACKGROUND_RETRY_POLICY.deadline_n_seconds is not None
+    assert (
+        BACKGROUND_RETRY_POLICY.deadline_n_seconds
+        > INTERACTIVE_RETRY_POLICY.deadline_n_seconds
+    )
+
+
+# --------------------------------------------------------------------------------------------------
+
+
+async def test_retries_transient_errors_until_success():
+    errors: list[TransientError | None] = []
+
+    async def action(error: TransientError | None) -> str:
+        errors.append(error)
+        if len(errors) < 3:
+            raise NetworkError("reset")
+        return "ok"
+
+    result = await with_transient_error_retry(
+        action,
+        policy=RetryPolicy(backoff=ConstantBackoff(0)),
+    )
+
+    assert result == "ok"
+    assert errors[0] is None
+    assert all(isinstance(error, NetworkError) for error in errors[1:])
+
+
+async def test_raises_the_last_transient_error_when_giving_up():
+    num_attempts = 0
+
+    async def action(_error: TransientError | None) -> str:
+        nonlocal num_attempts
+        num_attempts += 1
+        raise RateLimitError("slow down", response=None, retry_after_n_seconds=0)
+
+    with pytest.raises(RateLimitError):
+        await with_transient_error_retry(
+            action,
+            policy=RetryPolicy(backoff=ConstantBackoff(0), max_attempts=4),
+        )
+
+    assert num_attempts == 4
+
+
+async def test_doesnt_retry_other_errors():
+    num_attempts = 0
+
+    async def action(_error: TransientError | None) -> str:
+        nonlocal num_attempts
+        num_attempts += 1
+        raise RequestValidationError("bad request", response=None)
+
+    with pytest.raises(RequestValidationError):
+        await with_transient_error_retry(
+            action,
+            policy=RetryPolicy(backoff=ConstantBackoff(0)),
+        )
+
+    assert num_attempts == 1
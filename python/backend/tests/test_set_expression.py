@@ -0,0 +1,187 @@
+from pathlib import Path
+
+import numpy as np
+import pytest
+from memberships import (
+    MemberIdsSnapshot,
+    MembershipIndex,
+    MembershipStorage,
+    SetExpression,
+    set_expression,
+)
+from pydantic import TypeAdapter, ValidationError
+
+_expression_adapter: TypeAdapter[SetExpression] = TypeAdapter(SetExpression)
+
+# NB: "Members of 1 and 2 but not 3, or in at least 2 of 1, 3 and 4".
+_EXPRESSION = {
+    "type": "UNION",
+    "operands": [
+        {
+            "type": "DIFFERENCE",
+            "left": {
+                "type": "INTERSECTION",
+                "operands": [
+                    {"type": "GROUP", "group_id": 1},
+                    {"type": "GROUP", "group_id": 2},
+                ],
+            },
+            "right": {"type": "GROUP", "group_id": 3},
+        },
+        {
+            "type": "AT_LEAST",
+            "k": 2,
+            "operands": [
+                {"type": "GROUP", "group_id": 1},
+                {"type": "GROUP", "group_id": 3},
+                {"type": "GROUP", "group_id": 4},
+            ],
+        },
+    ],
+}
+
+_MEMBER_IDS = {
+    1: [1, 2, 3, 4, 5],
+    2: [2, 3, 4, 10],
+    3: [3, 5, 11],
+    4: [1, 11, 12],
+}
+
+
+class _MembershipStorage:
+    def __init__(self) -> None:
+        self.members_versions = {group_id: 1 for group_id in _MEMBER_IDS}
+        self.member_sets: dict[str, tuple[list[int], np.ndarray]] = {}
+        self.num_written_member_sets = 0
+
+    async def list_members_versions(self, group_ids: list[int]) -> dict[int, int]:
+        return {group_id: self.members_versions[group_id] for group_id in group_ids}
+
+    async def read_member_ids(self, group_id: int) -> MemberIdsSnapshot:
+        return MemberIdsSnapshot(
+            members_version=self.members_versions[group_id],
+            user_ids=np.array(_MEMBER_IDS[group_id], dtype=np.uint32),
+        )
+
+    async def read_member_set(
+        self,
+        expression_fingerprint: str,
+        members_versions: list[int],
+    ) -> np.ndarray | None:
+        stored = self.member_sets.get(expression_fingerprint)
+        if not stored or stored[0] != members_versions:
+            return None
+
+        return stored[1]
+
+    async def write_member_set(
+        self,
+        expression_fingerprint: str,
+        _group_ids: list[int],
+        members_versions: list[int],
+        user_ids: np.ndarray,
+    ) -> None:
+        self.member_sets[expression_fingerprint] = (members_versions, user_ids)
+        self.num_written_member_sets += 1
+
+
+# --------------------------------------------------------------------------------------------------
+
+
+def test_round_trips_through_json():
+    expression = _expression_adapter.validate_python(_EXPRESSION)
+
+    json = _expression_adapter.dump_json(expression)
+
+    assert _expression_adapter.validate_json(json) == expression
+    assert _expression_adapter.dump_python(expression) == _EXPRESSION
+
+
+def test_lists_group_ids_in_the_order_of_appearance():
+    expression = _expression_adapter.validate_python(_EXPRESSION)
+
+    assert set_expression.list_group_ids(expression) == [1, 2, 3, 4]
+    assert set_expression.count_nodes(expression) == 10
+
+
+def test_evaluates_over_member_ids():
+    expression = _expression_adapter.validate_python(_EXPRESSION)
+    member_ids = {
+        group_id: np.array(ids, dtype=np.uint32)
+        for group_id, ids in _MEMBER_IDS.items()
+    }
+
+    result = set_expression.evaluate(expression, member_ids)
+
+    groups = {group_id: set(ids) for group_id, ids in _MEMBER_IDS.items()}
+    at_least_2 = {
+        id
+        for id in groups[1] | groups[3] | groups[4]
+        if (id in groups[1]) + (id in groups[3]) + (id in groups[4]) >= 2
+    }
+    expected = ((groups[1] & groups[2]) - groups[3]) | at_least_2
+    assert result.tolist() == sorted(expected)
+
+
+@pytest.mark.parametrize(
+    "expression",
+    [
+        {"type": "UNION", "operands": []},
+        {"type": "AT_LEAST", "k": 0, "operands": [{"type": "GROUP", "group_id": 1}]},
+        {"type": "AT_LEAST", "k": 2, "operands": [{"type": "GROUP", "group_id": 1}]},
+        {"type": "COMPLEMENT", "operand": {"type": "GROUP", "group_id": 1}},
+    ],
+)
+def test_rejects_invalid_expressions(expression: dict):
+    with pytest.raises(ValidationError):
+        _expression_adapter.validate_python(expression)
+
+
+def test_fingerprints_equal_expressions_the_same():
+    expression = _expression_adapter.validate_python(_EXPRESSION)
+    reordered = _expression_adapter.validate_python(
+        {**_EXPRESSION, "operands": _EXPRESSION["operands"][::-1]}
+    )
+
+    assert set_expression.fingerprint(expression) == set_expression.fingerprint(
+        _expression_adapter.validate_json(_expression_adapter.dump_json(expression))
+    )
+    assert set_expression.fingerprint(expression) != set_expression.fingerprint(
+        reordered
+    )
+
+
+@pytest.mark.anyio
+async def test_stores_evaluated_expressions_until_their_groups_change(tmp_path: Path):
+    storage = _MembershipStorage()
+    index = MembershipIndex(storage, data_dir=tmp_path)  # type: ignore
+    expression = _expression_adapter.validate_python(_EXPRESSION)
+
+    assert (await index.evaluate(expression)).tolist() == [1, 2, 3, 4, 5, 11]
+    # NB: The next pages of the same audience.
+    assert (await index.evaluate(expression)).tolist() == [1, 2, 3, 4, 5, 11]
+    assert storage.num_written_member_sets == 1
+
+    storage.members_versions[4] = 2
+    await index.evaluate(expression)
+    assert storage.num_written_member_sets == 2
+
+    # NB: A single group is its own result.
+    await index.evaluate(
+        _expression_adapter.validate_python({"type": "GROUP", "group_id": 3})
+    )
+    assert storage.num_written_member_sets == 2
+
+
+@pytest.mark.anyio
+async def test_round_trips_stored_member_sets(pg_pool):
+    storage = MembershipStorage(pg_pool)
+    user_ids = np.array([1, 5, 2**32 - 1], dtype=np.uint32)
+
+    await storage.write_member_set("fingerprint", [3, 1], [2, 1], user_ids)
+
+    stored = await storage.read_member_set("fingerprint", [2, 1])
+    assert stored is not None
+    assert stored.tolist() == user_ids.tolist()
+    assert await storage.read_member_set("fingerprint", [2, 2]) is None
+    assert await storage.read_member_set("other", [2, 1]) is None
@@ -0,0 +1,95 @@
+import numpy as np
+import pytest
+from memberships import set_ops
+from memberships.set_ops import (
+    MAX_NUM_PAIRWISE_ARRAYS,
+    at_least_k_sorted,
+    count_pairwise_intersections,
+    difference_sorted,
+    intersect_sorted,
+    union_sorted,
+)
+
+
+def _random_arrays(seed: int, num_arrays: int = 5) -> list[np.ndarray]:
+    rng = np.random.default_rng(seed)
+    return [
+        np.unique(rng.integers(1, 500, size=rng.integers(0, 300), dtype=np.uint32))
+        for _ in range(num_arrays)
+    ]
+
+
+def _to_sets(arrays: list[np.ndarray]) -> list[set[int]]:
+    return [set(array.tolist()) for array in arrays]
+
+
+# --------------------------------------------------------------------------------------------------
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_matches_python_sets(seed: int):
+    arrays = _random_arrays(seed)
+    sets = _to_sets(arrays)
+
+    assert intersect_sorted(arrays).tolist() == sorted(set.intersection(*sets))
+    assert union_sorted(arrays).tolist() == sorted(set.union(*sets))
+    assert difference_sorted(arrays[0], arrays[1]).tolist() == sorted(sets[0] - sets[1])
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_counts_ids_present_in_at_least_k_arrays(seed: int):
+    arrays = _random_arrays(seed)
+    sets = _to_sets(arrays)
+
+    for k in range(len(arrays) + 2):
+        expected = sorted(
+            id for id in set.union(*sets) if sum(id in s for s in sets) >= k
+        )
+        assert at_least_k_sorted(arrays, k).tolist() == expected
+
+
+def test_handles_empty_inputs():
+    ids = np.array([1, 2, 3], dtype=np.uint32)
+    empty = np.empty(0, dtype=np.uint32)
+
+    assert intersect_sorted([]).tolist() == []
+    assert intersect_sorted([ids, empty]).tolist() == []
+    assert union_sorted([]).tolist() == []
+    assert union_sorted([empty, ids]).tolist() == [1, 2, 3]
+    assert difference_sorted(ids, empty).tolist() == [1, 2, 3]
+    assert difference_sorted(empty, ids).tolist() == []
+
+
+def test_doesnt_match_ids_past_the_end_of_other_arrays():
+    left = np.array([5, 10, 20], dtype=np.uint32)
+    right = np.array([1, 5], dtype=np.uint32)
+
+    assert intersect_sorted([left, right]).tolist() == [5]
+    assert difference_sorted(left, right).tolist() == [10, 20]
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_counts_pairwise_intersections(seed: int):
+    arrays = _random_arrays(seed, num_arrays=8)
+
+    result = count_pairwise_intersections(arrays)
+
+    for i, left in enumerate(arrays):
+        for j, right in enumerate(arrays):
+            assert result[i, j] == len(intersect_sorted([left, right]))
+
+
+def test_counts_pairwise_intersections_of_many_ids(monkeypatch):
+    # NB: More distinct bitmasks than fit into a single chunk.
+    monkeypatch.setattr(set_ops, "_PAIRWISE_CHUNK_SIZE", 16)
+    arrays = _random_arrays(0, num_arrays=MAX_NUM_PAIRWISE_ARRAYS)
+    arrays[-1] = np.array([0, 2**32 - 1], dtype=np.uint32)
+
+    result = count_pairwise_intersections(arrays)
+
+    assert result.tolist() == [
+        [len(intersect_sorted([left, right])) for right in arrays] for left in arrays
+    ]
+    assert count_pairwise_intersections([]).shape == (0, 0)
+    with pytest.raises(ValueError):
+        count_pairwise_intersections(arrays + [arrays[0]])
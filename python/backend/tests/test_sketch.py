@@ -0,0 +1,116 @@
+import numpy as np
+import pytest
+from memberships.sketch import (
+    SKETCH_SIZE,
+    build_sketch,
+    decode_sketch,
+    encode_sketch,
+    estimate_num_members,
+    estimate_overlap,
+    estimate_pairwise_overlaps,
+)
+
+
+def _user_ids(start: int, stop: int) -> np.ndarray:
+    return np.arange(start, stop, dtype=np.uint32)
+
+
+# --------------------------------------------------------------------------------------------------
+
+
+def test_keeps_the_smallest_hashes():
+    sketch = build_sketch(_user_ids(1, 10_000))
+    full_sketch = build_sketch(_user_ids(1, SKETCH_SIZE // 2))
+
+    assert len(sketch) == SKETCH_SIZE
+    assert np.all(np.diff(sketch) > 0)
+    # NB: Hashes of a subset are a subset of the hashes.
+    assert np.isin(full_sketch, build_sketch(_user_ids(1, SKETCH_SIZE))).all()
+    assert decode_sketch(encode_sketch(sketch)).tolist() == sketch.tolist()
+
+
+def test_counts_small_groups_exactly():
+    assert estimate_num_members(build_sketch(_user_ids(1, 1))) == 0
+    assert estimate_num_members(build_sketch(_user_ids(1, 101))) == 100
+
+
+@pytest.mark.parametrize("num_members", [5_000, 100_000, 1_000_000])
+def test_estimates_the_number_of_members(num_members: int):
+    rng = np.random.default_rng(num_members)
+    user_ids = rng.choice(10**9, size=num_members, replace=False).astype(np.uint32)
+
+    estimate = estimate_num_members(build_sketch(user_ids))
+
+    # NB: ~3% standard error, see `sketch.py`.
+    assert estimate == pytest.approx(num_members, rel=0.1)
+
+
+def test_estimates_overlaps_of_small_groups_exactly():
+    estimate = estimate_overlap(
+        [build_sketch(_user_ids(1, 101)), build_sketch(_user_ids(51, 201))]
+    )
+
+    assert estimate.is_exact
+    assert estimate.num_union_members == 200
+    assert estimate.num_intersection_members == 50
+    assert estimate.jaccard == 0.25
+
+
+def test_estimates_overlaps_of_large_groups():
+    # NB: 100k members each, 50k shared, so the union is 150k and the Jaccard is 1/3.
+    estimate = estimate_overlap(
+        [
+            build_sketch(_user_ids(1, 100_001)),
+            build_sketch(_user_ids(50_001, 150_001)),
+        ]
+    )
+
+    assert not estimate.is_exact
+    assert estimate.num_union_members == pytest.approx(150_000, rel=0.1)
+    assert estimate.jaccard == pytest.approx(1 / 3, abs=0.05)
+    assert estimate.num_intersection_members == pytest.approx(50_000, rel=0.2)
+
+
+def test_estimates_no_overlap_of_disjoint_groups():
+    estimate = estimate_overlap(
+        [
+            build_sketch(_user_ids(1, 100_001)),
+            build_sketch(_user_ids(100_001, 200_001)),
+        ]
+    )
+
+    assert estimate.num_intersection_members == 0
+    assert estimate_overlap([]).num_union_members == 0
+
+
+def test_estimates_pairwise_overlaps_like_overlaps_of_pairs():
+    sketches = [
+        build_sketch(_user_ids(1, 101)),
+        build_sketch(_user_ids(51, 201)),
+        build_sketch(_user_ids(1, 100_001)),
+        build_sketch(_user_ids(50_001, 150_001)),
+    ]
+
+    estimate = estimate_pairwise_overlaps(sketches)
+
+    assert not estimate.is_exact
+    assert estimate.num_members.tolist() == [
+        estimate_num_members(sketch) for sketch in sketches
+    ]
+    # NB: Small groups are sketched in full.
+    assert estimate.num_intersection_members[0, 1] == 50
+    assert estimate.jaccard[0, 1] == 0.25
+    # NB: Tiny shares of the union are noisy, but never exceed the smaller group.
+    assert estimate.num_intersection_members[0, 2] <= 100
+    assert estimate.jaccard[2, 3] == pytest.approx(1 / 3, abs=0.05)
+    assert estimate.num_intersection_members[2, 3] == pytest.approx(50_000, rel=0.2)
+    assert np.allclose(estimate.jaccard, estimate.jaccard.T)
+
+
+def test_estimates_exact_pairwise_overlaps_of_small_groups():
+    estimate = estimate_pairwise_overlaps(
+        [build_sketch(_user_ids(1, 101)), build_sketch(_user_ids(51, 201))]
+    )
+
+    assert estimate.is_exact
+    assert estimate.num_intersection_members.tolist() == [[100, 50], [50, 150]]
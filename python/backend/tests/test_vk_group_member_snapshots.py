@@ -0,0 +1,42 @@
+import numpy as np
+import pytest
+from postgres.vk_group_member_snapshots import (
+    ENCODING_DELTA_SHUFFLE_ZLIB,
+    decode_user_ids,
+    encode_user_ids,
+)
+
+
+@pytest.mark.parametrize(
+    "user_ids",
+    [
+        [],
+        [1],
+        [1, 2, 3, 5, 8, 13],
+        # NB: The whole `uint32` range.
+        [7, 2**31 - 1, 2**31, 2**32 - 1],
+    ],
+)
+def test_round_trips_user_ids(user_ids: list[int]):
+    data = encode_user_ids(np.array(user_ids, dtype=np.uint32))
+
+    decoded = decode_user_ids(ENCODING_DELTA_SHUFFLE_ZLIB, data)
+
+    assert decoded.dtype == np.uint32
+    assert decoded.tolist() == user_ids
+
+
+def test_round_trips_large_sparse_groups():
+    rng = np.random.default_rng(0)
+    user_ids = np.unique(rng.integers(1, 10**9, size=100_000, dtype=np.uint32))
+
+    data = encode_user_ids(user_ids)
+
+    assert np.array_equal(decode_user_ids(ENCODING_DELTA_SHUFFLE_ZLIB, data), user_ids)
+    # NB: Deltas of sorted ids have mostly zero high bytes, which compress well.
+    assert len(data) < user_ids.nbytes * 0.9
+
+
+def test_rejects_unknown_encodings():
+    with pytest.raises(ValueError):
+        decode_user_ids("RAW", encode_user_ids(np.array([1], dtype=np.uint32)))
@@ -0,0 +1,29 @@
+import postgres
+import pytest
+import vk
+
+pytestmark = pytest.mark.anyio
+
+
+def _group(id: int, name: str) -> vk.groups.GroupById:
+    return vk.groups.GroupById(
+        id=id,
+        name=name,
+        screen_name=f"club{id}",
+        members_count=10,
+    )
+
+
+async def test_upserts_groups_resolved_from_several_urls(pg_pool):
+    await postgres.vk_groups.upsert_only_vk_data(
+        pg_pool,
+        groups=[_group(1, "old"), _group(2, "other"), _group(1, "new")],
+    )
+    await postgres.vk_groups.upsert_only_vk_data(pg_pool, groups=[_group(2, "renamed")])
+
+    groups = await postgres.vk_groups.list_by_ids(pg_pool, group_ids=[1, 2])
+
+    assert sorted((group.id, group.name) for group in groups) == [
+        (1, "new"),
+        (2, "renamed"),
+    ]